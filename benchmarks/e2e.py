@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Measures the client end to end against the local emulator.
+
+Downloads a generated account with Paperwork.download, pushes changed
+notes with update, reconciles, searches locally and remotely and moves and
+deletes notes in bulk. Every scenario is run repeat times on a fresh
+emulator, the fastest run is kept. Results are printed and written as json
+to output, and compared to the json of an earlier run given as baseline.
+
+    python benchmarks/e2e.py --notes 10000 --latency 0.005 --output new.json
+    python benchmarks/e2e.py --baseline new.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from paperworks import emulator, models, wrapper
+
+queries = ['milk', 'bread meeting', '"paper work"', 'ide*']
+
+
+def bulk(notes, chunk_size, send):
+    """Sends notes grouped by notebook in chunks of chunk_size with
+    send(chunk), where chunk are the notes as json."""
+    by_notebook = {}
+    for note in notes:
+        by_notebook.setdefault(note.notebook.id, []).append(note)
+    for nb_notes in by_notebook.values():
+        for start in range(0, len(nb_notes), chunk_size):
+            send([note.to_json()
+                  for note in nb_notes[start:start + chunk_size]])
+
+
+def scenarios(pw, args):
+    """Yields names and functions of the scenarios, which run in order on
+    the same account."""
+    yield 'download', lambda: pw.download(args.workers, stream=True)
+
+    def update():
+        for i, note in enumerate(pw.get_notes()[:args.changes]):
+            note.title = 'changed {}'.format(i)
+        pw.update()
+    yield 'update', update
+    yield 'reconcile', lambda: pw.reconcile(workers=args.workers)
+
+    def search_local():
+        for query in queries:
+            pw.search(query, limit=20)
+    yield 'search_local', search_local
+
+    def search_remote():
+        for query in queries[:1]:
+            pw.search(query, remote=True)
+    yield 'search_remote', search_remote
+
+    def move():
+        notebooks = pw.get_notebooks()
+        target = notebooks[-1]
+        notes = [note for nb in notebooks[:-1]
+                 for note in nb.get_notes()][:args.changes]
+        bulk(notes, args.chunk_size,
+             lambda chunk: pw.api.move_notes(chunk, target.id))
+        for note in notes:
+            note.notebook.remove_note(note)
+            target.add_note(note)
+    yield 'move', move
+
+    def delete():
+        notes = pw.get_notes()[:args.changes]
+        bulk(notes, args.chunk_size, pw.api.delete_notes)
+        for note in notes:
+            note.notebook.remove_note(note)
+    yield 'delete', delete
+
+
+def run(args):
+    """Runs all scenarios once on a fresh emulator and returns their
+    results by name.
+
+    :rtype: dict
+    """
+    dataset = emulator.Dataset.generate(
+        args.notebooks, args.notes, args.tags, args.content_size)
+    server = emulator.Emulator(dataset, latency=args.latency,
+                               error_rate=args.error_rate).start()
+    try:
+        pool = wrapper.ConnectionPool(args.workers) if args.workers else None
+        pw = models.Paperwork(server.user, server.passwd, server.host, pool)
+        results = {}
+        for name, scenario in scenarios(pw, args):
+            pw.api.monitor.reset()
+            requests = server.requests
+            start = time.time()
+            scenario()
+            seconds = time.time() - start
+            metrics = pw.api.metrics().values()
+            results[name] = {
+                'seconds': seconds,
+                'requests': server.requests - requests,
+                'errors': sum(endpoint['errors'] for endpoint in metrics),
+                'bytes_received': sum(endpoint['bytes_received']
+                                      for endpoint in metrics)
+                }
+        return results
+    finally:
+        server.stop()
+
+
+def compare(results, baseline, tolerance):
+    """Prints results next to baseline and returns the names of scenarios
+    slower by more than tolerance.
+
+    :type results: dict
+    :type baseline: dict
+    :param float tolerance: Allowed slowdown, 0.2 for 20 percent.
+    :rtype: list
+    """
+    regressions = []
+    print('{:<15} {:>10} {:>10} {:>8}'.format(
+        'scenario', 'baseline', 'now', 'ratio'))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        ratio = result['seconds'] / before if before else 1.0
+        print('{:<15} {:>10.3f} {:>10.3f} {:>8.2f}'.format(
+            name, before, result['seconds'], ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the client against a local emulator.')
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--notebooks', type=int, default=50)
+    parser.add_argument('--tags', type=int, default=20)
+    parser.add_argument('--content-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every response is delayed')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests failing')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--changes', type=int, default=100,
+                        help='notes updated, moved and deleted')
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as json to path')
+    parser.add_argument('--baseline', help='compare to results at path')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown to baseline reported as regression')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = {}
+    for _ in range(args.repeat):
+        for name, result in run(args).items():
+            if name not in results or \
+                    result['seconds'] < results[name]['seconds']:
+                results[name] = result
+    for name, result in sorted(results.items()):
+        print('{:<15} {seconds:>8.3f}s {requests:>6} requests '
+              '{errors:>4} errors'.format(name, **result))
+
+    if args.output:
+        config = dict((key, value) for key, value in vars(args).items()
+                      if key not in ('output', 'baseline', 'tolerance'))
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2,
+                      sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'],
+                                  args.tolerance)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
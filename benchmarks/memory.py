@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Measures the memory used per loaded note.
+
+Loads notes from prepared json into a Paperwork instance the way a
+download does, with titles, tags and timestamps repeating like in real
+accounts, drops the json and prints the bytes kept per note. They include
+the content, the search and title indexes and the sorted views of the
+instance, its notebooks and tags.
+
+    python benchmarks/memory.py --notes 100000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from paperworks import emulator, models
+
+
+def prepare(count, notebooks=50, tags=20):
+    """Returns json of notebooks, tags and count notes in the format of
+    the host."""
+    tags_json = [{'id': i, 'title': 'tag {}'.format(i), 'visibility': 0}
+                 for i in range(1, tags + 1)]
+    notebooks_json = [{'id': i, 'title': 'notebook {}'.format(i), 'type': 0,
+                       'updated_at': '2014-09-20 19:43:59'}
+                      for i in range(1, notebooks + 1)]
+    notes_json = dict((nb['id'], []) for nb in notebooks_json)
+    for i in range(count):
+        notebook_id = i % notebooks + 1
+        notes_json[notebook_id].append({
+            'id': i + 1,
+            # Titles and contents come from separately decoded json, so
+            # equal values are distinct string objects.
+            'title': ''.join(['note ', str(i % 1000)]),
+            'content': ''.join(['content of note ', str(i)]),
+            'notebook_id': notebook_id,
+            'updated_at': ''.join(['2014-09-', str(10 + i % 20),
+                                   ' 19:43:59']),
+            'tags': [tags_json[i % tags], tags_json[(i * 7) % tags]]})
+    return tags_json, notebooks_json, notes_json
+
+
+def connect():
+    """Returns a Paperwork instance authenticated against an empty local
+    emulator, which is stopped again.
+
+    :rtype: models.Paperwork
+    """
+    server = emulator.Emulator().start()
+    try:
+        return models.Paperwork(server.user, server.passwd, server.host)
+    finally:
+        server.stop()
+
+
+def measure(count, notebooks=50, tags=20):
+    """Returns the bytes per note kept after loading count notes in
+    notebooks with tags and dropping the json they were loaded from.
+
+    :type count: int
+    :type notebooks: int
+    :type tags: int
+    :rtype: float
+    """
+    pw = connect()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tags_json, notebooks_json, notes_json = prepare(count, notebooks, tags)
+    pw.load_tags(tags_json)
+    for notebook in pw.load_notebooks(notebooks_json):
+        notebook.load(notes_json[notebook.id], pw.tags)
+    del(tags_json, notebooks_json, notes_json)
+    # Views sort notes added in bulk on first access.
+    pw.get_notes()
+    for model in list(pw.notebooks.values()) + list(pw.tags.values()):
+        model.get_notes()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return float(used) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures the memory used per loaded note.')
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--notebooks', type=int, default=50)
+    parser.add_argument('--tags', type=int, default=20)
+    args = parser.parse_args()
+    print('{} notes: {:.0f} bytes per note'.format(
+        args.notes, measure(args.notes, args.notebooks, args.tags)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Measures the startup of the command line client.
+
+Times importing paperworks.cli in a fresh interpreter and lists the slow
+modules it loaded eagerly. Then starts the client against a generated
+account on the local emulator and times the first prompt and the first
+command needing all notes, ls. Every measurement is repeated, the fastest
+run is kept.
+
+    python benchmarks/startup.py --notes 20000 --latency 0.005
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+from paperworks import emulator
+
+# Modules no command needs before the first prompt.
+deferred = ['yaml', 'argparse', 'fuzzywuzzy', 'sqlite3',
+            'paperworks.cache', 'paperworks.httpcache',
+            'paperworks.snapshot']
+
+measure_import = '''
+import sys, time
+start = time.time()
+import paperworks.cli
+print(time.time() - start)
+print(' '.join(sorted(name for name in {} if name in sys.modules)))
+'''.format(deferred)
+
+
+def time_import():
+    """Returns the seconds importing paperworks.cli took and the
+    deferred modules it loaded.
+
+    :rtype: float and list
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', measure_import], cwd=root,
+        stderr=subprocess.DEVNULL).decode('UTF-8').splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+def read_prompt(process):
+    """Reads the output of process until it prompts for a command."""
+    output = b''
+    while not output.endswith(b'>'):
+        chunk = os.read(process.stdout.fileno(), 64 * 1024)
+        if not chunk:
+            raise RuntimeError('Client exited: {}'.format(output[-200:]))
+        output += chunk
+
+
+def time_session(server, workers):
+    """Runs the client against server and returns the seconds until its
+    first prompt and until the notes are listed.
+
+    :type server: emulator.Emulator
+    :type workers: int
+    :rtype: float and float
+    """
+    home = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(home, '.paperworkrc'), 'w') as f:
+            f.write('host: {}\nuser: {}\npass: {}\n'.format(
+                server.host, server.user, server.passwd))
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'paperworks.cli',
+             '--workers', str(workers)],
+            cwd=root, env=dict(os.environ, HOME=home),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        try:
+            read_prompt(process)
+            prompt = time.time() - start
+            process.stdin.write(b'ls\n')
+            process.stdin.flush()
+            read_prompt(process)
+            ready = time.time() - start
+            process.stdin.write(b'exit\n')
+            process.stdin.flush()
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        return prompt, ready
+    finally:
+        shutil.rmtree(home)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the startup of the command line client.')
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--notebooks', type=int, default=50)
+    parser.add_argument('--content-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every response is delayed')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    imports = [time_import() for _ in range(args.repeat)]
+    print('{:<15} {:>8.3f}s'.format('import', min(
+        seconds for seconds, _ in imports)))
+    if imports[0][1]:
+        print('Loaded eagerly: {}'.format(', '.join(imports[0][1])))
+
+    server = emulator.Emulator(emulator.Dataset.generate(
+        args.notebooks, args.notes, content_size=args.content_size),
+        latency=args.latency).start()
+    try:
+        sessions = [time_session(server, args.workers)
+                    for _ in range(args.repeat)]
+    finally:
+        server.stop()
+    print('{:<15} {:>8.3f}s'.format('first prompt', min(
+        prompt for prompt, _ in sessions)))
+    print('{:<15} {:>8.3f}s'.format('notes listed', min(
+        ready for _, ready in sessions)))
+
+
+if __name__ == '__main__':
+    main()
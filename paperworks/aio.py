@@ -0,0 +1,738 @@
+# License: MIT
+"""asyncio variant of the api wrapper.
+
+Every endpoint method of wrapper.api is available on AsyncApi and returns
+a coroutine, e.g.::
+
+    api = AsyncApi(concurrency=20)
+    await api.basic_authentication(host, user, passwd)
+    notes = await asyncio.gather(*[api.list_notebook_notes(nb['id'])
+                                   for nb in await api.list_notebooks()])
+
+iter_notebook_notes and iter_search return async generators, which parse
+the body while it is received. Files, the blob store and the version
+store are used in the default executor, so they do not block the loop.
+
+Needs Python 3.6 or later, unlike the rest of the package.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from functools import partial
+from http.client import responses
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+from paperworks import wrapper
+
+logger = logging.getLogger(__name__)
+
+
+class Pending(Exception):
+    """Raised by Feed.read while no data is buffered."""
+
+
+class Feed:
+    def __init__(self):
+        """File-like buffer of the parts of a body received so far, to
+        read it with wrapper.JsonReader without blocking. read raises
+        Pending instead of waiting for more data."""
+        self.buffer = b''
+        self.eof = False
+
+    def feed(self, data):
+        """Adds data to the buffer, the end of the body if empty.
+
+        :type data: bytes
+        """
+        if data:
+            self.buffer += data
+        else:
+            self.eof = True
+
+    def read(self, amt=None):
+        if not self.buffer and not self.eof:
+            raise Pending()
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+
+async def iter_response(response, chunk_size=64 * 1024):
+    """Parses the json body of a response of the host while it is
+    received and yields the items of its response array one at a time,
+    like wrapper.iter_response.
+
+    Raises ValueError for invalid json and unsuccessful requests.
+
+    :type response: Response
+    :param int chunk_size: Bytes read at once.
+    """
+    feed = Feed()
+    reader = wrapper.JsonReader(feed, chunk_size)
+
+    async def parse(method, *args):
+        # The reader keeps its position if data runs out, so method is
+        # retried once more is received.
+        while True:
+            try:
+                return method(*args)
+            except Pending:
+                feed.feed(await response.read(chunk_size))
+
+    await parse(reader.expect, '{')
+    if await parse(reader.peek) == '}':
+        return
+    while True:
+        key = await parse(reader.value)
+        await parse(reader.expect, ':')
+        if key == 'response' and await parse(reader.peek) == '[':
+            await parse(reader.expect, '[')
+            if await parse(reader.peek) == ']':
+                await parse(reader.expect, ']')
+            else:
+                while True:
+                    yield await parse(reader.value)
+                    if await parse(reader.expect, ',]') == ']':
+                        break
+        else:
+            value = await parse(reader.value)
+            if key == 'success' and value is False:
+                raise ValueError('Unsuccessful request.')
+            if key == 'response':
+                yield value
+        if await parse(reader.expect, ',}') == '}':
+            return
+
+
+class Response:
+    def __init__(self, status, headers, reader, timeout, finish,
+                 chunk_size=64 * 1024):
+        """Response of the host whose body is received while it is read
+        and decompressed if the host sent it with a content coding.
+        finish is called once with the bytes received, whether receiving
+        failed and whether the connection can be reused, after the body
+        was received completely or the response was closed.
+
+        :type status: int
+        :param dict headers: Headers with lowercase names.
+        :type reader: asyncio.StreamReader
+        :param timeout: Seconds the host may take to send the next part
+                        of the body, None disables.
+        :type timeout: int or float or None
+        :type finish: callable
+        :param int chunk_size: Bytes received at once.
+        """
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._timeout = timeout
+        self._finish = finish
+        self._chunk_size = chunk_size
+        self._decoder = wrapper.decompressor(headers.get('content-encoding'))
+        self._chunked = \
+            headers.get('transfer-encoding', '').lower() == 'chunked'
+        # Bytes left of the body or of its current chunk, None if the
+        # body ends with the connection.
+        length = headers.get('content-length')
+        self._left = 0 if self._chunked else \
+            int(length) if length is not None else None
+        self._buffer = bytearray()
+        self._received = 0
+        self._eof = False
+        self._done = False
+
+    async def _receive(self):
+        # Returns the next part of the body as sent, b'' at its end.
+        reader = self._reader
+        if self._chunked and not self._left:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return b''
+            self._left = size
+        elif self._left is None:
+            return await reader.read(self._chunk_size)
+        elif not self._left:
+            return b''
+        data = await reader.read(min(self._left, self._chunk_size))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', self._left)
+        self._left -= len(data)
+        if self._chunked and not self._left:
+            await reader.readexactly(2)
+        return data
+
+    def _finished(self, error=False):
+        if not self._done:
+            self._done = True
+            self._finish(
+                self._received, error, self._eof and not error and
+                self._left is not None and
+                self.headers.get('connection', '').lower() != 'close')
+
+    async def read(self, amt=None):
+        """Returns up to amt bytes of the body, all of the rest if amt
+        is None. Returns as soon as some are received, b'' at the end of
+        the body.
+
+        :type amt: int
+        :rtype: bytes
+        """
+        try:
+            while not self._eof and (amt is None or not self._buffer):
+                data = await asyncio.wait_for(self._receive(),
+                                              self._timeout)
+                self._received += len(data)
+                self._eof = not data
+                if self._decoder is None:
+                    self._buffer += data
+                elif data:
+                    self._buffer += self._decoder.decompress(data)
+                else:
+                    self._buffer += self._decoder.flush()
+        except asyncio.TimeoutError:
+            self._finished(True)
+            raise IOError('Receiving the response timed out')
+        except BaseException:
+            self._finished(True)
+            raise
+        if self._eof:
+            self._finished()
+        amt = len(self._buffer) if amt is None else amt
+        data = bytes(self._buffer[:amt])
+        del(self._buffer[:amt])
+        return data
+
+    def close(self):
+        """Closes the response. The connection of a partially received
+        body is closed instead of being reused."""
+        self._finished()
+
+
+class AsyncApi(wrapper.api):
+    def __init__(self, user_agent=wrapper.default_agent, concurrency=10,
+                 timeout=30, pool_size=4, idle_timeout=30, versions=None):
+        """Api instance whose requests are coroutines.
+
+        :param int concurrency: Maximum of requests in flight at once.
+        :param timeout: Seconds the host may take to answer a request or
+                        to send the next part of a response, None
+                        disables.
+        :type timeout: int or float or None
+        :param int pool_size: Idle keep-alive connections kept open.
+        :param idle_timeout: Seconds after which idle connections are
+                             not reused anymore.
+        :type idle_timeout: int or float
+        :param versions: If given fetched note versions are kept there
+                         and never requested again.
+        :type versions: versions.VersionStore
+
+        A request failing on a reused connection is sent again on a new
+        one if it was not sent completely or its method is in
+        wrapper.ConnectionPool.retried_methods.
+        """
+        super().__init__(user_agent, versions=versions)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._semaphore = None
+        self._idle = []
+        # Locks of the attachments being downloaded by uri.
+        self._downloads = {}
+
+    async def basic_authentication(self, host, user, passwd):
+        """Basic authentication with host.
+
+        Returns false if connection fails.
+        :type host: str
+        :type user: str
+        :type passwd: str
+        :rtype: bool
+        """
+        self.set_credentials(host, user, passwd)
+        if await self.request(None, 'GET', 'notebooks'):
+            return True
+        return False
+
+    async def request(self, data, method, keyword, *args, body=None):
+        """Sends a request to the host and returns the parsed json data
+        if successfull. Cancelling the calling task aborts the request.
+
+        :type data: dict
+        :type method: str
+        :type keyword: str
+        :type args: str
+        :param body: Sent instead of data, with its content type and
+                     chunked if its length is unknown.
+        :type body: wrapper.MultipartBody
+        :rtype: dict or None
+        """
+        try:
+            res = await self._fetch(data, method, keyword, *args, body=body)
+            json_res = json.loads(res.decode('UTF-8'))
+            if json_res['success'] is False:
+                logger.error('Unsuccessful request.')
+            else:
+                return json_res['response']
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+
+    async def _fetch(self, data, method, keyword, *args, body=None):
+        # Returns the body of the response, errors are raised.
+        res = await self.open(data, method, keyword, *args, body=body)
+        try:
+            return await res.read()
+        finally:
+            res.close()
+
+    async def open(self, data, method, keyword, *args, headers=None,
+                   body=None):
+        """Sends a request to the host and returns the response, whose
+        body is received while it is read. Error responses raise
+        HTTPError, as with wrapper.api.open. A response holds one of the
+        concurrency slots until it is read completely or closed.
+
+        :type data: dict
+        :type method: str
+        :type keyword: str
+        :type args: str
+        :param dict headers: Headers added to the request.
+        :param body: Sent instead of data, with its content type and
+                     chunked if its length is unknown.
+        :type body: wrapper.MultipartBody
+        :rtype: Response
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if data:
+            data = json.dumps(data).encode('ASCII')
+        path = wrapper.api_version + wrapper.api_path[keyword].format(*args)
+        logger.info('{} request to {} with {}'.format(
+            method, self.host + path,
+            'upload' if body is not None else data))
+        size = len(data) if data else 0
+        await self._semaphore.acquire()
+        start = time.time()
+        try:
+            status, res_headers, reader, writer = await asyncio.wait_for(
+                self._open(method, path, data, body, headers), self.timeout)
+        except BaseException as e:
+            self._semaphore.release()
+            if not isinstance(e, Exception):
+                raise
+            self.monitor.record(method, keyword, time.time() - start,
+                                size if body is None else body.sent,
+                                0, True)
+            if isinstance(e, asyncio.TimeoutError):
+                raise IOError('{} request to {} timed out'.format(
+                    method, path))
+            raise
+
+        def finish(received, error, reusable):
+            self.monitor.record(method, keyword, time.time() - start,
+                                size if body is None else body.sent,
+                                received, error or status >= 400)
+            if reusable:
+                self._release(reader, writer)
+            else:
+                writer.close()
+            self._semaphore.release()
+
+        res = Response(status, res_headers, reader, self.timeout, finish)
+        if status >= 400:
+            try:
+                await res.read()
+            finally:
+                res.close()
+            raise HTTPError(self.host + path, status,
+                            responses.get(status, ''), res_headers, None)
+        return res
+
+    async def stream(self, keyword, *args):
+        """Sends a GET request to the host and yields the items of the
+        response one at a time, as iter_notebook_notes and iter_search
+        do. The body is parsed while it is received, without blocking
+        the loop. Errors are logged and raised, so a failed response is
+        not taken for a complete one.
+
+        :type keyword: str
+        :type args: str
+        """
+        res = None
+        try:
+            res = await self.open(None, 'GET', keyword, *args)
+            async for item in iter_response(res):
+                yield item
+            # Reading up to the end of the body keeps the connection.
+            await res.read()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise
+        finally:
+            if res is not None:
+                res.close()
+
+    async def _connect(self):
+        now = time.time()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and \
+                    not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        url = urlsplit(self.host)
+        reader, writer = await asyncio.open_connection(
+            url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+            ssl=url.scheme == 'https')
+        return reader, writer, False
+
+    def _release(self, reader, writer):
+        if len(self._idle) < self.pool_size:
+            self._idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    async def _open(self, method, path, data, body=None, extra=None):
+        # Returns the status, headers, reader and writer of the response
+        # once its head is received.
+        headers = dict(self.headers, **(extra or {}))
+        if body is None:
+            headers['Content-Length'] = len(data) if data else 0
+        else:
+            headers['Content-Type'] = body.content_type
+            if body.length is None:
+                headers['Transfer-Encoding'] = 'chunked'
+            else:
+                headers['Content-Length'] = body.length
+        head = ['{} {} HTTP/1.1'.format(method, path),
+                'Host: {}'.format(urlsplit(self.host).netloc)]
+        head += ['{}: {}'.format(key, value)
+                 for key, value in headers.items()]
+        message = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + \
+            (data or b'')
+        while True:
+            reader, writer, reused = await self._connect()
+            sent = False
+            try:
+                writer.write(message)
+                if body is not None:
+                    await self._write_body(writer, body)
+                await writer.drain()
+                sent = True
+                status, headers = await self._read_head(reader)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The host may have processed a completely sent request.
+                if not reused or sent and \
+                        method not in wrapper.ConnectionPool.retried_methods:
+                    raise
+                logger.info('Reconnecting stale connection')
+            except BaseException:
+                writer.close()
+                raise
+        if 'content-length' not in headers and \
+                headers.get('transfer-encoding', '').lower() != 'chunked':
+            # The body ends with the connection.
+            headers['connection'] = 'close'
+        return status, headers, reader, writer
+
+    async def _write_body(self, writer, body):
+        # The file is read in the default executor, not in the loop.
+        chunked = body.length is None
+        chunks = iter(body)
+        loop = asyncio.get_event_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            if chunked:
+                chunk = '{:x}\r\n'.format(len(chunk)).encode('ASCII') + \
+                    chunk + b'\r\n'
+            writer.write(chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+
+    async def _read_head(self, reader):
+        line = await reader.readuntil(b'\r\n')
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                return status, headers
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+
+    async def close(self):
+        """Closes idle connections."""
+        idle, self._idle = self._idle, []
+        for reader, writer, last_used in idle:
+            writer.close()
+
+    async def delete_note(self, note):
+        """Delete note.
+
+        :type note: models.Note
+        :rtype: dict
+        """
+        return (await self.delete_notes([note]))[0]
+
+    async def upload_attachment(self, note, attachment, filename=None,
+                                content_type=None, chunk_size=64 * 1024,
+                                progress=None):
+        """Uploads attachment to the latest version of note as
+        multipart/form-data, see wrapper.api.upload_attachment. The file
+        is read in the default executor.
+
+        :type note: models.Note
+        :param attachment: Path or file object opened in binary mode.
+        :type attachment: str or file
+        :type filename: str
+        :type content_type: str
+        :type chunk_size: int
+        :type progress: callable
+        :rtype: dict or None
+        """
+        if isinstance(attachment, str):
+            with open(attachment, 'rb') as fileobj:
+                return await self.upload_attachment(
+                    note, fileobj, filename or os.path.basename(attachment),
+                    content_type, chunk_size, progress)
+        filename = filename or os.path.basename(
+            getattr(attachment, 'name', None) or 'attachment')
+        body = wrapper.MultipartBody(attachment, filename, content_type,
+                                     chunk_size=chunk_size,
+                                     progress=progress)
+        return await self.request(
+            None, 'POST', 'attachments',
+            note['notebook_id'],
+            note['id'],
+            note['versions'][0]['id'],
+            body=body)
+
+    async def upload_attachments(self, note, attachments, workers=4,
+                                 progress=None, **kwargs):
+        """Uploads attachments to note concurrently and returns the
+        responses in order of attachments. Up to concurrency requests
+        are in flight at once, workers is ignored.
+
+        :type note: models.Note
+        :param list attachments: Paths or file objects.
+        :type workers: int
+        :param progress: Called with the attachment, the bytes sent and
+                         the total bytes of its upload.
+        :type progress: callable
+        :param kwargs: Passed to upload_attachment.
+        :rtype: list
+        """
+        return await asyncio.gather(*[
+            self.upload_attachment(
+                note, attachment,
+                progress=progress and partial(progress, attachment),
+                **kwargs)
+            for attachment in attachments])
+
+    async def list_notes_versions(self, notes):
+        """Returns lists of versions of given notes. Listed versions with
+        content are kept in the version store.
+
+        :type notes: list
+        :rtype: list
+        """
+        lists = await self.get('versions', notes[0]['notebook_id'], ','.join(
+            [str(note['id']) for note in notes]))
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._keep_versions, notes, lists)
+        return lists
+
+    async def get_note_version(self, note, version_id):
+        """Returns version with version_id of note, from the version
+        store if it was fetched before.
+
+        :type note: models.Note
+        :type version_id: int
+        :rtype: dict
+        """
+        loop = asyncio.get_event_loop()
+        if self.versions is not None:
+            version = await loop.run_in_executor(
+                None, self.versions.get, note['id'], version_id)
+            if version is not None:
+                return version
+        version = await self.get('version', note['notebook_id'], note['id'],
+                                 version_id)
+        if version is not None and self.versions is not None:
+            await loop.run_in_executor(None, self.versions.put, note['id'],
+                                       version)
+        return version
+
+    async def prefetch_versions(self, notes, workers=4, chunk_size=50):
+        """Fetches all versions of notes missing in the version store,
+        listing them in chunks of chunk_size notes per notebook. Returns
+        the number of versions added to the store. Up to concurrency
+        requests are in flight at once, workers is ignored.
+
+        :type notes: list
+        :type workers: int
+        :type chunk_size: int
+        :rtype: int
+        """
+        if self.versions is None:
+            raise ValueError('No version store to prefetch into.')
+        loop = asyncio.get_event_loop()
+        chunks = wrapper.notebook_chunks(notes, chunk_size)
+        stored = (await loop.run_in_executor(
+            None, self.versions.stats))['versions']
+        lists = await asyncio.gather(*[self.list_notes_versions(chunk)
+                                       for chunk in chunks])
+        missing = await loop.run_in_executor(
+            None, self._missing_versions, chunks, lists)
+        await asyncio.gather(*[self.get_note_version(note, version_id)
+                               for note, version_id in missing])
+        return (await loop.run_in_executor(
+            None, self.versions.stats))['versions'] - stored
+
+    async def download_attachment(self, note, attachment, store,
+                                  chunk_size=64 * 1024, progress=None):
+        """Downloads attachment of the latest version of note into store
+        and returns the path of its content, or None if the download
+        failed, see wrapper.api.download_attachment. Concurrent downloads
+        of the same attachment wait for the first one.
+
+        :type note: models.Note
+        :param attachment: Attachment as returned by the host, or its id.
+        :type attachment: dict or int
+        :type store: blobs.BlobStore
+        :type chunk_size: int
+        :param progress: Called with the bytes received and the size of
+                         the attachment, None if unknown, after every
+                         chunk.
+        :type progress: callable
+        :rtype: str or None
+        """
+        if not isinstance(attachment, dict):
+            attachment = await self.get_note_attachment(note, attachment)
+            if attachment is None:
+                return None
+        args = (note['notebook_id'], note['id'], note['versions'][0]['id'],
+                attachment['id'])
+        uri = self.host + wrapper.api_version + \
+            wrapper.api_path['raw'].format(*args)
+        announced = attachment.get('hash')
+        loop = asyncio.get_event_loop()
+        lock = self._downloads.get(uri)
+        if lock is None:
+            lock = self._downloads[uri] = asyncio.Lock()
+        async with lock:
+            path = await loop.run_in_executor(None, store.lookup, uri,
+                                              announced)
+            if path is not None:
+                return path
+            target = store.partial(uri)
+            try:
+                digest = await self._download(args, target, store.new_hash(),
+                                              chunk_size, progress)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('Download of {} failed: {}'.format(uri, e))
+                return None
+            if store.valid_digest(announced) and \
+                    digest.lower() != announced.lower():
+                logger.error('Download of {} is corrupt, hash {} instead '
+                             'of {}.'.format(uri, digest, announced))
+                await loop.run_in_executor(None, os.remove, target)
+                return None
+            return await loop.run_in_executor(None, store.commit, uri,
+                                              target, digest)
+
+    async def _download(self, args, target, digest, chunk_size, progress):
+        # Bytes of an earlier, interrupted download are kept.
+        loop = asyncio.get_event_loop()
+        try:
+            offset = await loop.run_in_executor(None, os.path.getsize,
+                                                target)
+        except OSError:
+            offset = 0
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            res = await self.open(None, 'GET', 'raw', *args, headers=headers)
+        except HTTPError as e:
+            if e.code != 416:
+                raise
+            # The partial download is complete or does not match anymore.
+            await loop.run_in_executor(None, os.remove, target)
+            return await self._download(args, target, digest, chunk_size,
+                                        progress)
+        try:
+            if res.status != 206:
+                offset = 0
+            length = res.headers.get('content-length')
+            total = offset + int(length) if length is not None else None
+            f = await loop.run_in_executor(None, wrapper.open_partial,
+                                           target, offset, digest,
+                                           chunk_size)
+            try:
+                received = offset
+                while True:
+                    data = await res.read(chunk_size)
+                    if not data:
+                        break
+                    await loop.run_in_executor(None, f.write, data)
+                    digest.update(data)
+                    received += len(data)
+                    if progress is not None:
+                        progress(received, total)
+            finally:
+                await loop.run_in_executor(None, f.close)
+        finally:
+            res.close()
+        if total is not None and received != total:
+            raise IOError('Received {} of {} bytes'.format(received, total))
+        return digest.hexdigest()
+
+    async def download_attachments(self, note, attachments, store,
+                                   workers=4, progress=None, **kwargs):
+        """Downloads attachments of note into store concurrently and
+        returns the paths of their contents in order of attachments, None
+        for failed downloads. Up to concurrency requests are in flight at
+        once, workers is ignored.
+
+        :type note: models.Note
+        :param list attachments: Attachments or their ids.
+        :type store: blobs.BlobStore
+        :type workers: int
+        :param progress: Called with the attachment, the bytes received
+                         and its size, see download_attachment.
+        :type progress: callable
+        :param kwargs: Passed to download_attachment.
+        :rtype: list
+        """
+        return await asyncio.gather(*[
+            self.download_attachment(
+                note, attachment, store,
+                progress=progress and partial(progress, attachment),
+                **kwargs)
+            for attachment in attachments])
+
+    async def move_note(self, note, new_notebook_id):
+        """Moves note to new_notebook_id.
+
+        :type note: models.Note
+        :type new_notebook_id: int
+        :rtype: dict
+        """
+        return (await self.move_notes([note], new_notebook_id))[0]
@@ -0,0 +1,127 @@
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def as_list(notes):
+    """Returns notes as returned by the host as list, the host returns a
+    single note without list.
+
+    :type notes: list or dict or None
+    :rtype: list or None
+    """
+    return [notes] if isinstance(notes, dict) else notes
+
+
+class NoteLoader:
+    def __init__(self, api, window=0.005, max_batch=50):
+        """Batches requests of single notes. Notes requested within window
+        seconds of the first pending request are fetched per notebook
+        with one request of several ids, and the results are handed back
+        to every caller. Safe to use from several threads.
+
+        :type api: wrapper.api
+        :param window: Seconds to wait for more requests, if None
+                       requests are sent on tick only.
+        :type window: int or float or None
+        :param int max_batch: A notebook with this many pending notes is
+                              fetched at once.
+        """
+        self.api = api
+        self.window = window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timer = None
+        self.loads = 0
+        self.batches = 0
+
+    def submit(self, notebook_id, note_id):
+        """Queues a request of note with note_id in notebook with
+        notebook_id and returns a future of the note, None if the host
+        did not return it.
+
+        :type notebook_id: int
+        :type note_id: int
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        batch = None
+        with self.lock:
+            self.loads += 1
+            notes = self.pending.setdefault(notebook_id, OrderedDict())
+            notes.setdefault(note_id, []).append(future)
+            if len(notes) >= self.max_batch:
+                batch = self.pending.pop(notebook_id)
+            elif self.timer is None and self.window is not None:
+                self.timer = threading.Timer(self.window, self.tick)
+                self.timer.daemon = True
+                self.timer.start()
+        if batch is not None:
+            self._send(notebook_id, batch)
+        return future
+
+    def load(self, notebook_id, note_id):
+        """Returns note with note_id in notebook with notebook_id once its
+        batch was fetched, None if the host did not return it.
+
+        :type notebook_id: int
+        :type note_id: int
+        :rtype: dict or None
+        """
+        future = self.submit(notebook_id, note_id)
+        if self.window is None:
+            self.tick()
+        return future.result()
+
+    def tick(self):
+        """Sends all pending requests."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for notebook_id, notes in pending.items():
+            self._send(notebook_id, notes)
+
+    def _send(self, notebook_id, notes):
+        with self.lock:
+            self.batches += 1
+        logger.info('Fetching {} batched notes of notebook {}'.format(
+            len(notes), notebook_id))
+        try:
+            remote = as_list(self.api.get_notes(notebook_id, list(notes)))
+            if remote is None and len(notes) > 1:
+                # A single missing note fails the request of all of them.
+                logger.info('Fetching {} notes one at a time'.format(
+                    len(notes)))
+                remote = [note for note_id in notes for note in as_list(
+                    self.api.get_notes(notebook_id, [note_id])) or []]
+        except Exception as e:
+            for futures in notes.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+        remote = dict((int(note['id']), note) for note in remote or [])
+        for note_id, futures in notes.items():
+            note = remote.get(int(note_id))
+            futures[0].set_result(note)
+            # Callers of the same note get own copies.
+            for future in futures[1:]:
+                future.set_result(copy.deepcopy(note))
+
+    def stats(self):
+        """Returns counters of the loader.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'loads': self.loads,
+                'batches': self.batches,
+                'pending': sum(len(notes) for notes in self.pending.values())
+                }
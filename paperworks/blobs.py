@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    # Blobs are named by this digest of their bytes, like the hash field
+    # of attachments.
+    algorithm = 'md5'
+
+    def __init__(self, path):
+        """Content-addressed store of downloaded attachments in directory
+        path. Every distinct content is kept once, however many
+        attachments share it. Attachments are mapped to the digest of
+        their content in a SQLite database, partial downloads are kept
+        for resuming. Safe to use from several threads.
+
+        :type path: str
+        """
+        self.root = path
+        self.partial_dir = os.path.join(path, 'partial')
+        if not os.path.isdir(self.partial_dir):
+            os.makedirs(self.partial_dir)
+        self.lock = threading.Lock()
+        # Locks of the uris being downloaded, dropped once unused.
+        self.downloads = weakref.WeakValueDictionary()
+        self.db = sqlite3.connect(os.path.join(path, 'refs.db'),
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS refs ('
+            'uri TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    def close(self):
+        """Closes the database."""
+        with self.lock:
+            self.db.close()
+
+    def new_hash(self):
+        """Returns a hash object of the algorithm naming blobs."""
+        return hashlib.new(self.algorithm)
+
+    def valid_digest(self, digest):
+        """Returns true if digest can name a blob of this store.
+
+        :type digest: str
+        :rtype: bool
+        """
+        return bool(digest) and \
+            len(digest) == self.new_hash().digest_size * 2 and \
+            all(char in '0123456789abcdef' for char in digest.lower())
+
+    def path(self, digest):
+        """Returns the path of the blob with digest.
+
+        :type digest: str
+        :rtype: str
+        """
+        digest = digest.lower()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def partial(self, uri):
+        """Returns the path a download of uri is written to until it is
+        complete.
+
+        :type uri: str
+        :rtype: str
+        """
+        return os.path.join(self.partial_dir, hashlib.sha1(
+            uri.encode('UTF-8')).hexdigest())
+
+    def download_lock(self, uri):
+        """Returns the lock held while uri is downloaded, so concurrent
+        downloads of it do not write the same partial file.
+
+        :type uri: str
+        :rtype: threading.Lock
+        """
+        with self.lock:
+            lock = self.downloads.get(uri)
+            if lock is None:
+                lock = self.downloads[uri] = threading.Lock()
+            return lock
+
+    def lookup(self, uri, digest=None):
+        """Returns the path of the stored content of uri, known by digest
+        or by an earlier download of uri, or None.
+
+        :type uri: str
+        :param digest: Digest announced by the host.
+        :type digest: str
+        :rtype: str or None
+        """
+        with self.lock:
+            announced = self.valid_digest(digest)
+            if not announced:
+                row = self.db.execute('SELECT digest FROM refs WHERE uri = ?',
+                                      (uri,)).fetchone()
+                digest = row and row[0]
+            if digest and os.path.exists(self.path(digest)):
+                self.hits += 1
+                if announced:
+                    with self.db:
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO refs (uri, digest) '
+                            'VALUES (?, ?)', (uri, digest.lower()))
+                return self.path(digest)
+            self.misses += 1
+            return None
+
+    def commit(self, uri, partial, digest):
+        """Moves the completed download of uri at partial into the store
+        as blob digest and returns its path. If the content is stored
+        already, partial is removed.
+
+        :type uri: str
+        :type partial: str
+        :type digest: str
+        :rtype: str
+        """
+        path = self.path(digest)
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(partial)
+                self.deduplicated += 1
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(partial, path)
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO refs (uri, digest) VALUES (?, ?)',
+                    (uri, digest.lower()))
+        return path
+
+    def discard(self, digest):
+        """Removes the blob with digest and the references to it.
+
+        :type digest: str
+        """
+        with self.lock:
+            if os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
+            with self.db:
+                self.db.execute('DELETE FROM refs WHERE digest = ?',
+                                (digest.lower(),))
+
+    def stats(self):
+        """Returns counters of the store.
+
+        :rtype: dict
+        """
+        blobs = size = 0
+        for directory in os.listdir(self.root):
+            directory = os.path.join(self.root, directory)
+            if len(os.path.basename(directory)) != 2 or \
+                    not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                blobs += 1
+                size += os.path.getsize(os.path.join(directory, name))
+        with self.lock:
+            return {
+                'blobs': blobs,
+                'size': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'deduplicated': self.deduplicated
+                }
@@ -0,0 +1,312 @@
+import logging
+import sqlite3
+import threading
+
+from paperworks import models
+
+logger = logging.getLogger(__name__)
+
+schema = '''
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    visibility INTEGER NOT NULL DEFAULT 0,
+    dirty TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS notebooks (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    type INTEGER NOT NULL DEFAULT 0,
+    updated_at INTEGER NOT NULL DEFAULT 0,
+    dirty TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    notebook_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    updated_at INTEGER NOT NULL DEFAULT 0,
+    dirty TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS notes_notebook ON notes (notebook_id);
+CREATE TABLE IF NOT EXISTS note_tags (
+    note_id INTEGER NOT NULL,
+    tag_id INTEGER NOT NULL,
+    PRIMARY KEY (note_id, tag_id)
+);
+'''
+
+
+def dump_dirty(model):
+    """Returns the names of the changed fields of model as stored.
+
+    :type model: models.Model
+    :rtype: str
+    """
+    return ','.join(sorted(model.dirty))
+
+
+def load_dirty(dirty):
+    """Returns the changed fields stored by dump_dirty.
+
+    :type dirty: str
+    :rtype: frozenset
+    """
+    return frozenset(dirty.split(',')) if dirty else models.no_changes
+
+
+class Store:
+    def __init__(self, path):
+        """On-disk cache of notebooks, notes and tags in a SQLite database
+        in WAL mode. Safe to use from several threads.
+
+        :type path: str
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(schema)
+        # Caches written before changed fields were stored lack them.
+        for table in ('tags', 'notebooks', 'notes'):
+            columns = [row[1] for row in self.db.execute(
+                'PRAGMA table_info({})'.format(table))]
+            if 'dirty' not in columns:
+                self.db.execute(
+                    "ALTER TABLE {} ADD COLUMN dirty TEXT NOT NULL "
+                    "DEFAULT ''".format(table))
+
+    def close(self):
+        """Closes the database."""
+        with self.lock:
+            self.db.close()
+
+    def load(self, paperwork):
+        """Fills paperwork with the cached tags, notebooks and notes,
+        including their changes not yet updated to the host. Returns
+        false if the cache is empty.
+
+        :type paperwork: models.Paperwork
+        :rtype: bool
+        """
+        api = paperwork.api
+        with self.lock:
+            tags = self.db.execute(
+                'SELECT id, title, visibility, dirty FROM tags').fetchall()
+            notebooks = self.db.execute(
+                'SELECT id, title, type, updated_at, dirty '
+                'FROM notebooks').fetchall()
+            notes = self.db.execute(
+                'SELECT id, notebook_id, title, content, updated_at, dirty '
+                'FROM notes').fetchall()
+            note_tags = self.db.execute(
+                'SELECT note_id, tag_id FROM note_tags').fetchall()
+        if not notebooks:
+            return False
+
+        for id, title, visibility, dirty in tags:
+            tag = models.Tag(title, id, api, visibility)
+            tag.dirty = load_dirty(dirty)
+            paperwork.add_tag(tag)
+        for id, title, type, updated_at, dirty in notebooks:
+            notebook = models.Notebook(title, id, api, type, updated_at)
+            notebook.dirty = load_dirty(dirty)
+            paperwork.add_notebook(notebook)
+        tags_of = {}
+        for note_id, tag_id in note_tags:
+            if tag_id in paperwork.tags:
+                tags_of.setdefault(note_id, []).append(
+                    paperwork.tags[tag_id])
+        shared = paperwork.index.tag_tuples
+        by_notebook = {}
+        for id, notebook_id, title, content, updated_at, dirty in notes:
+            notebook = paperwork.notebooks.get(notebook_id)
+            if notebook is not None:
+                note = models.Note(title, id, notebook, content, updated_at)
+                # Set before the content may be unloaded, an edited one
+                # stays loaded.
+                note.dirty = load_dirty(dirty)
+                if id in tags_of:
+                    note.tags = models.shared_tags(tags_of[id], shared)
+                by_notebook.setdefault(notebook, []).append(note)
+        # Sorted into the views and indexes once per notebook.
+        loaded = 0
+        for notebook, notebook_notes in by_notebook.items():
+            notebook.add_notes(notebook_notes)
+            loaded += len(notebook_notes)
+        logger.info('Loaded {} notebooks and {} notes from {}'.format(
+            len(notebooks), loaded, self.path))
+        return True
+
+    def save(self, paperwork):
+        """Brings the cache up to the state of paperwork. Only notes that
+        differ from their stored rows are written, stored contents of
+        unloaded notes are kept instead of being fetched again. Changed
+        fields are stored too, so local changes survive a restart.
+
+        :type paperwork: models.Paperwork
+        """
+        notebooks = list(paperwork.notebooks.values())
+        notes = [note for notebook in notebooks
+                 for note in list(notebook.notes.values())]
+        with self.lock:
+            stored = self._stored()
+            stored_notebooks = set(row[0] for row in self.db.execute(
+                'SELECT id FROM notebooks'))
+        changed, contents = self._changes(notes, stored)
+        removed = set(stored) - set(note.id for note in notes)
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM tags')
+            self._save_tags(paperwork.tags.values())
+            self.db.executemany(
+                'DELETE FROM notebooks WHERE id = ?',
+                [(id,) for id in stored_notebooks -
+                 set(notebook.id for notebook in notebooks)])
+            for notebook in notebooks:
+                self._save_notebook_row(notebook)
+            self.db.executemany('DELETE FROM notes WHERE id = ?',
+                                [(id,) for id in removed])
+            self.db.executemany('DELETE FROM note_tags WHERE note_id = ?',
+                                [(id,) for id in removed])
+            self._save_notes(changed, contents, stored)
+        logger.info('Saved {} of {} notes to {}'.format(
+            len(changed), len(notes), self.path))
+
+    def save_tags(self, tags):
+        """Replaces the cached tags.
+
+        :type tags: list
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM tags')
+            self._save_tags(tags)
+
+    def save_notebook(self, notebook, notes=None, removed=()):
+        """Stores notebook and those of the given notes that differ from
+        their stored rows.
+
+        :type notebook: models.Notebook
+        :param list notes: Changed notes, all notes of notebook if None.
+        :param removed: Ids of notes no longer in notebook.
+        :type removed: list or set
+        """
+        if notes is None:
+            notes = list(notebook.notes.values())
+        with self.lock:
+            stored = self._stored(notebook.id)
+        changed, contents = self._changes(notes, stored)
+        with self.lock, self.db:
+            self._delete_notes(notebook.id, removed)
+            self._save_notebook_row(notebook)
+            self._save_notes(changed, contents, stored)
+
+    def remove_notebooks(self, notebook_ids):
+        """Removes notebooks and their notes from the cache.
+
+        :type notebook_ids: list or set
+        """
+        with self.lock, self.db:
+            for notebook_id in notebook_ids:
+                self.db.execute(
+                    'DELETE FROM note_tags WHERE note_id IN '
+                    '(SELECT id FROM notes WHERE notebook_id = ?)',
+                    (notebook_id,))
+                self.db.execute('DELETE FROM notes WHERE notebook_id = ?',
+                                (notebook_id,))
+                self.db.execute('DELETE FROM notebooks WHERE id = ?',
+                                (notebook_id,))
+
+    def _save_tags(self, tags):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO tags (id, title, visibility, dirty) '
+            'VALUES (?, ?, ?, ?)',
+            [(tag.id, tag.title, tag.visibility, dump_dirty(tag))
+             for tag in tags])
+
+    def _delete_notes(self, notebook_id, note_ids):
+        # A note moved to another notebook may already be stored there.
+        self.db.executemany(
+            'DELETE FROM notes WHERE id = ? AND notebook_id = ?',
+            [(id, notebook_id) for id in note_ids])
+        self.db.executemany(
+            'DELETE FROM note_tags WHERE note_id = ? AND NOT EXISTS '
+            '(SELECT 1 FROM notes WHERE id = ?)',
+            [(id, id) for id in note_ids])
+
+    def _stored(self, notebook_id=None):
+        # Notebook, title, updated_at, tag ids and changed fields of stored
+        # notes by id, without their contents.
+        where = '' if notebook_id is None else ' WHERE notebook_id = ?'
+        params = () if notebook_id is None else (notebook_id,)
+        tags_of = {}
+        for note_id, tag_id in self.db.execute(
+                'SELECT note_id, tag_id FROM note_tags WHERE note_id IN '
+                '(SELECT id FROM notes' + where + ')', params):
+            tags_of.setdefault(note_id, set()).add(tag_id)
+        return dict(
+            (id, (notebook_id, title, updated_at,
+                  frozenset(tags_of.get(id, ())), dirty))
+            for id, notebook_id, title, updated_at, dirty in self.db.execute(
+                'SELECT id, notebook_id, title, updated_at, dirty '
+                'FROM notes' + where, params))
+
+    def _changes(self, notes, stored):
+        # Returns the notes differing from their stored rows and the
+        # contents to write, fetching only those neither loaded nor
+        # stored with the same updated_at.
+        changed = []
+        missing = []
+        for note in notes:
+            row = stored.get(note.id)
+            if row == (note.notebook.id, note.title, note.updated_at,
+                       frozenset(tag.id for tag in note.tags),
+                       dump_dirty(note)) and \
+                    'content' not in note.dirty:
+                continue
+            changed.append(note)
+            if note.loaded_content is None and \
+                    (row is None or row[2] != note.updated_at):
+                missing.append(note)
+        contents = missing[0].notebook.contents if missing else None
+        if contents is None:
+            return changed, {}
+        return changed, contents.fetch(missing)
+
+    def _save_notebook_row(self, notebook):
+        self.db.execute(
+            'INSERT OR REPLACE INTO notebooks '
+            '(id, title, type, updated_at, dirty) VALUES (?, ?, ?, ?, ?)',
+            (notebook.id, notebook.title, notebook.type,
+             notebook.updated_at, dump_dirty(notebook)))
+
+    def _save_notes(self, notes, contents, stored):
+        rows = []
+        updated = []
+        saved = []
+        for note in notes:
+            content = contents.get(note.id, note.loaded_content)
+            row = stored.get(note.id)
+            if content is not None:
+                rows.append((note.id, note.notebook.id, note.title, content,
+                             note.updated_at, dump_dirty(note)))
+            elif row is not None and row[2] == note.updated_at:
+                # The stored content is current, it is kept.
+                updated.append((note.notebook.id, note.title,
+                                note.updated_at, dump_dirty(note), note.id))
+            else:
+                logger.error('Not caching {}, content unknown'.format(note))
+                continue
+            saved.append(note)
+        self.db.executemany(
+            'INSERT OR REPLACE INTO notes '
+            '(id, notebook_id, title, content, updated_at, dirty) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.db.executemany(
+            'UPDATE notes SET notebook_id = ?, title = ?, updated_at = ?, '
+            'dirty = ? WHERE id = ?', updated)
+        self.db.executemany('DELETE FROM note_tags WHERE note_id = ?',
+                            [(note.id,) for note in saved])
+        self.db.executemany(
+            'INSERT INTO note_tags (note_id, tag_id) VALUES (?, ?)',
+            [(note.id, tag.id) for note in saved for tag in note.tags])
@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 
-from paperworks import models
+# Modules only some commands need are imported where they are used, so
+# the prompt appears quickly.
+from paperworks import models, wrapper
 import os
 import sys
 import logging
-import yaml
-import argparse
-import tempfile
+import threading
 
 if str(sys.version[0]) < '3':
     input = raw_input
@@ -14,16 +14,36 @@ if str(sys.version[0]) < '3':
 logger = logging.getLogger(__name__)
 
 pw = None
-
-
-def login():
+store = None
+sync = None
+# Changes fetched by the sync thread, applied in the main thread.
+synced = []
+# Thread filling pw after startup and the exception it failed with.
+loading = None
+loading_error = None
+# Commands that do not need the notes and run while they are loaded.
+independent_cmds = frozenset(['stats', 'help', 'export', 'import'])
+
+
+def login(connections=4, lazy=0, http_cache=None, batch_window=None):
     """Creates Paperwork instance.
-    Reads credentials from rc-file or prompts."""
+    Reads credentials from rc-file or prompts.
+
+    :param int connections: Keep-alive connections kept per host,
+                            0 disables pooling.
+    :param int lazy: Megabytes of note contents kept in memory,
+                     0 keeps all contents loaded.
+    :param str http_cache: Path of a database caching responses, 'memory'
+                           keeps them in memory, None disables caching.
+    :param float batch_window: Seconds single notes requested concurrently
+                               are collected to be fetched at once.
+    """
     global pw
     rc = os.environ.get('HOME')+'/.paperworkrc'
     if os.path.exists(rc):
+        import yaml
         with open(rc, 'r') as f:
-            conf = yaml.load(f)
+            conf = yaml.safe_load(f)
         host = conf['host']
         user = conf['user']
         passwd = conf['pass']
@@ -32,15 +52,112 @@ def login():
         host = input('Host:')
         user = input('User:')
         passwd = getpass('Password:')
-    pw = models.Paperwork(user, passwd, host)
+    pool = wrapper.ConnectionPool(connections) if connections else None
+    content_cache = None
+    if lazy:
+        from paperworks import contents
+        content_cache = contents.ContentCache(lazy * 1024 * 1024)
+    responses = None
+    if http_cache:
+        from paperworks import httpcache
+    if http_cache == 'memory':
+        responses = httpcache.ResponseCache()
+    elif http_cache:
+        responses = httpcache.ResponseCache(httpcache.DiskBackend(
+            os.path.expanduser(http_cache)))
+    pw = models.Paperwork(user, passwd, host, pool, content_cache,
+                          responses, batch_window)
     if not pw.authenticated:
         print('User/password not valid or host not reachable.')
         sys.exit()
 
 
-def download():
-    """Fills Paperwork instance with information from server."""
-    pw.download()
+def download(workers=1):
+    """Fills Paperwork instance with information from server.
+
+    :param int workers: Number of concurrent requests.
+    """
+    pw.download(workers, stream=True)
+
+
+def load(path, workers=1):
+    """Fills Paperwork instance from the local cache at path and returns
+    a thread fetching changes from the server in the background, which
+    apply_sync applies. Downloads everything if the cache is empty.
+
+    :type path: str
+    :param int workers: Number of concurrent requests.
+    :rtype: threading.Thread or None
+    """
+    from paperworks import cache
+    global store
+    store = cache.Store(path)
+    if not pw.load(store):
+        download(workers)
+        pw.save(store)
+        return None
+    sync = threading.Thread(
+        target=lambda: synced.append(pw.fetch_changes(workers)))
+    sync.daemon = True
+    sync.start()
+    return sync
+
+
+def apply_sync():
+    """Applies the changes fetched by the sync thread once it finished.
+    The instance is only changed here, in the main thread, so commands
+    never see it half synchronized."""
+    global sync
+    if sync is None or sync.is_alive():
+        return
+    sync = None
+    changes = synced.pop() if synced else None
+    if changes is not None:
+        pw.apply_changes(store, changes)
+
+
+def start_loading(path=None, workers=1):
+    """Fills Paperwork instance in a background thread, from the local
+    cache at path if given, else from the server, and returns the
+    thread. Commands needing the notes call wait_loaded first.
+
+    :type path: str
+    :param int workers: Number of concurrent requests.
+    :rtype: threading.Thread
+    """
+    global loading
+
+    def run():
+        global sync, loading_error
+        try:
+            if path:
+                sync = load(path, workers)
+            else:
+                download(workers)
+        except Exception as e:
+            logger.error(e)
+            loading_error = e
+    loading = threading.Thread(target=run)
+    loading.daemon = True
+    loading.start()
+    return loading
+
+
+def wait_loaded(synchronized=False):
+    """Blocks until the background loading finished and applies the
+    changes the sync thread fetched meanwhile. Returns false if loading
+    failed.
+
+    :param bool synchronized: Also wait for the sync thread.
+    :rtype: bool
+    """
+    if loading is not None and loading.is_alive():
+        print('Waiting for notes to load...')
+        loading.join()
+    if synchronized and sync is not None:
+        sync.join()
+    apply_sync()
+    return loading_error is None
 
 
 def update():
@@ -48,6 +165,19 @@ def update():
     pw.update()
 
 
+def reconcile():
+    """Synchronizes all notebooks and notes in batched requests."""
+    result = pw.reconcile()
+    print('{pushed} pushed, {pulled} pulled, {missing} missing'.format(
+        **result))
+
+
+def changes():
+    """Prints what update would push to the remote host."""
+    for item, fields in pw.update(dry_run=True):
+        print('{} ({})'.format(item.title, ', '.join(fields)))
+
+
 def print_all():
     """Prints notebook and notes in alphabetical order."""
     for nb in pw.get_notebooks():
@@ -105,6 +235,7 @@ def edit(title):
 
     :type title: str
     """
+    import tempfile
     note = choose_note(title)
     logger.info('Getting $EDITOR')
     editor = os.environ.get('EDITOR')
@@ -206,6 +337,73 @@ def tag(args):
             pw.add_tag(tag_title)
 
 
+def search(key):
+    """Prints notes matching key, best match first.
+
+    :type key: str
+    """
+    for note in pw.search(key, limit=20):
+        print('{} ({})'.format(note.title, note.notebook.title))
+
+
+def stats():
+    """Prints requests sent per endpoint, slowest first, and counters of
+    the connection pool and caches."""
+    metrics = sorted(pw.api.metrics().values(),
+                     key=lambda endpoint: endpoint['total'], reverse=True)
+    print('{:<20} {:>6} {:>6} {:>10} {:>10} {:>8} {:>8} {:>8}'.format(
+        'endpoint', 'count', 'errors', 'sent', 'received', 'p50 ms',
+        'p95 ms', 'p99 ms'))
+    for endpoint in metrics:
+        print('{:<20} {requests:>6} {errors:>6} {bytes_sent:>10} '
+              '{bytes_received:>10} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+                  '{method} {keyword}'.format(**endpoint),
+                  endpoint['p50'] * 1000, endpoint['p95'] * 1000,
+                  endpoint['p99'] * 1000, **endpoint))
+    for name, counters in (('connections', pw.api.pool),
+                           ('coalescing', pw.api.flights),
+                           ('batching', pw.api.loader),
+                           ('contents', pw.contents),
+                           ('responses', pw.api.cache),
+                           ('versions', pw.api.versions)):
+        if counters is not None:
+            print('{}: {}'.format(name, ', '.join(
+                '{} {}'.format(key, round(value, 2))
+                for key, value in sorted(counters.stats().items()))))
+
+
+def export(path):
+    """Writes a snapshot of the remote host to path, gzip compressed if
+    path ends with '.gz'.
+
+    :type path: str
+    """
+    from paperworks import snapshot
+    counts = snapshot.export(pw.api, os.path.expanduser(path))
+    if counts is None:
+        print('Export failed.')
+    else:
+        print('{tag} tags, {notebook} notebooks and {note} notes '
+              'exported'.format(**counts))
+
+
+def restore(path):
+    """Creates the contents of the snapshot at path on the remote host.
+    An interrupted restore continues where it stopped.
+
+    :type path: str
+    """
+    from paperworks import snapshot
+    if not prompt('Restore {} to {}?'.format(path, pw.api.host)):
+        return
+    counts = snapshot.restore(pw.api, os.path.expanduser(path))
+    if counts is None:
+        print('Restore incomplete, run it again to continue.')
+    else:
+        print('{tag} tags, {notebook} notebooks and {note} notes '
+              'restored'.format(**counts))
+
+
 def tagged(tag_title):
     """Print notes tagged with tag.
 
@@ -221,6 +419,8 @@ def print_help():
     print("""The commands are self-explanatory. Notes, tags and notebooks are chosen through a fuzzy search.
 
 update                      Pushes local changes to the remote host
+changes                     List local changes update would push
+reconcile                   Pushes and pulls all changes in batches
 ls                          List notebooks and notes
 edit $note                  edit note
 delete $notebook            delete notebook
@@ -232,12 +432,19 @@ tags                        list tags
 tag $note with $tag         tag note with tag
 tag $tag                    create $tag
 tagged $tag                 print notes tagged with $tag
+search $keywords            search titles and contents of notes,
+                            "quoted words" match a phrase, word* a prefix
+stats                       print request metrics and cache counters
+export $path                write a snapshot of the host to $path
+import $path                create the contents of snapshot $path
 exit                        exit application
 """
           )
 
 cmd_dict = {
     'update': update,
+    'changes': changes,
+    'reconcile': reconcile,
     'ls': print_all,
     'edit': edit,
     'delete': delete,
@@ -246,24 +453,46 @@ cmd_dict = {
     'tags': tags,
     'tag': tag,
     'tagged': tagged,
+    'search': search,
+    'stats': stats,
+    'export': export,
+    'import': restore,
     'help': print_help
     }
 
 
 def main():
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-v", "--verbose", help="verbose output", action="store_true")
     parser.add_argument(
         "--threading", help="enable multi-threading", action="store_true")
+    parser.add_argument(
+        "--connections", help="keep-alive connections per host, 0 disables",
+        type=int, default=4)
+    parser.add_argument(
+        "--workers", help="concurrent requests while downloading",
+        type=int, default=8)
+    parser.add_argument(
+        "--cache", help="keep notes in a local cache at this path")
+    parser.add_argument(
+        "--lazy", help="load note contents on access, keeping at most this "
+        "many megabytes of them in memory", type=int, default=0)
+    parser.add_argument(
+        "--http-cache", help="revalidate cached responses instead of "
+        "downloading them again, 'memory' or a database path")
     args = parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
     if args.threading:
         models.use_threading = True
-    login()
-    download()
+    # Threaded updates request their notes concurrently, in batches.
+    login(args.connections, args.lazy, args.http_cache,
+          0.005 if args.threading else None)
+    cache_path = args.cache and os.path.expanduser(args.cache)
+    start_loading(cache_path, args.workers)
 
     cmd = input('>')
     while (cmd != 'exit'):
@@ -274,7 +503,11 @@ def main():
             cmd = cmd[0]
         else:
             args = None
-        if cmd in cmd_dict.keys():
+        apply_sync()
+        if cmd in cmd_dict.keys() and cmd not in independent_cmds and \
+                not wait_loaded():
+            print('Loading notes failed: {}'.format(loading_error))
+        elif cmd in cmd_dict.keys():
             if args:
                 cmd_dict[cmd](args)
             else:
@@ -283,6 +516,13 @@ def main():
             logger.info('Invalid command')
             print('{} unknown'.format(cmd))
         cmd = input('>')
+    for error in pw.flush():
+        print('Failed: {}'.format(error))
+    if cache_path:
+        wait_loaded(synchronized=True)
+    if store:
+        pw.save(store)
+        store.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from paperworks.batching import as_list
+
+logger = logging.getLogger(__name__)
+
+
+class ContentCache:
+    # Maximum of note ids per request when fetching contents.
+    chunk_size = 50
+
+    def __init__(self, max_size=16 * 1024 * 1024):
+        """Contents of lazily loaded notes by note id. The least recently
+        used contents are evicted once their total length exceeds
+        max_size characters. Safe to use from several threads.
+
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.contents = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.contents)
+
+    def get(self, note_id):
+        """Returns the cached content of the note with note_id or None.
+
+        :type note_id: int
+        :rtype: str or None
+        """
+        with self.lock:
+            content = self.contents.pop(note_id, None)
+            if content is None:
+                self.misses += 1
+                return None
+            self.contents[note_id] = content
+            self.hits += 1
+            return content
+
+    def put(self, note_id, content):
+        """Caches content of the note with note_id, evicting the least
+        recently used contents if needed.
+
+        :type note_id: int
+        :type content: str
+        """
+        with self.lock:
+            old = self.contents.pop(note_id, None)
+            if old is not None:
+                self.size -= len(old)
+            self.contents[note_id] = content
+            self.size += len(content)
+            while self.size > self.max_size and len(self.contents) > 1:
+                evicted = self.contents.popitem(last=False)[1]
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, note_id):
+        """Removes the content of the note with note_id.
+
+        :type note_id: int
+        """
+        with self.lock:
+            old = self.contents.pop(note_id, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def fetch(self, notes):
+        """Returns the contents of notes by note id. Contents neither
+        loaded nor cached are requested from the host, in chunks of
+        chunk_size ids per notebook, and cached. Notes the host did not
+        return are missing in the result.
+
+        :type notes: list
+        :rtype: dict
+        """
+        contents = {}
+        missing = {}
+        for note in notes:
+            content = note.loaded_content
+            if content is None:
+                content = self.get(note.id)
+            if content is None:
+                missing.setdefault(note.notebook, []).append(note.id)
+            else:
+                contents[note.id] = content
+        for notebook, note_ids in missing.items():
+            for start in range(0, len(note_ids), self.chunk_size):
+                chunk = note_ids[start:start + self.chunk_size]
+                logger.info('Fetching {} notes of {}'.format(
+                    len(chunk), notebook))
+                remote = as_list(notebook.api.get_notes(notebook.id, chunk))
+                if remote is None:
+                    logger.error('Contents of {} notes could not be '
+                                 'fetched.'.format(len(chunk)))
+                    continue
+                for note_json in remote:
+                    note_id = int(note_json['id'])
+                    contents[note_id] = note_json['content']
+                    self.put(note_id, note_json['content'])
+        return contents
+
+    def stats(self):
+        """Returns counters of the cache.
+
+        :rtype: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'notes': len(self.contents),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+                }
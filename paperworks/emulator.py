@@ -0,0 +1,534 @@
+"""Local stand-in for a Paperwork host, serving the routes of
+wrapper.api_path from memory. Meant for tests and benchmarks of the
+client, with configurable latency and injected errors.
+
+    server = Emulator(Dataset.generate(notes=1000)).start()
+    pw = models.Paperwork(server.user, server.passwd, server.host)
+    ...
+    server.stop()
+"""
+
+import json
+import logging
+import random
+import re
+import threading
+import time
+from base64 import b64decode
+from hashlib import md5
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from paperworks import wrapper
+
+logger = logging.getLogger(__name__)
+
+# Keywords of api_path with the regular expressions matching their paths.
+routes = [(keyword, re.compile('^{}$'.format(
+    re.escape(path).replace(re.escape('{}'), '([^/]+)'))))
+    for keyword, path in wrapper.api_path.items()]
+
+
+def now():
+    """Returns the current time in the format of the host.
+
+    :rtype: str
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+def ids(segment):
+    """Returns the ids of a path segment listing them separated by comma.
+
+    :type segment: str
+    :rtype: list
+    """
+    return [int(note_id) for note_id in segment.split(',')]
+
+
+def form_files(body, content_type):
+    """Returns the files of a multipart/form-data body as dicts of field
+    name, filename, content_type and content.
+
+    :type body: bytes
+    :param str content_type: Content-Type header naming the boundary.
+    :rtype: list
+    """
+    boundary = re.search('boundary="?([^";]+)', content_type).group(1)
+    files = []
+    for part in body.split(b'--' + boundary.encode('ASCII'))[1:-1]:
+        head, content = part[2:].split(b'\r\n\r\n', 1)
+        head = head.decode('UTF-8')
+        name = re.search(' name="([^"]*)"', head)
+        filename = re.search('filename="([^"]*)"', head)
+        part_type = re.search('Content-Type: *(.+)', head, re.I)
+        files.append({
+            'name': name and name.group(1),
+            'filename': filename and filename.group(1),
+            'content_type': part_type.group(1).strip() if part_type
+            else 'application/octet-stream',
+            'content': content[:-2]
+            })
+    return files
+
+
+class Dataset:
+    def __init__(self):
+        """Notebooks, notes, tags, versions and attachments of a user,
+        changed through the methods named after the request method and
+        api_path keyword, like get_notes. Safe to use from several
+        threads."""
+        self.lock = threading.RLock()
+        self.notebooks = {}
+        self.notes = {}
+        self.tags = {}
+        # Ids of the notes of every notebook.
+        self.notebook_notes = {}
+        # Contents of attachments by attachment id.
+        self.files = {}
+        self.last_id = 0
+
+    @classmethod
+    def generate(cls, notebooks=10, notes=100, tags=10, content_size=200,
+                 seed=0):
+        """Returns a dataset with notes spread evenly over notebooks, each
+        tagged with up to two tags and with content_size characters of
+        content. Equal arguments give equal datasets.
+
+        :type notebooks: int
+        :type notes: int
+        :type tags: int
+        :type content_size: int
+        :type seed: int
+        :rtype: Dataset
+        """
+        rand = random.Random(seed)
+        words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'paper', 'work',
+                 'note', 'book', 'tag', 'milk', 'bread', 'meeting', 'idea']
+        dataset = cls()
+        tag_ids = [dataset.post_tags({'title': 'tag {}'.format(i),
+                                      'visibility': 0})['id']
+                   for i in range(tags)]
+        notebook_ids = [dataset.post_notebooks(
+            {'title': 'notebook {}'.format(i), 'type': 0})['id']
+            for i in range(notebooks)]
+        for i in range(notes):
+            content = []
+            while sum(len(word) + 1 for word in content) < content_size:
+                content.append(rand.choice(words))
+            note = dataset.post_notes(
+                {'title': 'note {} {}'.format(i, rand.choice(words)),
+                 'content': ' '.join(content)[:content_size]},
+                notebook_ids[i % notebooks])
+            if tag_ids:
+                dataset.notes[note['id']]['tags'] = sorted(set(
+                    rand.choice(tag_ids) for _ in range(2)))
+        return dataset
+
+    def next_id(self):
+        with self.lock:
+            self.last_id += 1
+            return self.last_id
+
+    def note_json(self, note):
+        """Returns the json of a stored note.
+
+        :type note: dict
+        :rtype: dict
+        """
+        return dict(
+            note,
+            tags=[self.tags[tag_id] for tag_id in note['tags']
+                  if tag_id in self.tags],
+            versions=[{'id': version['id']}
+                      for version in reversed(note['versions'])])
+
+    def find_notes(self, notebook_id, segment):
+        """Returns the stored notes of notebook_id listed in segment.
+        Raises KeyError if any is missing.
+
+        :type notebook_id: str
+        :type segment: str
+        :rtype: list
+        """
+        found = []
+        for note_id in ids(segment):
+            note = self.notes[note_id]
+            if note['notebook_id'] != int(notebook_id):
+                raise KeyError(note_id)
+            found.append(note)
+        return found
+
+    def find_version(self, notebook_id, note_id, version_id):
+        note = self.find_notes(notebook_id, note_id)[0]
+        for version in note['versions']:
+            if version['id'] == int(version_id):
+                return version
+        raise KeyError(version_id)
+
+    def get_notebooks(self):
+        with self.lock:
+            return sorted(self.notebooks.values(),
+                          key=lambda notebook: notebook['id'])
+
+    def post_notebooks(self, data):
+        with self.lock:
+            notebook = {'id': self.next_id(), 'title': data['title'],
+                        'type': data.get('type', 0), 'updated_at': now()}
+            self.notebooks[notebook['id']] = notebook
+            self.notebook_notes[notebook['id']] = set()
+            return notebook
+
+    def get_notebook(self, notebook_id):
+        with self.lock:
+            return self.notebooks[int(notebook_id)]
+
+    def put_notebook(self, data, notebook_id):
+        with self.lock:
+            notebook = self.notebooks[int(notebook_id)]
+            notebook.update(title=data['title'], updated_at=now())
+            return notebook
+
+    def delete_notebook(self, notebook_id):
+        with self.lock:
+            notebook = self.notebooks.pop(int(notebook_id))
+            for note_id in self.notebook_notes.pop(notebook['id']):
+                del self.notes[note_id]
+            return notebook
+
+    def get_notes(self, notebook_id):
+        with self.lock:
+            return [self.note_json(self.notes[note_id]) for note_id in
+                    sorted(self.notebook_notes[int(notebook_id)])]
+
+    def post_notes(self, data, notebook_id):
+        with self.lock:
+            if int(notebook_id) not in self.notebooks:
+                raise KeyError(notebook_id)
+            note = {'id': self.next_id(), 'title': data['title'],
+                    'content': data.get('content', ''),
+                    'notebook_id': int(notebook_id), 'updated_at': now(),
+                    'tags': [], 'versions': []}
+            note['versions'].append(self.new_version(note))
+            self.notes[note['id']] = note
+            self.notebook_notes[note['notebook_id']].add(note['id'])
+            return self.note_json(note)
+
+    def new_version(self, note):
+        return {'id': self.next_id(), 'title': note['title'],
+                'content': note['content'], 'updated_at': note['updated_at'],
+                'attachments': {}}
+
+    def get_note(self, notebook_id, segment):
+        with self.lock:
+            notes = [self.note_json(note)
+                     for note in self.find_notes(notebook_id, segment)]
+            return notes[0] if len(notes) == 1 else notes
+
+    def put_note(self, data, notebook_id, segment):
+        with self.lock:
+            note = self.find_notes(notebook_id, segment)[0]
+            note.update(title=data['title'], content=data['content'],
+                        updated_at=now())
+            if 'tags' in data:
+                for tag in data['tags']:
+                    self.tags.setdefault(int(tag['id']), tag)
+                note['tags'] = [int(tag['id']) for tag in data['tags']]
+            note['versions'].append(self.new_version(note))
+            return self.note_json(note)
+
+    def delete_note(self, notebook_id, segment):
+        with self.lock:
+            notes = self.find_notes(notebook_id, segment)
+            for note in notes:
+                del self.notes[note['id']]
+                self.notebook_notes[note['notebook_id']].discard(note['id'])
+            return [self.note_json(note) for note in notes]
+
+    def get_move(self, notebook_id, segment, new_notebook_id):
+        with self.lock:
+            notebook = self.notebooks[int(new_notebook_id)]
+            notes = self.find_notes(notebook_id, segment)
+            for note in notes:
+                self.notebook_notes[note['notebook_id']].discard(note['id'])
+                self.notebook_notes[notebook['id']].add(note['id'])
+                note.update(notebook_id=notebook['id'], updated_at=now())
+            return [dict(self.note_json(note), notebook=notebook)
+                    for note in notes]
+
+    def get_versions(self, notebook_id, segment):
+        with self.lock:
+            return [[dict((key, value) for key, value in version.items()
+                          if key != 'attachments')
+                     for version in reversed(note['versions'])]
+                    for note in self.find_notes(notebook_id, segment)]
+
+    def get_version(self, notebook_id, note_id, version_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            return dict((key, value) for key, value in version.items()
+                        if key != 'attachments')
+
+    def get_attachments(self, notebook_id, note_id, version_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            return sorted(version['attachments'].values(),
+                          key=lambda attachment: attachment['id'])
+
+    def get_attachment(self, notebook_id, note_id, version_id,
+                       attachment_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            return version['attachments'][int(attachment_id)]
+
+    def get_raw(self, notebook_id, note_id, version_id, attachment_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            if int(attachment_id) not in version['attachments']:
+                raise KeyError(attachment_id)
+            return self.files[int(attachment_id)]
+
+    def post_attachments(self, files, notebook_id, note_id, version_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            uploaded = [upload for upload in files
+                        if upload['name'] == 'file']
+            if not uploaded:
+                raise ValueError('No file uploaded')
+            content = uploaded[0]['content']
+            attachment = {
+                'id': self.next_id(),
+                'filename': uploaded[0]['filename'],
+                'fileextension': uploaded[0]['filename'].rpartition('.')[2],
+                'mimetype': uploaded[0]['content_type'],
+                'filesize': len(content),
+                'hash': md5(content).hexdigest()
+                }
+            version['attachments'][attachment['id']] = attachment
+            self.files[attachment['id']] = content
+            return attachment
+
+    def delete_attachment(self, notebook_id, note_id, version_id,
+                          attachment_id):
+        with self.lock:
+            version = self.find_version(notebook_id, note_id, version_id)
+            self.files.pop(int(attachment_id), None)
+            return version['attachments'].pop(int(attachment_id))
+
+    def get_tags(self):
+        with self.lock:
+            return sorted(self.tags.values(), key=lambda tag: tag['id'])
+
+    def post_tags(self, data):
+        with self.lock:
+            tag = {'id': self.next_id(), 'title': data['title'],
+                   'visibility': data.get('visibility', 0)}
+            self.tags[tag['id']] = tag
+            return tag
+
+    def get_tag(self, tag_id):
+        with self.lock:
+            return self.tags[int(tag_id)]
+
+    def get_tagged(self, tag_id):
+        with self.lock:
+            if int(tag_id) not in self.tags:
+                raise KeyError(tag_id)
+            return [self.note_json(note) for note in self.notes.values()
+                    if int(tag_id) in note['tags']]
+
+    def get_search(self, keyword):
+        keyword = b64decode(keyword).decode('UTF-8').lower()
+        with self.lock:
+            return [self.note_json(note) for note in self.notes.values()
+                    if keyword in note['title'].lower() or
+                    keyword in note['content'].lower()]
+
+    def get_i18n(self):
+        return {}
+
+    def get_i18nkey(self, key):
+        return key
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle's algorithm
+    # every response would wait for the delayed ack of the client.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_PUT(self):
+        self.handle_api('PUT')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return wrapper.decompress(body, self.headers.get('Content-Encoding'))
+
+    def handle_api(self, method):
+        server = self.server
+        body = self.read_body()
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        path = self.path.split('?')[0]
+        if not path.startswith(wrapper.api_version):
+            return self.respond(404, None)
+        if self.headers.get('Authorization') != server.authorization:
+            return self.respond(401, None)
+        if server.error_rate and server.random() < server.error_rate:
+            return self.respond(500, None)
+        path = path[len(wrapper.api_version):]
+        for keyword, regex in routes:
+            match = regex.match(path)
+            if match:
+                break
+        else:
+            return self.respond(404, None)
+        route = getattr(server.dataset, '{}_{}'.format(
+            method.lower(), keyword), None)
+        if route is None:
+            return self.respond(405, None)
+        try:
+            content_type = self.headers.get('Content-Type', '')
+            if content_type.startswith('multipart/form-data'):
+                response = route(form_files(body, content_type),
+                                 *match.groups())
+            elif method in ('POST', 'PUT'):
+                response = route(json.loads(body.decode('UTF-8')),
+                                 *match.groups())
+            else:
+                response = route(*match.groups())
+        except (KeyError, ValueError):
+            return self.respond(404, None)
+        if isinstance(response, bytes):
+            return self.respond_raw(response)
+        self.respond(200, response, method == 'GET')
+
+    def respond_raw(self, body):
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        if match:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)))
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def respond(self, status, response, cacheable=False):
+        body = json.dumps({'success': status == 200,
+                           'response': response}).encode('UTF-8')
+        headers = {'Content-Type': 'application/json'}
+        if cacheable:
+            headers['ETag'] = '"{}"'.format(md5(body).hexdigest())
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, body = 304, b''
+        if body and self.server.compress and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = wrapper.gzip_compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class Emulator(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, dataset=None, address=('127.0.0.1', 0), latency=0,
+                 error_rate=0, compress=True, user='user', passwd='passwd',
+                 seed=0):
+        """Http server answering requests of the api like a Paperwork host
+        of one user.
+
+        :param dataset: Empty if None.
+        :type dataset: Dataset
+        :param tuple address: Host and port, port 0 picks a free one.
+        :param latency: Seconds every response is delayed.
+        :type latency: int or float
+        :param float error_rate: Fraction of requests failing with 500.
+        :param bool compress: Gzip responses if the client accepts it.
+        :type user: str
+        :type passwd: str
+        :param int seed: Seed of the injected errors.
+        """
+        HTTPServer.__init__(self, address, Handler)
+        self.dataset = Dataset() if dataset is None else dataset
+        self.latency = latency
+        self.error_rate = error_rate
+        self.compress = compress
+        self.user = user
+        self.passwd = passwd
+        self.authorization = 'Basic ' + wrapper.b64('{}:{}'.format(
+            user, passwd))
+        self.random = random.Random(seed).random
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def host(self):
+        """Host to pass to the api, as host:port."""
+        return '{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        """Serves requests in a background thread and returns self.
+
+        :rtype: Emulator
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
@@ -0,0 +1,273 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Changes below the first path segment also change responses below these.
+dependents = {
+    'notebooks': ('tagged', 'search'),
+    'tags': ('notebooks', 'tagged', 'search')
+    }
+
+
+def related(path, other):
+    """Returns true if path and other are the same resource or one
+    contains the other. Segments listing several ids, like 'notes/1,2',
+    match segments with any of the ids.
+
+    :type path: str
+    :type other: str
+    :rtype: bool
+    """
+    for segment, other_segment in zip(path.split('/'), other.split('/')):
+        if segment != other_segment and \
+                not set(segment.split(',')) & set(other_segment.split(',')):
+            return False
+    return True
+
+
+class Entry:
+    def __init__(self, path, body, etag=None, last_modified=None,
+                 stored_at=None):
+        """Cached body of a GET response and its validators.
+
+        :param str path: Path of the request below the api version.
+        :type body: bytes
+        :type etag: str
+        :type last_modified: str
+        :param float stored_at: Time the body was stored or revalidated.
+        """
+        self.path = path
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+
+class MemoryBackend:
+    def __init__(self, max_size=8 * 1024 * 1024):
+        """Keeps entries in memory, evicting the least recently used once
+        their bodies exceed max_size bytes.
+
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, uri):
+        with self.lock:
+            entry = self.entries.pop(uri, None)
+            if entry is not None:
+                self.entries[uri] = entry
+            return entry
+
+    def put(self, uri, entry):
+        with self.lock:
+            old = self.entries.pop(uri, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self.entries[uri] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_size and self.entries:
+                self.size -= len(self.entries.popitem(last=False)[1].body)
+
+    def discard(self, uri):
+        with self.lock:
+            old = self.entries.pop(uri, None)
+            if old is not None:
+                self.size -= len(old.body)
+
+    def paths(self):
+        """Returns (uri, path) tuples of all entries.
+
+        :rtype: list
+        """
+        with self.lock:
+            return [(uri, entry.path) for uri, entry in self.entries.items()]
+
+
+class DiskBackend:
+    def __init__(self, path, max_size=64 * 1024 * 1024):
+        """Keeps entries in a SQLite database at path, evicting the least
+        recently used once their bodies exceed max_size bytes.
+
+        :type path: str
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'uri TEXT PRIMARY KEY, path TEXT NOT NULL, body BLOB NOT NULL, '
+            'etag TEXT, last_modified TEXT, stored_at REAL NOT NULL, '
+            'used_at REAL NOT NULL)')
+
+    def close(self):
+        """Closes the database."""
+        with self.lock:
+            self.db.close()
+
+    def get(self, uri):
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT path, body, etag, last_modified, stored_at '
+                'FROM responses WHERE uri = ?', (uri,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE responses SET used_at = ? WHERE uri = ?',
+                            (time.time(), uri))
+        path, body, etag, last_modified, stored_at = row
+        return Entry(path, bytes(body), etag, last_modified, stored_at)
+
+    def put(self, uri, entry):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(uri, path, body, etag, last_modified, stored_at, used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (uri, entry.path, sqlite3.Binary(entry.body), entry.etag,
+                 entry.last_modified, entry.stored_at, time.time()))
+            size = self.db.execute(
+                'SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses'
+                ).fetchone()[0]
+            rows = self.db.execute(
+                'SELECT uri, LENGTH(body) FROM responses '
+                'ORDER BY used_at').fetchall() if size > self.max_size else []
+            for evicted, length in rows:
+                if size <= self.max_size:
+                    break
+                self.db.execute('DELETE FROM responses WHERE uri = ?',
+                                (evicted,))
+                size -= length
+
+    def discard(self, uri):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM responses WHERE uri = ?', (uri,))
+
+    def paths(self):
+        """Returns (uri, path) tuples of all entries.
+
+        :rtype: list
+        """
+        with self.lock:
+            return self.db.execute(
+                'SELECT uri, path FROM responses').fetchall()
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=3600, max_age=0):
+        """Cache of GET responses for conditional requests. Cached bodies
+        are revalidated with If-None-Match and If-Modified-Since and
+        served again if the host answers 304 Not Modified.
+
+        :param backend: MemoryBackend if None.
+        :type backend: MemoryBackend or DiskBackend
+        :param ttl: Seconds an entry is kept after it was last validated.
+        :type ttl: int or float
+        :param max_age: Seconds after validation during which bodies are
+                        served without asking the host.
+        :type max_age: int or float
+        """
+        self.backend = MemoryBackend() if backend is None else backend
+        self.ttl = ttl
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def lookup(self, uri):
+        """Returns the entry for uri if it did not expire and whether it
+        can be served without revalidation.
+
+        :type uri: str
+        :rtype: Entry or None and bool
+        """
+        entry = self.backend.get(uri)
+        if entry is None:
+            return None, False
+        age = time.time() - entry.stored_at
+        if age > self.ttl:
+            self.backend.discard(uri)
+            return None, False
+        if age < self.max_age:
+            self._count('hits')
+            return entry, True
+        return entry, False
+
+    def conditions(self, entry):
+        """Returns the headers making a request conditional on entry.
+
+        :type entry: Entry or None
+        :rtype: dict
+        """
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def not_modified(self, uri, entry):
+        """Marks entry as validated by a 304 response and returns its body.
+
+        :type uri: str
+        :type entry: Entry
+        :rtype: bytes
+        """
+        self._count('revalidated')
+        entry.stored_at = time.time()
+        self.backend.put(uri, entry)
+        return entry.body
+
+    def store(self, uri, path, headers, body):
+        """Stores body of a successful response with headers, if it can be
+        revalidated or served from the cache.
+
+        :type uri: str
+        :type path: str
+        :param headers: Headers of the response, supporting get.
+        :type body: bytes
+        """
+        self._count('misses')
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag or last_modified or self.max_age > 0:
+            self.backend.put(uri, Entry(path, body, etag, last_modified))
+
+    def invalidate(self, path):
+        """Drops entries of path, resources containing it or contained in
+        it, and of resources depending on its first segment.
+
+        :param str path: Path of a changing request below the api version.
+        """
+        roots = dependents.get(path.split('/')[0], ())
+        for uri, cached in self.backend.paths():
+            if related(path, cached) or cached.split('/')[0] in roots:
+                logger.info('Invalidating cached {}'.format(cached))
+                self.backend.discard(uri)
+
+    def stats(self):
+        """Returns counters of the cache.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'entries': len(self.backend.paths())
+                }
@@ -0,0 +1,431 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import islice
+from operator import itemgetter
+
+from paperworks.search import SearchIndex
+
+
+def ngrams(title, n=3):
+    """Returns the set of lowercase character n-grams of title, padded so
+    that short titles and word starts produce grams too.
+
+    :type title: str
+    :type n: int
+    :rtype: set
+    """
+    padded = ' ' * (n - 1) + title.lower() + ' '
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class SortedView:
+    # At least this many pending items are sorted in in one pass instead
+    # of being inserted one at a time.
+    bulk_size = 64
+
+    def __init__(self):
+        """Items kept sorted by title and id, items with equal titles and
+        ids in insertion order. Supports len, in, iteration, indexing and
+        slicing; iterating works on a copy, so the view may change
+        meanwhile.
+
+        Items added with update are sorted in on the next access, so
+        loading many items sorts the view once."""
+        self.lock = threading.RLock()
+        # (title, id) keys and items in the same order, keys kept for
+        # bisecting.
+        self.keys = []
+        self.items = []
+        self.pending = []
+
+    def __len__(self):
+        with self.lock:
+            self._flush()
+            return len(self.items)
+
+    def __contains__(self, item):
+        with self.lock:
+            self._flush()
+            return self._find(item, item.title) is not None
+
+    def __iter__(self):
+        with self.lock:
+            self._flush()
+            return iter(list(self.items))
+
+    def __getitem__(self, index):
+        with self.lock:
+            self._flush()
+            return self.items[index]
+
+    def _find(self, item, title):
+        key = (title, item.id)
+        start = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, start)
+        for position in range(start, end):
+            if self.items[position] is item:
+                return position
+        return None
+
+    def _insert(self, item):
+        key = (item.title, item.id)
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.items.insert(position, item)
+
+    def _flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        added = set()
+        pairs = []
+        for item in pending:
+            if id(item) not in added and (
+                    not self.keys or self._find(item, item.title) is None):
+                added.add(id(item))
+                pairs.append(((item.title, item.id), item))
+        if len(pairs) < self.bulk_size:
+            for key, item in pairs:
+                self._insert(item)
+            return
+        # Stable and merging the sorted runs, equal keys stay in
+        # insertion order.
+        pairs.sort(key=itemgetter(0))
+        pairs = list(zip(self.keys, self.items)) + pairs
+        pairs.sort(key=itemgetter(0))
+        self.keys = [key for key, item in pairs]
+        self.items = [item for key, item in pairs]
+
+    def add(self, item):
+        """Adds item, if not in the view yet.
+
+        :type item: models.Model
+        """
+        with self.lock:
+            self._flush()
+            if self._find(item, item.title) is None:
+                self._insert(item)
+
+    def update(self, items):
+        """Adds items not in the view yet. They are sorted in at once on
+        the next access.
+
+        :type items: list
+        """
+        with self.lock:
+            self.pending.extend(items)
+
+    def discard(self, item, title=None):
+        """Removes item, which is sorted under title if given.
+
+        :type item: models.Model
+        :type title: str
+        """
+        title = item.title if title is None else title
+        with self.lock:
+            pending = [other for other in self.pending if other is not item]
+            if len(pending) < len(self.pending):
+                self.pending = pending
+            self._flush()
+            position = self._find(item, title)
+            if position is not None:
+                del(self.keys[position])
+                del(self.items[position])
+
+    def retitle(self, item, old_title):
+        """Moves item, sorted under old_title, to its current title.
+
+        :type item: models.Model
+        :type old_title: str
+        """
+        with self.lock:
+            self._flush()
+            position = self._find(item, old_title)
+            if position is not None:
+                del(self.keys[position])
+                del(self.items[position])
+                self._insert(item)
+
+    def range(self, start=None, end=None):
+        """Returns the items with start <= title < end. Open ends are
+        given as None.
+
+        :type start: str
+        :type end: str
+        :rtype: list
+        """
+        with self.lock:
+            self._flush()
+            # A key of the title alone sorts before all keys with it.
+            low = 0 if start is None else bisect_left(self.keys, (start,))
+            high = len(self.keys) if end is None \
+                else bisect_left(self.keys, (end,))
+            return self.items[low:high]
+
+
+class TitleIndex:
+    # Titles scored exactly per fuzzy query, chosen by shared n-grams.
+    max_candidates = 200
+    # N-grams shared by more than this share of the titles, and by more
+    # than max_candidates, do not choose candidates.
+    common_share = 0.1
+    # Fuzzy queries whose results are kept until a title changes.
+    cache_size = 256
+
+    def __init__(self):
+        """Maps titles to items. Several items may share a title, they are
+        kept in insertion order. An inverted n-gram index of the titles
+        serves fuzzy queries, a sorted view ordered listings. New titles
+        are added to the n-gram index on the next fuzzy query, so loading
+        does not wait for it."""
+        self.lock = threading.RLock()
+        self.items = {}
+        self.sorted = SortedView()
+        self.grams = {}
+        # Titles not in the n-gram index yet.
+        self.unindexed = set()
+        self.cache = {}
+
+    def add(self, item):
+        """:type item: models.Model"""
+        self.update([item])
+
+    def update(self, items):
+        """Adds items, sorting them into the sorted view at once.
+
+        :type items: list
+        """
+        with self.lock:
+            added = []
+            for item in items:
+                titled = self.items.get(item.title)
+                if titled is None:
+                    titled = self.items[item.title] = []
+                    self.unindexed.add(item.title)
+                if item not in titled:
+                    titled.append(item)
+                    added.append(item)
+            if added:
+                self.sorted.update(added)
+                self.cache.clear()
+
+    def remove(self, item, title=None):
+        """Removes item, which is indexed under title if given.
+
+        :type item: models.Model
+        :type title: str
+        """
+        title = item.title if title is None else title
+        with self.lock:
+            items = self.items.get(title)
+            if items and item in items:
+                items.remove(item)
+                self.sorted.discard(item, title)
+                self.cache.clear()
+                if not items:
+                    del(self.items[title])
+                    if title in self.unindexed:
+                        self.unindexed.discard(title)
+                    else:
+                        for gram in ngrams(title):
+                            titles = self.grams[gram]
+                            titles.discard(title)
+                            if not titles:
+                                del(self.grams[gram])
+
+    def _index_grams(self):
+        for title in self.unindexed:
+            for gram in ngrams(title):
+                titles = self.grams.get(gram)
+                if titles is None:
+                    self.grams[gram] = {title}
+                else:
+                    titles.add(title)
+        self.unindexed = set()
+
+    def __contains__(self, item):
+        with self.lock:
+            return item in self.items.get(item.title, ())
+
+    def get(self, title):
+        """Returns all items with title.
+
+        :type title: str
+        :rtype: list
+        """
+        with self.lock:
+            return list(self.items.get(title, ()))
+
+    def first(self, title):
+        """Returns the first item added with title.
+
+        :type title: str
+        :rtype: models.Model or None
+        """
+        with self.lock:
+            items = self.items.get(title)
+            return items[0] if items else None
+
+    def fuzzy(self, query, limit=1, cutoff=1):
+        """Returns up to limit (score, item) tuples of the items whose
+        titles match query best, scored with fuzz.ratio. Only the
+        max_candidates titles sharing the most n-grams with query are
+        scored. Common n-grams are skipped, unless no rarer one is in a
+        title. If no title shares any, the first max_candidates are
+        scored.
+
+        :type query: str
+        :type limit: int
+        :param int cutoff: Minimal score of returned items.
+        :rtype: list
+        """
+        key = (query, limit, cutoff)
+        with self.lock:
+            if key in self.cache:
+                return list(self.cache[key])
+            # Imported on first use, it is slow to import.
+            from fuzzywuzzy import fuzz
+            self._index_grams()
+            common = max(self.max_candidates,
+                         len(self.items) * self.common_share)
+            postings = sorted((self.grams[gram] for gram in ngrams(query)
+                               if gram in self.grams), key=len)
+            shared = Counter()
+            for titles in postings:
+                # Rarest first, so at least one n-gram is counted.
+                if shared and len(titles) > common:
+                    break
+                shared.update(titles)
+            if shared:
+                candidates = [title for title, count in
+                              shared.most_common(self.max_candidates)]
+            else:
+                candidates = list(islice(self.items, self.max_candidates))
+            scored = sorted(
+                ((fuzz.ratio(title, query), title) for title in candidates),
+                key=lambda scored: (-scored[0], scored[1]))
+            matches = []
+            for score, title in scored:
+                if score < cutoff or len(matches) >= limit:
+                    break
+                matches.extend((score, item) for item in self.items[title])
+            matches = matches[:limit]
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[key] = matches
+            return list(matches)
+
+
+class Index:
+    def __init__(self):
+        """Indexes of a paperwork instance: notes by id, notes, notebooks
+        and tags by title and the text of notes. Kept up to date by the
+        models, which also share the tuples of their tags here."""
+        self.lock = threading.RLock()
+        self.notes = {}
+        self.text = SearchIndex()
+        self.note_titles = TitleIndex()
+        self.notebook_titles = TitleIndex()
+        self.tag_titles = TitleIndex()
+        # Tuples of tags, so notes with the same tags share one tuple.
+        self.tag_tuples = {}
+
+    def add_note(self, note):
+        """Adds note, replacing an indexed note with the same id.
+
+        :type note: models.Note
+        """
+        self.add_notes([note])
+
+    def add_notes(self, notes):
+        """Adds notes, replacing indexed notes with the same ids. Their
+        titles are sorted in at once.
+
+        :type notes: list
+        """
+        with self.lock:
+            for note in notes:
+                old = self.notes.get(note.id)
+                if old is not None and old is not note:
+                    self.note_titles.remove(old)
+                self.notes[note.id] = note
+                self.index_text(note)
+            self.note_titles.update(
+                [note for note in notes if self.notes.get(note.id) is note])
+
+    def index_text(self, note):
+        """Indexes the text of note. An unloaded content is not fetched
+        if the note is indexed already, only its title is updated then,
+        as it is if the content can not be fetched.
+
+        :type note: models.Note
+        """
+        content = note.loaded_content
+        if content is None and note.id in self.text.notes:
+            self.text.retitle(note)
+            return
+        try:
+            self.text.add(note, content)
+        except IOError:
+            # Only the title is searchable until the content is loaded.
+            self.text.retitle(note)
+
+    def remove_note(self, note):
+        """:type note: models.Note"""
+        with self.lock:
+            if self.notes.get(note.id) is note:
+                del(self.notes[note.id])
+                self.text.remove(note.id)
+            self.note_titles.remove(note)
+
+    def add_notebook(self, notebook):
+        """Adds notebook and its notes.
+
+        :type notebook: models.Notebook
+        """
+        with self.lock:
+            self.notebook_titles.add(notebook)
+            self.add_notes(list(notebook.notes.values()))
+
+    def remove_notebook(self, notebook):
+        """Removes notebook and its notes.
+
+        :type notebook: models.Notebook
+        """
+        with self.lock:
+            self.notebook_titles.remove(notebook)
+            for note in list(notebook.notes.values()):
+                self.remove_note(note)
+
+    def add_tag(self, tag):
+        """:type tag: models.Tag"""
+        with self.lock:
+            self.tag_titles.add(tag)
+
+    def retitle(self, item, old_title):
+        """Moves item, indexed under old_title, to its current title.
+
+        :type item: models.Model
+        :type old_title: str
+        """
+        with self.lock:
+            for titles in (self.note_titles, self.notebook_titles,
+                           self.tag_titles):
+                with titles.lock:
+                    if item in titles.items.get(old_title, ()):
+                        titles.remove(item, old_title)
+                        titles.add(item)
+
+    def changed(self, item, name, old):
+        """Updates the indexes after the attribute name of item changed.
+
+        :type item: models.Model
+        :type name: str
+        :param old: Previous value of the attribute.
+        """
+        with self.lock:
+            if name == 'title':
+                self.retitle(item, old)
+            if self.notes.get(item.id) is item:
+                self.index_text(item)
@@ -0,0 +1,161 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_bounds(smallest=0.0005, largest=120.0, factor=1.25):
+    """Returns upper bounds of latency buckets in seconds, growing by
+    factor from smallest to largest.
+
+    :rtype: list
+    """
+    bounds = [smallest]
+    while bounds[-1] < largest:
+        bounds.append(bounds[-1] * factor)
+    return bounds
+
+
+class Histogram:
+    # Shared by all histograms, percentiles are precise to the factor.
+    bounds = bucket_bounds()
+
+    def __init__(self):
+        """Latency histogram with fixed logarithmic buckets, so its size
+        does not grow with the number of recorded values."""
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """:param float value: Latency in seconds."""
+        low, high = 0, len(self.bounds)
+        while low < high:
+            middle = (low + high) // 2
+            if self.bounds[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        self.counts[low] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Returns the estimated latency below which percent of the values
+        are, interpolated within its bucket.
+
+        :type percent: int or float
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) \
+                    else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(value, self.max)
+            seen += count
+        return self.max
+
+
+class Endpoint:
+    def __init__(self):
+        """Counters of requests to one endpoint."""
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+
+
+class Monitor:
+    def __init__(self):
+        """Collects counters and latency histograms of requests by method
+        and api_path keyword, and passes every request to hooks. Safe to
+        use from several threads."""
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """Calls hook with a dict of method, keyword, duration,
+        bytes_sent, bytes_received and error after every request.
+
+        :type hook: callable
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """:type hook: callable"""
+        self.hooks.remove(hook)
+
+    def record(self, method, keyword, duration, sent=0, received=0,
+               error=False):
+        """Records a finished request.
+
+        :type method: str
+        :type keyword: str
+        :param float duration: Seconds the request took.
+        :param int sent: Bytes of the request body.
+        :param int received: Bytes of the response body.
+        :param bool error: True if the request failed.
+        """
+        with self.lock:
+            endpoint = self.endpoints.get((method, keyword))
+            if endpoint is None:
+                endpoint = self.endpoints[(method, keyword)] = Endpoint()
+            endpoint.requests += 1
+            endpoint.errors += bool(error)
+            endpoint.bytes_sent += sent
+            endpoint.bytes_received += received
+            endpoint.latency.add(duration)
+        event = {
+            'method': method,
+            'keyword': keyword,
+            'duration': duration,
+            'bytes_sent': sent,
+            'bytes_received': received,
+            'error': bool(error)
+            }
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as e:
+                logger.error('Metrics hook failed: {}'.format(e))
+
+    def reset(self):
+        """Drops all recorded requests."""
+        with self.lock:
+            self.endpoints = {}
+
+    def snapshot(self):
+        """Returns the counters and latency percentiles in seconds of every
+        endpoint, keyed by method and keyword like 'GET notes'.
+
+        :rtype: dict
+        """
+        snapshot = {}
+        with self.lock:
+            for (method, keyword), endpoint in self.endpoints.items():
+                latency = endpoint.latency
+                snapshot['{} {}'.format(method, keyword)] = {
+                    'method': method,
+                    'keyword': keyword,
+                    'requests': endpoint.requests,
+                    'errors': endpoint.errors,
+                    'bytes_sent': endpoint.bytes_sent,
+                    'bytes_received': endpoint.bytes_received,
+                    'total': latency.total,
+                    'mean': latency.total / latency.count,
+                    'p50': latency.percentile(50),
+                    'p95': latency.percentile(95),
+                    'p99': latency.percentile(99),
+                    'max': latency.max
+                    }
+        return snapshot
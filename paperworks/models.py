@@ -1,44 +1,248 @@
 from paperworks import wrapper
-from fuzzywuzzy import fuzz
+from paperworks.batching import as_list
+from paperworks.index import Index, SortedView
+import calendar
 import logging
-from threading import Thread
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, \
+    wait as wait_futures
+from functools import wraps
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 try:
     isinstance('string', basestring)
 except NameError:
     basestring = str
 
+try:
+    from sys import intern
+except ImportError:
+    pass
+
 logger = logging.getLogger(__name__)
 
 use_threading = False
+# Notes loaded from json are added to their notebook in batches of this
+# many, so views and indexes are sorted once per batch.
+load_batch = 1000
+# Size of the shared executor and the maximum of calls waiting in it. Both
+# are read when the executor is created, call shutdown() to apply changes.
+max_workers = 8
+queue_limit = 256
+
+_executor = None
+_slots = None
+_pending = set()
+_failed = []
+_lock = threading.Lock()
+_local = threading.local()
+
+# Dirty fields of synchronized models, shared by all of them.
+no_changes = frozenset()
+
+
+def timestamp(value):
+    """Returns an updated_at value of the host, like '2014-09-20 19:43:59',
+    as seconds since the epoch. Integers are returned as they are, empty
+    values as 0.
+
+    :type value: str or int
+    :rtype: int
+    """
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    try:
+        return calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    except ValueError:
+        logger.error('Invalid timestamp {}'.format(value))
+        return 0
+
+
+def shared_tags(tags, shared=None):
+    """Returns tags as a tuple sorted by id, the same tuple for equal tags
+    in shared.
+
+    :type tags: list or set or tuple
+    :param dict shared: Maps tuples of tags to the one notes share.
+    :rtype: tuple
+    """
+    tags = tuple(sorted(tags, key=lambda tag: tag.id))
+    if shared is None:
+        return tags
+    return shared.setdefault(tags, tags)
+
+
+def executor():
+    """Returns the executor shared by all threaded methods."""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers)
+            _slots = threading.BoundedSemaphore(queue_limit)
+        return _executor
+
+
+def shutdown(wait=True):
+    """Shuts the shared executor down. A new one is created on next use.
+
+    :param bool wait: Block until pending calls finished.
+    """
+    global _executor
+    with _lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait)
+
+
+def wait(timeout=None):
+    """Blocks until all background calls finished or timeout passed.
+    Returns the futures not yet done.
+
+    :type timeout: int or float or None
+    :rtype: set
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        with _lock:
+            pending = list(_pending)
+        if not pending:
+            return set()
+        remaining = None if deadline is None \
+            else max(0, deadline - time.time())
+        not_done = wait_futures(pending, remaining).not_done
+        if not_done:
+            return not_done
+
+
+def pop_failed():
+    """Returns exceptions of failed background calls since the last call.
+
+    :rtype: list
+    """
+    global _failed
+    with _lock:
+        failed, _failed = _failed, []
+    return failed
+
+
+def _finished(future, slots):
+    with _lock:
+        _pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(future.exception())
+            _failed.append(future.exception())
+    slots.release()
+
+
+def _submit(func, *args, **kwargs):
+    def task():
+        _local.worker = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.worker = False
+
+    pool = executor()
+    slots = _slots
+    slots.acquire()
+    try:
+        future = pool.submit(task)
+    except Exception:
+        slots.release()
+        raise
+    with _lock:
+        _pending.add(future)
+    future.add_done_callback(lambda future: _finished(future, slots))
+    return future
 
 
 def threaded_method(func):
-    """Decorator to put a function into background after calling,
-    if threading is enabled."""
+    """Decorator to put a function into the shared executor after calling,
+    if threading is enabled. Returns a future of the result either way.
+
+    Calling blocks while queue_limit calls are pending. Calls made from
+    within a background call run inline, so they can not wait for a slot
+    held by their caller."""
+    @wraps(func)
     def run(*args, **kwargs):
-        if use_threading:
-            Thread(target=func, args=args, kwargs=kwargs).start()
-        else:
-            func(*args, **kwargs)
+        if use_threading and not getattr(_local, 'worker', False):
+            return _submit(func, *args, **kwargs)
+        future = Future()
+        future.set_result(func(*args, **kwargs))
+        return future
     return run
 
 
 class Model:
-    def __init__(self, title, id, api):
-        """Model for paperwork-objects.
+    __slots__ = ('dirty', 'id', 'title')
+    # Attributes whose changes mark the model as dirty.
+    tracked = ('title',)
+
+    def __init__(self, title, id):
+        """Model for paperwork-objects. Titles are interned, timestamps
+        stored as seconds since the epoch.
 
         :type title: str
         :type id: integer
-        :type api: wrapper.api
         """
-        self.id = int(id)
-        self.title = title
-        self.api = api
+        # Initial values are set directly, there are no changes to track.
+        set_slot = object.__setattr__
+        set_slot(self, 'dirty', no_changes)
+        set_slot(self, 'id', int(id))
+        set_slot(self, 'title', intern(title) if type(title) is str
+                 else title)
 
     def __str__(self):
         return "{}:'{}'".format(self.id, self.title)
 
+    def __setattr__(self, name, value):
+        if name not in self.tracked and name != 'updated_at':
+            super().__setattr__(name, value)
+            return
+        if name == 'title' and type(value) is str:
+            value = intern(value)
+        elif name == 'updated_at':
+            value = timestamp(value)
+        old = self.stored(name, value)
+        if name in self.tracked and old != value:
+            self.dirty = self.dirty | set([name])
+        super().__setattr__(name, value)
+        if name == 'title' and old != value:
+            self.retitled(old)
+        if name in self.tracked and old != value and self.index is not None:
+            self.index.changed(self, name, old)
+
+    def stored(self, name, default):
+        """Returns the stored value of attribute name, without loading it.
+
+        :type name: str
+        :param default: Returned if the attribute is not set.
+        """
+        return getattr(self, name, default)
+
+    def retitled(self, old_title):
+        """Called after the title changed from old_title, to update views
+        sorting the model.
+
+        :type old_title: str
+        """
+        pass
+
+    def clean(self):
+        """Marks all fields as synchronized with the host."""
+        self.dirty = no_changes
+
     def to_json(self):
         """Returns model as dict."""
         return {
@@ -59,18 +263,28 @@ class Model:
 
 
 class Notebook(Model):
+    __slots__ = ('api', 'index', 'contents', 'type', 'updated_at', 'notes',
+                 'sorted_notes')
+
     def __init__(self, title, id, api, type=0, updated_at=''):
         """Notebook paperwork-object.
 
         :type title: str
         :type id: integer
         :type api: wrapper.api
-        :type updated_at: str
+        :type updated_at: str or int
         """
-        super().__init__(title, id, api)
-        self.type = type
-        self.updated_at = updated_at
-        self.notes = {}
+        super().__init__(title, id)
+        set_slot = object.__setattr__
+        # Index and content cache of the paperwork instance the notebook
+        # belongs to.
+        set_slot(self, 'index', None)
+        set_slot(self, 'contents', None)
+        set_slot(self, 'api', api)
+        set_slot(self, 'type', type)
+        set_slot(self, 'updated_at', timestamp(updated_at))
+        set_slot(self, 'notes', {})
+        set_slot(self, 'sorted_notes', SortedView())
 
     def to_json(self):
         """Returns notebook as dict."""
@@ -92,7 +306,7 @@ class Notebook(Model):
             json['id'],
             api,
             type=json['type'],
-            updated_at='')
+            updated_at=json.get('updated_at', ''))
 
     @classmethod
     def create(cls, api, title):
@@ -122,20 +336,36 @@ class Notebook(Model):
         if remote is None:
             logger.error('Remote notebook could not be found.'
                          'Wrong id or deleted.')
-        elif force or remote['updated_at'] < self.updated_at:
-            self.updated_at = self.api.update_notebook(
-                self.to_json())['updated_at']
+        elif force or timestamp(remote['updated_at']) < self.updated_at:
+            self.push()
         else:
             logger.info('Remote version is higher.'
                         'Updating local notebook.')
-            self.title = remote['title']
-            self.updated_at = remote['updated_at']
+            self.pull(remote)
 
-    def get_notes(self):
-        """Returns notes in an alphabetically sorted list.
+    def push(self):
+        """Sends the local notebook to the host."""
+        self.updated_at = self.api.update_notebook(
+            self.to_json())['updated_at']
+        self.clean()
+
+    def pull(self, remote):
+        """Overwrites the local notebook with the remote one.
+
+        :param dict remote: Notebook as returned by the host.
+        """
+        self.title = remote['title']
+        self.updated_at = remote['updated_at']
+        self.clean()
 
+    def get_notes(self, start=None, end=None):
+        """Returns notes in an alphabetically sorted list, optionally only
+        those with start <= title < end.
+
+        :type start: str
+        :type end: str
         :rtype: list"""
-        return sorted(self.notes.values(), key=lambda note: note.title)
+        return self.sorted_notes.range(start, end)
 
     @threaded_method
     def create_note(self, title):
@@ -144,45 +374,225 @@ class Notebook(Model):
         :type title: str
         """
         note = Note.create(title, self)
-        self.notes[note.id] = note
+        self.add_note(note)
         logger.info('Created note {} in {}'.format(note, self))
 
-    @threaded_method
     def add_note(self, note):
         """Adds a note to the notebook.
 
         :type note: models.Note"""
-        self.notes[note.id] = note
-        logger.info('Added note {} to {}'.format(note, self))
-
-    def download(self, tags):
-        """Downloads notes.
+        self.add_notes([note])
+
+    def add_notes(self, notes):
+        """Adds notes to the notebook, replacing notes with the same ids.
+        Many notes are sorted into the views and indexes at once.
+
+        :type notes: list"""
+        if not notes:
+            return
+        for note in notes:
+            old = self.notes.get(note.id)
+            if old is not None and old is not note:
+                self.remove_note(old)
+            if note.notebook is not self:
+                note.notebook = self
+            self.notes[note.id] = note
+        notes = [note for note in notes if self.notes.get(note.id) is note]
+        self.sorted_notes.update(notes)
+        tagged = {}
+        for note in notes:
+            for tag in note.tags:
+                tagged.setdefault(tag, []).append(note)
+        for tag, tag_notes in tagged.items():
+            tag.notes.update(tag_notes)
+        if self.index is not None:
+            self.index.add_notes(notes)
+        for note in notes:
+            note.unload()
+        logger.info('Added {} notes to {}'.format(len(notes), self))
+
+    def remove_note(self, note, keep_indexed=False):
+        """Removes a note from the notebook, the host is not changed.
+
+        :type note: models.Note
+        :param bool keep_indexed: Keep the note in the index, when it is
+                                  added to another notebook with it.
+        """
+        if self.notes.get(note.id) is note:
+            del(self.notes[note.id])
+        self.sorted_notes.discard(note)
+        for tag in list(note.tags):
+            tag.notes.discard(note)
+        if self.index is not None and not keep_indexed:
+            self.index.remove_note(note)
+
+    def download(self, tags, stream=False):
+        """Downloads notes. Returns false if the download failed, the
+        notes received until then are kept.
 
         :param dict tags: Tags of the paperwork instance.
+        :param bool stream: Add notes one at a time while the response is
+                            received, instead of after reading all of it.
+        :rtype: bool
         """
-        notes_json = self.api.list_notebook_notes(self.id)
         logger.info('Downloading notes of notebook {}'.format(self))
+        try:
+            if stream:
+                notes_json = self.api.iter_notebook_notes(self.id)
+            else:
+                notes_json = self.api.list_notebook_notes(self.id)
+                if notes_json is None:
+                    raise ValueError('Listing notes failed.')
+            self.load(notes_json, tags)
+        except Exception as e:
+            self.download_failed(e)
+            return False
+        return True
+
+    def download_failed(self, error):
+        """Marks the notes as incomplete after their download failed.
+        updated_at is reset, so the next synchronization downloads them
+        again.
+
+        :type error: Exception
+        """
+        logger.error('Downloading notes of notebook {} failed: {}'.format(
+            self, error))
+        self.updated_at = ''
+
+    def load(self, notes_json, tags):
+        """Adds notes from already downloaded or streamed json, load_batch
+        notes at a time.
+
+        :type notes_json: list
+        :param dict tags: Tags of the paperwork instance.
+        """
+        shared = self.index.tag_tuples if self.index is not None else None
+        notes = []
+        try:
+            for note_json in notes_json:
+                note = Note.from_json(note_json, self)
+                note.tags = shared_tags(
+                    [tags[int(tag['id'])] for tag in note_json['tags']],
+                    shared)
+                notes.append(note)
+                if len(notes) >= load_batch:
+                    self.add_notes(notes)
+                    notes = []
+        finally:
+            # Notes received before a failure are kept.
+            self.add_notes(notes)
+
+    def merge(self, notes_json, tags):
+        """Replaces notes whose updated_at differs from notes_json and
+        removes notes missing in it. Notes with local changes are kept.
+        Returns the changed notes and the ids of the removed ones.
+
+        :type notes_json: list
+        :param dict tags: Tags of the paperwork instance.
+        :rtype: list and set
+        """
+        changed = []
         for note_json in notes_json:
-            note = Note.from_json(note_json, self)
-            self.add_note(note)
-            note.add_tags([tags[int(tag['id'])] for tag in note_json['tags']])
+            note = self.notes.get(int(note_json['id']))
+            if note is not None and note.dirty:
+                continue
+            if note is None or \
+                    note.updated_at != timestamp(note_json['updated_at']):
+                note = Note.from_json(note_json, self)
+                self.add_note(note)
+                note.add_tags(
+                    [tags[int(tag['id'])] for tag in note_json['tags']])
+                note.clean()
+                changed.append(note)
+        removed = set(note_id for note_id, note in self.notes.items()
+                      if not note.dirty) - set(
+            int(note_json['id']) for note_json in notes_json)
+        for note_id in removed:
+            self.remove_note(self.notes[note_id])
+        return changed, removed
 
 
 class Note(Model):
+    __slots__ = ('notebook', '_content', 'updated_at', 'tags')
+    tracked = ('title', 'content')
+
     def __init__(self, title, id, notebook, content='', updated_at=''):
         """Note paperwork-object.
 
+        In notebooks with a content cache synchronized contents are moved
+        into the cache and loaded from it or the host on access.
+
         :type title: str
         :type id: int or str
         :type notebook: Notebook
         :type content: str
-        :type updated_at: str
+        :type updated_at: str or int
         """
-        super().__init__(title, id, notebook.api)
-        self.notebook = notebook
-        self.content = content
-        self.updated_at = updated_at
-        self.tags = set()
+        super().__init__(title, id)
+        set_slot = object.__setattr__
+        set_slot(self, 'notebook', notebook)
+        set_slot(self, '_content', content)
+        set_slot(self, 'updated_at', timestamp(updated_at))
+        set_slot(self, 'tags', ())
+
+    @property
+    def api(self):
+        """Api of the notebook the note is in."""
+        return self.notebook.api
+
+    @property
+    def index(self):
+        """Index of the notebook the note is in."""
+        return self.notebook.index
+
+    @property
+    def content(self):
+        """Content of the note, fetched through the content cache of the
+        notebook if not loaded. Raises IOError if it can not be fetched,
+        so a missing content is never sent to the host."""
+        content = self._content
+        if content is None and self.notebook.contents is not None:
+            content = self.notebook.contents.fetch([self]).get(self.id)
+            if content is None:
+                raise IOError('Content of note {} could not be '
+                              'loaded.'.format(self))
+        return content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    @property
+    def loaded_content(self):
+        """Content of the note if it is loaded, else None."""
+        return self._content
+
+    def stored(self, name, default):
+        # An unloaded content counts as changed instead of being fetched.
+        if name == 'content':
+            name = '_content'
+        return getattr(self, name, default)
+
+    def unload(self):
+        """Moves a synchronized content into the content cache of the
+        notebook, if it has one."""
+        contents = self.notebook.contents
+        content = self._content
+        if contents is not None and content is not None and \
+                'content' not in self.dirty:
+            contents.put(self.id, content)
+            self._content = None
+
+    def clean(self):
+        """Marks all fields as synchronized with the host."""
+        super().clean()
+        self.unload()
+
+    def retitled(self, old_title):
+        self.notebook.sorted_notes.retitle(self, old_title)
+        for tag in list(self.tags):
+            tag.notes.retitle(self, old_title)
 
     def to_json(self):
         """Returns note as dict."""
@@ -238,34 +648,52 @@ class Note(Model):
         if remote is None:
             logger.error('Remote note could not be found. Wrong id,'
                          'deleted or moved to another notebook')
-        elif force or remote['updated_at'] <= self.updated_at:
+        elif force or timestamp(remote['updated_at']) <= self.updated_at:
             logger.info('Remote version is lower or force update.'
                         'Updating remote note.')
-            self.updated_at = self.api.update_note(
-                self.to_json())['updated_at']
+            self.push()
         else:
             logger.info('Remote version is higher. Updating local note.')
-            self.title = remote['title']
-            self.content = remote['content']
-            self.updated_at = remote['updated_at']
+            self.pull(remote)
+
+    def push(self):
+        """Sends the local note to the host. Raises IOError without
+        sending anything if its unloaded content can not be fetched."""
+        self.updated_at = self.api.update_note(
+            self.to_json())['updated_at']
+        self.clean()
+
+    def pull(self, remote):
+        """Overwrites the local note with the remote one.
+
+        :param dict remote: Note as returned by the host.
+        """
+        self.title = remote['title']
+        self.content = remote['content']
+        self.updated_at = remote['updated_at']
+        self.clean()
 
     @threaded_method
     def delete(self):
         """Deletes note from remote host and notebook."""
         logger.info('Deleting note {} in notebook {}'.format(
             self, self.notebook))
-        if self.id in self.notebook.notes:
-            del(self.notebook.notes[self.id])
+        self.notebook.remove_note(self)
         self.api.delete_note(self.to_json())
 
-    @threaded_method
     def add_tags(self, tags):
         """Adds a collection of tags to the note.
 
         :type tags: list or set"""
+        index = self.notebook.index
+        shared = index.tag_tuples if index is not None else None
         for tag in tags:
             logger.info('Adding tag {} to note {}'.format(tag, self))
-            self.tags.add(tag)
+            if tag not in self.tags:
+                self.tags = shared_tags(self.tags + (tag,), shared)
+                self.dirty = self.dirty | set(['tags'])
+            if self.notebook.notes.get(self.id) is self:
+                tag.notes.add(self)
 
     @threaded_method
     def move_to(self, new_notebook):
@@ -273,12 +701,19 @@ class Note(Model):
 
         :type new_notebook: Notebook
         """
-        self.api.move_note(self.to_json(), new_notebook.id)
-        del(self.notebook.notes[self.id])
+        # Moving needs the ids only, an unloaded content is not fetched.
+        note_json = self.to_json() if self.loaded_content is not None \
+            else {'id': self.id, 'notebook_id': self.notebook.id}
+        self.api.move_note(note_json, new_notebook.id)
+        # Indexed again, the unloaded content would be fetched.
+        self.notebook.remove_note(
+            self, keep_indexed=self.index is new_notebook.index)
         new_notebook.add_note(self)
 
 
 class Tag(Model):
+    __slots__ = ('api', 'index', 'visibility', 'notes')
+
     def __init__(self, title, id, api, visibility=0):
         """Tag paperwork-object.
 
@@ -287,9 +722,14 @@ class Tag(Model):
         :type api: wrapper.api
         :type visibility: int
         """
-        super().__init__(title, id, api)
-        self.visibility = visibility
-        self.notes = set()
+        super().__init__(title, id)
+        set_slot = object.__setattr__
+        # Index of the paperwork instance the tag belongs to.
+        set_slot(self, 'index', None)
+        set_slot(self, 'api', api)
+        set_slot(self, 'visibility', visibility)
+        # Notes with the tag, sorted by title.
+        set_slot(self, 'notes', SortedView())
 
     def to_json(self):
         """Returns tag as dict."""
@@ -313,24 +753,43 @@ class Tag(Model):
             json['visibility']
             )
 
-    def get_notes(self):
-        """Returns notes in a sorted list.
+    def get_notes(self, start=None, end=None):
+        """Returns notes in a sorted list, optionally only those with
+        start <= title < end.
 
+        :type start: str
+        :type end: str
         :rtype: list"""
-        return sorted(self.notes, key=lambda note: note.title)
+        return self.notes.range(start, end)
 
 
 class Paperwork:
-    def __init__(self, user, passwd, host):
+    def __init__(self, user, passwd, host, pool=None, contents=None,
+                 http_cache=None, batch_window=None):
         """Paperwork object.
 
         :type user: str
         :type passwd: str
         :type host: str
+        :type pool: wrapper.ConnectionPool
+        :param contents: Keeps contents of notes loaded lazily, all
+                         contents stay loaded if None.
+        :type contents: contents.ContentCache
+        :param http_cache: Caches GET responses for conditional requests.
+        :type http_cache: httpcache.ResponseCache
+        :param batch_window: Seconds single notes requested concurrently,
+                             like by threaded updates, are collected to
+                             be fetched in one request. None disables.
+        :type batch_window: int or float
         """
         self.notebooks = {}
         self.tags = {}
-        self.api = wrapper.api()
+        self.index = Index()
+        self.contents = contents
+        self.timings = {}
+        self.incomplete = []
+        self.api = wrapper.api(pool=pool, cache=http_cache,
+                               batch_window=batch_window)
         self.authenticated = self.api.basic_authentication(host, user, passwd)
 
     def create_notebook(self, title):
@@ -341,7 +800,7 @@ class Paperwork:
         """
         if title != 'All Notes':
             notebook = Notebook.create(self.api, title)
-            self.notebooks[notebook.id] = notebook
+            self.add_notebook(notebook)
             logger.info('Created notebook {}'.format(notebook))
             return notebook
 
@@ -352,9 +811,8 @@ class Paperwork:
         :type nb: Notebook
         """
         nb.delete()
-        del(self.notebooks[nb.id])
+        self.remove_notebook(nb)
 
-    @threaded_method
     def add_notebook(self, notebook):
         """Adds notebook to paperwork.
 
@@ -362,57 +820,431 @@ class Paperwork:
         """
         if notebook.id != 0:
             self.notebooks[notebook.id] = notebook
+            notebook.index = self.index
+            notebook.contents = self.contents
+            self.index.add_notebook(notebook)
+            for note in list(notebook.notes.values()):
+                note.unload()
             logger.info('Added notebook {}'.format(notebook))
 
-    @threaded_method
+    def remove_notebook(self, nb):
+        """Removes notebook from paperwork, the host is not changed.
+
+        :type nb: Notebook
+        """
+        if self.notebooks.get(nb.id) is nb:
+            del(self.notebooks[nb.id])
+        self.index.remove_notebook(nb)
+        nb.index = None
+
     def add_tag(self, tag):
         """Adds tag to paperwork.
 
         :type tag: Tag
         """
         self.tags[tag.id] = tag
+        tag.index = self.index
+        self.index.add_tag(tag)
         logger.info('Added tag {}'.format(tag))
 
-    def download(self):
-        """Downloading tags, notebooks and notes from host."""
+    def download(self, workers=1, stream=False):
+        """Downloading tags, notebooks and notes from host.
+
+        Durations of the phases are stored in timings, notebooks whose
+        notes could not be downloaded completely in incomplete.
+
+        :param int workers: With more than one worker tags and notebooks
+                            are requested at once and notes of up to
+                            workers notebooks concurrently.
+        :param bool stream: Parse notes one at a time while they are
+                            received, so no complete response of a
+                            notebook is held in memory.
+        """
         logger.info('Downloading all')
+        start = time.time()
+        self.timings = {}
+        self.incomplete = []
+        if workers > 1:
+            self._download_parallel(workers, stream)
+        else:
+            logger.info('Downloading tags')
+            self.load_tags(self.api.list_tags())
+            tags_done = time.time()
+            self.timings['tags'] = tags_done - start
+
+            logger.info('Downloading notebooks')
+            notebooks = self.load_notebooks(self.api.list_notebooks())
+            notebooks_done = time.time()
+            self.timings['notebooks'] = notebooks_done - tags_done
+
+            for notebook in notebooks:
+                if not notebook.download(self.tags, stream):
+                    self.incomplete.append(notebook)
+            self.timings['notes'] = time.time() - notebooks_done
+        self.timings['total'] = time.time() - start
+        logger.info('Downloaded in {total:.3f}s (tags {tags:.3f}s, '
+                    'notebooks {notebooks:.3f}s, notes {notes:.3f}s)'.format(
+                        **self.timings))
+
+    def _download_parallel(self, workers, stream=False):
+        def timed(phase, func, *args):
+            start = time.time()
+            try:
+                return func(*args)
+            finally:
+                self.timings[phase] = time.time() - start
+
+        with ThreadPoolExecutor(workers) as executor:
+            logger.info('Downloading tags and notebooks')
+            tags = executor.submit(timed, 'tags', self.api.list_tags)
+            notebooks = executor.submit(
+                timed, 'notebooks', self.api.list_notebooks)
+            self.load_tags(tags.result())
+            notebooks = self.load_notebooks(notebooks.result())
+
+            start = time.time()
+            if stream:
+                self._stream_notes(executor, notebooks, workers)
+            else:
+                futures = dict(
+                    (executor.submit(self.api.list_notebook_notes, nb.id),
+                     nb)
+                    for nb in notebooks)
+                # Results are merged here, in the calling thread only.
+                for future in as_completed(futures):
+                    notebook = futures[future]
+                    try:
+                        notes_json = future.result()
+                        if notes_json is None:
+                            raise ValueError('Listing notes failed.')
+                        notebook.load(notes_json, self.tags)
+                    except Exception as e:
+                        notebook.download_failed(e)
+                        self.incomplete.append(notebook)
+                        continue
+                    logger.info('Downloaded notes of notebook {}'.format(
+                        notebook))
+            self.timings['notes'] = time.time() - start
+
+    def _stream_notes(self, executor, notebooks, workers):
+        # Workers parse the responses, notes are added in the calling
+        # thread. The bounded queue keeps few parsed notes in memory,
+        # besides batches of up to load_batch notes per notebook.
+        parsed = Queue(2 * workers)
+        errors = {}
+
+        def stream(notebook):
+            try:
+                for note_json in self.api.iter_notebook_notes(notebook.id):
+                    parsed.put((notebook, note_json))
+            except Exception as e:
+                errors[notebook] = e
+            finally:
+                parsed.put((notebook, None))
+
+        for notebook in notebooks:
+            executor.submit(stream, notebook)
+        remaining = len(notebooks)
+        failed = None
+        # Notes are added in batches, views are sorted once per batch.
+        received = dict((notebook, []) for notebook in notebooks)
+        while remaining:
+            notebook, note_json = parsed.get()
+            batch = received[notebook]
+            if note_json is not None:
+                batch.append(note_json)
+            if failed is None and batch and \
+                    (note_json is None or len(batch) >= load_batch):
+                try:
+                    notebook.load(batch, self.tags)
+                except Exception as e:
+                    # Keep draining, so no worker blocks on the queue.
+                    failed = e
+                del(batch[:])
+            if note_json is None:
+                remaining -= 1
+                if notebook in errors:
+                    notebook.download_failed(errors[notebook])
+                    self.incomplete.append(notebook)
+                else:
+                    logger.info('Downloaded notes of notebook {}'.format(
+                        notebook))
+        if failed is not None:
+            raise failed
+
+    def load_tags(self, tags_json):
+        """Adds tags from json. Known tags are updated in place, so notes
+        keep referencing them.
+
+        :type tags_json: list
+        """
+        for tag_json in tags_json:
+            tag = self.tags.get(int(tag_json['id']))
+            if tag is None:
+                self.add_tag(Tag.from_json(tag_json, self.api))
+            elif not tag.dirty:
+                tag.title = tag_json['title']
+                tag.visibility = tag_json['visibility']
+                tag.clean()
+
+    def load(self, store):
+        """Fills the instance from a local cache. Returns false if the
+        cache is empty.
+
+        :type store: cache.Store
+        :rtype: bool
+        """
+        return store.load(self)
+
+    def save(self, store):
+        """Writes the instance to a local cache.
+
+        :type store: cache.Store
+        """
+        store.save(self)
+
+    def sync(self, store, workers=1):
+        """Brings an instance loaded from store up to date with the host.
 
-        logger.info('Downloading tags')
-        for tag in self.api.list_tags():
-            tag = Tag.from_json(tag, self.api)
-            self.tags[tag.id] = tag
+        Notes are only downloaded for notebooks whose updated_at changed,
+        only notes whose updated_at changed are replaced and written to
+        store. All requests are done before the instance is changed.
 
-        logger.info('Downloading notebooks')
-        for notebook in self.api.list_notebooks():
+        :type store: cache.Store
+        :param int workers: Number of concurrent requests.
+        """
+        fetched = self.fetch_changes(workers)
+        if fetched is not None:
+            self.apply_changes(store, fetched)
+
+    def fetch_changes(self, workers=1):
+        """Requests what sync needs to bring the instance up to date and
+        returns it for apply_changes, or None if the requests failed. The
+        instance is not changed, so this can run in a background thread
+        while the instance is used.
+
+        :param int workers: Number of concurrent requests.
+        :rtype: tuple or None
+        """
+        logger.info('Synchronizing with host')
+        known = dict((notebook_id, notebook.updated_at)
+                     for notebook_id, notebook in list(self.notebooks.items()))
+        with ThreadPoolExecutor(max(workers, 1)) as pool:
+            tags_json = pool.submit(self.api.list_tags)
+            notebooks_json = pool.submit(self.api.list_notebooks)
+            tags_json = tags_json.result()
+            notebooks_json = notebooks_json.result()
+            if tags_json is None or notebooks_json is None:
+                logger.error('Synchronizing failed, keeping cached state.')
+                return None
+            notebooks_json = [nb for nb in notebooks_json
+                              if nb['title'] != 'All Notes']
+            stale = [nb for nb in notebooks_json
+                     if not nb.get('updated_at') or
+                     known.get(nb['id']) != timestamp(nb['updated_at'])]
+            futures = [(nb, pool.submit(self.api.list_notebook_notes,
+                                        nb['id']))
+                       for nb in stale]
+            fetched = [(nb, future.result()) for nb, future in futures]
+        return tags_json, notebooks_json, fetched
+
+    def apply_changes(self, store, changes):
+        """Applies what fetch_changes returned to the instance and writes
+        it to store. Local changes not yet updated to the host are kept.
+        Must run in the thread using the instance.
+
+        :type store: cache.Store
+        :type changes: tuple
+        """
+        tags_json, notebooks_json, fetched = changes
+        self.load_tags(tags_json)
+        store.save_tags(list(self.tags.values()))
+        removed = set(notebook_id for notebook_id, notebook
+                      in self.notebooks.items()
+                      if not notebook.dirty and not any(
+                          note.dirty for note in notebook.notes.values()))
+        removed -= set(int(nb['id']) for nb in notebooks_json)
+        for notebook_id in removed:
+            self.remove_notebook(self.notebooks[notebook_id])
+        store.remove_notebooks(removed)
+        for notebook_json, notes_json in fetched:
+            if notes_json is None:
+                continue
+            notebook = self.notebooks.get(int(notebook_json['id']))
+            if notebook is None:
+                notebook = Notebook.from_json(notebook_json, self.api)
+                self.add_notebook(notebook)
+            if not notebook.dirty:
+                notebook.title = notebook_json['title']
+                notebook.updated_at = notebook_json.get('updated_at', '')
+                notebook.clean()
+            changed, removed_notes = notebook.merge(notes_json, self.tags)
+            store.save_notebook(notebook, changed, removed_notes)
+            logger.info('Synchronized {}: {} changed, {} removed'.format(
+                notebook, len(changed), len(removed_notes)))
+
+    def load_notebooks(self, notebooks_json):
+        """Adds notebooks from json and returns them, without notes.
+
+        :type notebooks_json: list
+        :rtype: list
+        """
+        notebooks = []
+        for notebook in notebooks_json:
             if notebook['title'] != 'All Notes':
                 notebook = Notebook.from_json(notebook, self.api)
                 self.add_notebook(notebook)
-                notebook.download(self.tags)
+                notebooks.append(notebook)
             else:
                 logger.info('Skipping notebook {}'.format(notebook))
+        return notebooks
 
-    @threaded_method
-    def update(self):
-        """Updating notebooks and notes to host."""
-        logger.info('Updating notebooks and notes')
-        for nb in self.notebooks.values():
-            nb.update()
+    def changes(self):
+        """Returns notebooks and notes with local changes and the names of
+        the changed fields.
+
+        :rtype: list
+        """
+        changes = []
+        for nb in self.get_notebooks():
+            if nb.dirty:
+                changes.append((nb, sorted(nb.dirty)))
             for note in nb.get_notes():
-                note.update()
+                if note.dirty:
+                    changes.append((note, sorted(note.dirty)))
+        return changes
+
+    def update(self, dry_run=False):
+        """Updating changed notebooks and notes to host. Returns the
+        changes as reported by changes.
+
+        In threaded mode the single updates are queued in the shared
+        executor, use wait or flush to block until they finished.
 
-    def find(self, key, coll):
+        :param bool dry_run: If true nothing is sent to the host.
+        :rtype: list
+        """
+        changes = self.changes()
+        logger.info('Updating {} changed notebooks and notes'.format(
+            len(changes)))
+        if not dry_run:
+            for item, fields in changes:
+                item.update()
+        return changes
+
+    def reconcile(self, notes=None, chunk_size=50, workers=1):
+        """Synchronizes notebooks and notes with the host in bulk.
+
+        Remote notebooks are fetched with one request, remote notes in
+        chunks of chunk_size ids per notebook. A chunk the host failed,
+        like for a note deleted there, is requested one note at a time,
+        so only notes it did not return are missing. Items whose remote
+        updated_at is newer are pulled, other dirty items are pushed.
+        Returns counts of pushed, pulled and missing items and of the
+        requests needed to fetch the remote state.
+
+        :param notes: Notes to reconcile, all notes if None.
+        :type notes: list or None
+        :param int chunk_size: Maximum of note ids per request.
+        :param int workers: Number of concurrent requests.
+        :rtype: dict
+        """
+        result = {'pushed': 0, 'pulled': 0, 'missing': 0, 'requests': 0}
+
+        def apply(item, remote):
+            if remote is None:
+                logger.error('Remote version of {} could not be '
+                             'found.'.format(item))
+                result['missing'] += 1
+            elif timestamp(remote['updated_at']) > item.updated_at:
+                item.pull(remote)
+                result['pulled'] += 1
+            elif item.dirty:
+                item.push()
+                result['pushed'] += 1
+
+        if notes is None:
+            notebooks = list(self.notebooks.values())
+            notes = [note for nb in notebooks for note in nb.notes.values()]
+            remote_notebooks = self.api.list_notebooks() or []
+            result['requests'] += 1
+            remote_notebooks = dict(
+                (int(nb['id']), nb) for nb in remote_notebooks)
+            for nb in notebooks:
+                apply(nb, remote_notebooks.get(nb.id))
+
+        chunks = []
+        by_notebook = {}
+        for note in notes:
+            by_notebook.setdefault(note.notebook.id, []).append(note)
+        for notebook_id, nb_notes in by_notebook.items():
+            for i in range(0, len(nb_notes), chunk_size):
+                chunks.append((notebook_id, nb_notes[i:i + chunk_size]))
+
+        def fetch(chunk):
+            notebook_id, chunk_notes = chunk
+            note_ids = [note.id for note in chunk_notes]
+            remote = as_list(self.api.get_notes(notebook_id, note_ids))
+            requests = 1
+            if remote is None and len(note_ids) > 1:
+                # A single deleted note fails the request of the chunk.
+                logger.info('Fetching {} notes one at a time'.format(
+                    len(note_ids)))
+                remote = [note for note_id in note_ids
+                          for note in as_list(self.api.get_notes(
+                              notebook_id, [note_id])) or []]
+                requests += len(note_ids)
+            return dict((int(note['id']), note)
+                        for note in remote or []), requests
+
+        with ThreadPoolExecutor(max(workers, 1)) as pool:
+            for chunk, (remote, requests) in zip(
+                    chunks, pool.map(fetch, chunks)):
+                result['requests'] += requests
+                for note in chunk[1]:
+                    apply(note, remote.get(note.id))
+        logger.info('Reconciled: {pushed} pushed, {pulled} pulled, '
+                    '{missing} missing in {requests} requests'.format(
+                        **result))
+        return result
+
+    def wait(self, timeout=None):
+        """Blocks until background operations finished or timeout passed.
+        Returns true if nothing is pending anymore.
+
+        :type timeout: int or float or None
+        :rtype: bool
+        """
+        return not wait(timeout)
+
+    def flush(self):
+        """Blocks until all background operations finished and returns the
+        exceptions of those that failed since the last flush.
+
+        :rtype: list
+        """
+        wait()
+        return pop_failed()
+
+    def find(self, key, coll, titles=None):
         """Finds key in given dict.
 
         :type key: str or int
         :type coll: dict
+        :param index.TitleIndex titles: Title index of coll, if available.
         :rtype: Notebook or Note or Tag or None
         """
         logger.info('Searching item for key {} of type {}'.format(
             key, type(key)))
         if isinstance(key, basestring):
-            for item in coll.values():
-                if key == item.title:
+            if titles is not None:
+                item = titles.first(key)
+                if item is not None:
                     return item
+            else:
+                for item in coll.values():
+                    if key == item.title:
+                        return item
             logger.error('No item found for key {} of type {}'.format(
                 key, type(key)))
         else:
@@ -424,7 +1256,7 @@ class Paperwork:
         :type key: str or int
         :rtype: Tag or None
         """
-        return self.find(key, self.tags)
+        return self.find(key, self.tags, self.index.tag_titles)
 
     def find_notebook(self, key):
         """Find notebook with key (id or title).
@@ -432,7 +1264,7 @@ class Paperwork:
         :type key: str or int
         :rtype: Notebook or None
         """
-        return self.find(key, self.notebooks)
+        return self.find(key, self.notebooks, self.index.notebook_titles)
 
     def find_note(self, key):
         """Find note with key (id or title).
@@ -443,16 +1275,21 @@ class Paperwork:
         logger.info('Searching note for key {} of type {}'.format(
             key, type(key)))
         if isinstance(key, basestring):
-            for item in self.get_notes():
-                if key == item.title:
-                    return item
+            note = self.index.note_titles.first(key)
         else:
-            logger.info('key is int, finding through keys')
-            for nb in self.notebooks.values():
-                if key in nb.notes:
-                    return nb.notes[key]
-        logger.error('No note found for key {} of type {}'.format(
-            key, type(key)))
+            note = self.index.notes.get(key)
+        if note is None:
+            logger.error('No note found for key {} of type {}'.format(
+                key, type(key)))
+        return note
+
+    def find_notes(self, title):
+        """Finds all notes with title.
+
+        :type title: str
+        :rtype: list
+        """
+        return self.index.note_titles.get(title)
 
     def fuzzy_find(self, title, choices):
         """Fuzzy find for title in choices. Returns highest match.
@@ -461,6 +1298,7 @@ class Paperwork:
         :type choices: list or set or tuple
         :rtype: Tag or Note or Notebook
         """
+        from fuzzywuzzy import fuzz
         top_choice = (0, None)
         for choice in choices:
             val = fuzz.ratio(choice.title, title)
@@ -469,8 +1307,13 @@ class Paperwork:
         return top_choice[1]
 
     def fuzzy_find_tag(self, title):
-        """Fuzzy search for tag with given title."""
-        return self.fuzzy_find(title, self.tags.values())
+        """Fuzzy search for tag with given title.
+
+        :type title: str
+        :rtype: Tag
+        """
+        matches = self.index.tag_titles.fuzzy(title)
+        return matches[0][1] if matches else None
 
     def fuzzy_find_notebook(self, title):
         """Fuzzy search for notebook with given title.
@@ -478,48 +1321,68 @@ class Paperwork:
         :type title: str
         :rtype: Notebook
         """
-        return self.fuzzy_find(title, self.notebooks.values())
+        matches = self.index.notebook_titles.fuzzy(title)
+        return matches[0][1] if matches else None
 
     def fuzzy_find_note(self, title):
-        """Fuzze search for note with given title.
+        """Fuzzy search for note with given title.
 
         :type title: str
         :rtype: Note
         """
-        return self.fuzzy_find(title, self.get_notes())
+        matches = self.index.note_titles.fuzzy(title)
+        return matches[0][1] if matches else None
+
+    def search(self, key, remote=False, limit=None):
+        """Searches for given key and returns note-instances, best match
+        first.
 
-    def search(self, key):
-        """Searches for given key and returns note-instances.
+        Searches the local index of titles and contents unless remote is
+        true. Words in quotes are matched as a phrase, a trailing * matches
+        words starting with the word.
 
         :type key: str
+        :param bool remote: Search on the host instead.
+        :param int limit: Maximum of returned notes.
         :rtype: List
         """
-        json_notes = self.api.search(key)
+        if not remote:
+            return self.index.text.search(key, limit)
         notes = []
-        for json_note in json_notes:
-            self.find_note(json_note['id'])
+        for json_note in self.api.iter_search(key):
+            note = self.find_note(int(json_note['id']))
+            if note is not None:
+                notes.append(note)
+            if limit is not None and len(notes) >= limit:
+                break
         return notes
 
-    def get_notes(self):
-        """Returns notes in a sorted list.
+    def get_notes(self, start=None, end=None):
+        """Returns notes in a sorted list, optionally only those with
+        start <= title < end.
 
+        :type start: str
+        :type end: str
         :rtype: list
         """
-        return sorted(
-            [note for nb in self.notebooks.values()
-             for note in nb.notes.values()],
-            key=lambda note: note.title)
+        return self.index.note_titles.sorted.range(start, end)
 
-    def get_notebooks(self):
-        """Returns notebooks in a sorted list.
+    def get_notebooks(self, start=None, end=None):
+        """Returns notebooks in a sorted list, optionally only those with
+        start <= title < end.
 
+        :type start: str
+        :type end: str
         :rtype: list
         """
-        return sorted(self.notebooks.values(), key=lambda nb: nb.title)
+        return self.index.notebook_titles.sorted.range(start, end)
 
-    def get_tags(self):
-        """Returns tags in a sorted list.
+    def get_tags(self, start=None, end=None):
+        """Returns tags in a sorted list, optionally only those with
+        start <= title < end.
 
+        :type start: str
+        :type end: str
         :rtype: list
         """
-        return sorted(self.tags.values(), key=lambda tag: tag.title)
+        return self.index.tag_titles.sorted.range(start, end)
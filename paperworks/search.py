@@ -0,0 +1,265 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+word = re.compile(r'\w+', re.UNICODE)
+markup = re.compile(r'<[^>]*>')
+query_parts = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Returns the lowercase words of text, ignoring html tags.
+
+    :type text: str
+    :rtype: list
+    """
+    return word.findall(markup.sub(' ', text).lower())
+
+
+def parse(query):
+    """Parses query into clauses. Quoted words form a phrase clause, a
+    trailing * makes a prefix clause, other words are term clauses.
+
+    :type query: str
+    :rtype: list of tuples
+    """
+    clauses = []
+    for phrase, part in query_parts.findall(query):
+        if phrase:
+            terms = tokenize(phrase)
+            if terms:
+                clauses.append(('phrase', terms))
+            continue
+        terms = tokenize(part)
+        if len(terms) > 1:
+            clauses.append(('phrase', terms))
+        elif terms and part.endswith('*'):
+            clauses.append(('prefix', terms[0]))
+        elif terms:
+            clauses.append(('term', terms[0]))
+    return clauses
+
+
+def contains(title, content, phrase):
+    """Returns whether the title terms and content of a note contain the
+    terms of phrase in order. Only the title is checked if the content
+    is None.
+
+    :param tuple title: Terms of the title.
+    :type content: str or None
+    :param list phrase: Terms of the phrase.
+    :rtype: bool
+    """
+    # The gap keeps phrases from matching across title and content.
+    tokens = list(title) + [None] + tokenize(content or '')
+    first, count = phrase[0], len(phrase)
+    return any(tokens[start:start + count] == phrase
+               for start, term in enumerate(tokens) if term == first)
+
+
+class SearchIndex:
+    # BM25 parameters
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        """Inverted index over titles and contents of notes, ranking
+        matches with BM25. Every clause of a query has to match.
+
+        Postings keep term frequencies only. Phrases are checked against
+        the text of the notes containing all their terms, so their
+        contents may be fetched. They are fetched in bulk without holding
+        the lock."""
+        self.lock = threading.RLock()
+        self.postings = {}
+        self.lengths = {}
+        self.title_terms = {}
+        self.doc_terms = {}
+        self.notes = {}
+        # Sorted vocabulary for prefix queries, rebuilt after changes.
+        self.terms = None
+        self.total = 0
+
+    def __len__(self):
+        return len(self.notes)
+
+    def add(self, note, content=None):
+        """Indexes note with content, by default its content, replacing
+        an indexed note with the same id.
+
+        :type note: models.Note
+        :type content: str
+        """
+        if content is None:
+            content = note.content
+        title = tokenize(note.title)
+        tokens = tokenize(content or '')
+        frequencies = Counter(tokens)
+        frequencies.update(title)
+        with self.lock:
+            self._insert(note, frequencies, len(title) + len(tokens), title)
+
+    def retitle(self, note):
+        """Indexes the title of note again, keeping its indexed content.
+        A note not indexed yet is indexed without content.
+
+        :type note: models.Note
+        """
+        title = tokenize(note.title)
+        frequencies = Counter(title)
+        with self.lock:
+            old_title = self.title_terms.get(note.id)
+            length = len(title)
+            if old_title is not None:
+                length += self.lengths[note.id] - len(old_title)
+                for term in self.doc_terms[note.id]:
+                    frequencies[term] += self.postings[term][note.id]
+                frequencies.subtract(old_title)
+            self._insert(note, frequencies, length, title)
+
+    def _insert(self, note, frequencies, length, title):
+        self.remove(note.id)
+        self.notes[note.id] = note
+        self.lengths[note.id] = length
+        self.title_terms[note.id] = tuple(intern(term) for term in title)
+        terms = []
+        self.total += length
+        for term, frequency in frequencies.items():
+            if frequency <= 0:
+                continue
+            term = intern(term)
+            terms.append(term)
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self.terms = None
+            postings[note.id] = frequency
+        self.doc_terms[note.id] = tuple(terms)
+
+    def remove(self, note_id):
+        """Removes the note with note_id.
+
+        :type note_id: int
+        """
+        with self.lock:
+            note = self.notes.pop(note_id, None)
+            if note is None:
+                return
+            self.total -= self.lengths.pop(note_id)
+            del(self.title_terms[note_id])
+            for term in self.doc_terms.pop(note_id):
+                postings = self.postings[term]
+                del(postings[note_id])
+                if not postings:
+                    del(self.postings[term])
+                    self.terms = None
+
+    def expand(self, prefix):
+        """Returns the indexed terms starting with prefix.
+
+        :type prefix: str
+        :rtype: list
+        """
+        with self.lock:
+            if self.terms is None:
+                self.terms = sorted(self.postings)
+            end = start = bisect_left(self.terms, prefix)
+            while end < len(self.terms) and \
+                    self.terms[end].startswith(prefix):
+                end += 1
+            return self.terms[start:end]
+
+    def _matches(self, clause):
+        """Returns note ids matching clause and the terms to score. For
+        phrases these are the notes containing all their terms."""
+        kind, value = clause
+        if kind == 'term':
+            return set(self.postings.get(value, ())), [value]
+        if kind == 'prefix':
+            terms = self.expand(value)
+            ids = set()
+            for term in terms:
+                ids.update(self.postings[term])
+            return ids, terms
+        ids = None
+        for term in value:
+            term_ids = set(self.postings.get(term, ()))
+            ids = term_ids if ids is None else ids & term_ids
+        return ids, value
+
+    def _contents(self, notes):
+        """Returns the contents of notes by id. Unloaded contents are
+        fetched in bulk through the content caches of their notebooks,
+        those that can not be fetched are missing."""
+        contents = {}
+        unloaded = {}
+        for note in notes:
+            content = note.loaded_content
+            if content is not None:
+                contents[note.id] = content
+            elif note.notebook.contents is not None:
+                unloaded.setdefault(note.notebook.contents, []).append(note)
+            else:
+                contents[note.id] = ''
+        for cache, cache_notes in unloaded.items():
+            contents.update(cache.fetch(cache_notes))
+        return contents
+
+    def _score(self, note_id, terms):
+        avg_length = float(self.total) / len(self.notes) or 1.0
+        length = self.lengths[note_id]
+        score = 0.0
+        for term in set(terms):
+            postings = self.postings.get(term, {})
+            if note_id not in postings:
+                continue
+            frequency = postings[note_id]
+            idf = math.log(1 + (len(self.notes) - len(postings) + 0.5) /
+                           (len(postings) + 0.5))
+            score += idf * frequency * (self.k1 + 1) / (
+                frequency + self.k1 * (1 - self.b + self.b *
+                                       length / avg_length))
+        return score
+
+    def search(self, query, limit=None):
+        """Returns notes matching query, best match first.
+
+        :type query: str
+        :param int limit: Maximum of returned notes.
+        :rtype: list
+        """
+        clauses = parse(query)
+        phrases = [value for kind, value in clauses if kind == 'phrase']
+        with self.lock:
+            if not clauses or not self.notes:
+                return []
+            ids = None
+            terms = []
+            for clause in clauses:
+                clause_ids, clause_terms = self._matches(clause)
+                ids = clause_ids if ids is None else ids & clause_ids
+                terms.extend(clause_terms)
+                if not ids:
+                    return []
+            candidates = [(self.notes[note_id], self.title_terms[note_id])
+                          for note_id in ids] if phrases else ()
+        if phrases:
+            # Checked outside the lock, fetching contents may take long.
+            contents = self._contents([note for note, title in candidates])
+            ids = set(note.id for note, title in candidates
+                      if all(contains(title, contents.get(note.id), phrase)
+                             for phrase in phrases))
+        with self.lock:
+            # Notes removed meanwhile are left out.
+            ranked = sorted((note_id for note_id in ids
+                             if note_id in self.notes),
+                            key=lambda note_id: (
+                                -self._score(note_id, terms), note_id))
+            return [self.notes[note_id] for note_id in ranked[:limit]]
@@ -0,0 +1,72 @@
+import copy
+import threading
+
+
+class Call:
+    def __init__(self):
+        """A call in flight and its outcome."""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = False
+
+
+class Group:
+    def __init__(self):
+        """Coalesces concurrent calls with equal keys into one call whose
+        result all callers receive. Safe to use from several threads."""
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Returns the result of func, or of the call of another thread
+        with key still in flight. Exceptions are raised in all callers.
+        Callers sharing a result get own copies of it, so they can change
+        it independently.
+
+        :type key: tuple
+        :type func: callable
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                self.executed += 1
+                leader = True
+            else:
+                call.shared = True
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        # No thread joins anymore, shared is final.
+        return copy.deepcopy(call.result) if call.shared else call.result
+
+    def stats(self):
+        """Returns counters of the group.
+
+        :rtype: dict
+        """
+        with self.lock:
+            calls = self.executed + self.coalesced
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls),
+                'coalesced_ratio': (float(self.coalesced) / calls
+                                    if calls else 0.0)
+                }
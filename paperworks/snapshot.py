@@ -0,0 +1,332 @@
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Format of the written snapshots, readers refuse newer ones.
+format_version = 1
+
+
+def replace(source, target):
+    """Renames source to target, replacing target if it exists.
+
+    :type source: str
+    :type target: str
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+        return
+    # Before Python 3.3, rename does not replace files on Windows.
+    if os.name == 'nt' and os.path.exists(target):
+        os.remove(target)
+    os.rename(source, target)
+
+
+def open_snapshot(path, mode='r', compress=None):
+    """Opens the snapshot at path as text file, gzip compressed if
+    compress is true. By default snapshots whose path ends with '.gz' are
+    compressed.
+
+    :type path: str
+    :param str mode: 'r' or 'w'.
+    :type compress: bool or None
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return io.TextIOWrapper(gzip.open(path, mode + 'b'),
+                                encoding='UTF-8', newline='\n')
+    return io.open(path, mode, encoding='UTF-8', newline='\n')
+
+
+def write_record(f, record_type, **fields):
+    fields['type'] = record_type
+    f.write(json.dumps(fields, sort_keys=True, separators=(',', ':')))
+    f.write('\n')
+
+
+def read_records(f):
+    """Yields the records of an open snapshot one at a time, with their
+    line numbers.
+
+    Raises ValueError for snapshots of unknown format.
+
+    :type f: file
+    """
+    for number, line in enumerate(f):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record['type'] == 'snapshot' and \
+                record['version'] > format_version:
+            raise ValueError('Snapshot format {} is not supported.'.format(
+                record['version']))
+        yield number, record
+
+
+def export(api, path, compress=None):
+    """Writes all tags, notebooks and notes of the host to a snapshot at
+    path, one json record per line, and returns the number of records
+    of each type. Notes are written while they are received, so memory
+    does not grow with the size of the instance. The snapshot is written
+    to a temporary file first, on errors nothing is written and None is
+    returned.
+
+    :type api: wrapper.api
+    :type path: str
+    :param compress: Compress with gzip, by default if path ends with
+                     '.gz'.
+    :type compress: bool or None
+    :rtype: dict or None
+    """
+    counts = {'tag': 0, 'notebook': 0, 'note': 0}
+    if compress is None:
+        compress = path.endswith('.gz')
+    temporary = path + '.part'
+    logger.info('Exporting snapshot to {}'.format(path))
+    try:
+        with open_snapshot(temporary, 'w', compress) as f:
+            write_record(f, 'snapshot', version=format_version,
+                         host=api.host, created=int(time.time()))
+            tags = api.list_tags()
+            notebooks = api.list_notebooks()
+            if tags is None or notebooks is None:
+                raise ValueError('Listing tags and notebooks failed.')
+            for tag in tags:
+                write_record(f, 'tag', id=int(tag['id']), title=tag['title'],
+                             visibility=tag.get('visibility', 0))
+                counts['tag'] += 1
+            notebooks = [nb for nb in notebooks
+                         if nb['title'] != 'All Notes']
+            for nb in notebooks:
+                write_record(f, 'notebook', id=int(nb['id']),
+                             title=nb['title'], kind=nb.get('type', 0))
+                counts['notebook'] += 1
+            for nb in notebooks:
+                for note in api.iter_notebook_notes(nb['id']):
+                    write_record(
+                        f, 'note', id=int(note['id']),
+                        notebook_id=int(nb['id']), title=note['title'],
+                        content=note.get('content', ''),
+                        updated_at=note.get('updated_at', ''),
+                        tags=[int(tag['id'])
+                              for tag in note.get('tags', [])])
+                    counts['note'] += 1
+    except Exception as e:
+        logger.error('Export failed: {}'.format(e))
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return None
+    replace(temporary, path)
+    logger.info('Exported {tag} tags, {notebook} notebooks and {note} '
+                'notes'.format(**counts))
+    return counts
+
+
+class Checkpoint:
+    # Seconds between writes for notes created meanwhile.
+    save_interval = 1.0
+
+    def __init__(self, path):
+        """Progress of a restore, kept in a json file at path. Records
+        before line are restored, as are the records at lines in done.
+        Tags and notebooks map the ids in the snapshot to the created
+        ones, notes those of created notes whose tags are not set yet.
+        Safe to use from several threads, changes are made with the
+        methods.
+
+        :type path: str
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # Held while writing, so writes do not overlap.
+        self.write_lock = threading.Lock()
+        self.saved = 0
+        self.line = 0
+        self.done = set()
+        self.tags = {}
+        self.notebooks = {}
+        self.notes = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.line = state['line']
+            self.done = set(state['done'])
+            self.tags = dict((int(key), value)
+                             for key, value in state['tags'].items())
+            self.notebooks = dict((int(key), value)
+                                  for key, value in state['notebooks'].items())
+            self.notes = dict((int(key), value)
+                              for key, value in state.get('notes', {}).items())
+
+    def restored(self, number):
+        """Returns true if the record at line number was restored.
+
+        :type number: int
+        :rtype: bool
+        """
+        return number < self.line or number in self.done
+
+    def save(self):
+        """Writes the checkpoint, replacing the old one at once."""
+        temporary = self.path + '.part'
+        with self.write_lock:
+            # Copied at once, the state may change while it is written.
+            with self.lock:
+                state = {'line': self.line, 'done': sorted(self.done),
+                         'tags': dict(self.tags),
+                         'notebooks': dict(self.notebooks),
+                         'notes': dict(self.notes)}
+                self.saved = time.time()
+            with open(temporary, 'w') as f:
+                json.dump(state, f)
+            replace(temporary, self.path)
+
+    def created_note(self, id, created_id):
+        """Records that the note with id in the snapshot was created as
+        created_id, before its tags are set. The checkpoint is written at
+        most every save_interval seconds for created notes.
+
+        :type id: int
+        :type created_id: int
+        """
+        with self.lock:
+            self.notes[id] = created_id
+            due = time.time() - self.saved >= self.save_interval
+        if due:
+            self.save()
+
+    def restored_record(self, number, record, result):
+        """Records that record at line number was restored as result.
+
+        :type number: int
+        :type record: dict
+        :param result: Created tag, id of the created notebook or the
+                       created note.
+        """
+        with self.lock:
+            if record['type'] == 'tag':
+                self.tags[record['id']] = result
+            elif record['type'] == 'notebook':
+                self.notebooks[record['id']] = result
+            else:
+                self.notes.pop(record['id'], None)
+            self.done.add(number)
+
+    def advance(self, line):
+        """Records that all records before line are restored.
+
+        :type line: int
+        """
+        with self.lock:
+            self.line = line
+            self.done = set(n for n in self.done if n >= line)
+
+
+def batches(records, size):
+    """Yields lists of up to size records of the same type.
+
+    :param records: Iterable of line numbers and records.
+    :type size: int
+    """
+    batch = []
+    for number, record in records:
+        if batch and (len(batch) == size or
+                      batch[-1][1]['type'] != record['type']):
+            yield batch
+            batch = []
+        batch.append((number, record))
+    if batch:
+        yield batch
+
+
+def restore(api, path, checkpoint=None, workers=4, batch_size=50,
+            compress=None):
+    """Recreates the tags, notebooks and notes of the snapshot at path on
+    the host of api and returns the number of created records of each
+    type, or None if some could not be created. Records are read and
+    created in batches of batch_size, with up to workers concurrent
+    requests. Progress is saved to checkpoint after every batch, so
+    running restore again with the same checkpoint continues where it
+    stopped without creating anything twice. Notes are created first and
+    tagged after, created notes are recorded in between, so a failed
+    tagging is retried on the created note.
+
+    Ids and times are chosen by the target host, notes keep their tags.
+
+    :type api: wrapper.api
+    :type path: str
+    :param str checkpoint: Path of the progress file, by default path
+                           with '.checkpoint' appended.
+    :type workers: int
+    :type batch_size: int
+    :param compress: Whether the snapshot is compressed with gzip, by
+                     default if path ends with '.gz'.
+    :type compress: bool or None
+    :rtype: dict or None
+    """
+    state = Checkpoint(checkpoint or path + '.checkpoint')
+    counts = {'tag': 0, 'notebook': 0, 'note': 0}
+    failed = 0
+
+    def create(record):
+        kind = record['type']
+        if kind == 'tag':
+            tag = api.create_tag(record['title'], record['visibility'])
+            return tag and {'id': int(tag['id']), 'title': tag['title'],
+                            'visibility': tag.get('visibility', 0)}
+        elif kind == 'notebook':
+            notebook = api.create_notebook(record['title'])
+            return notebook and int(notebook['id'])
+        notebook_id = state.notebooks.get(record['notebook_id'])
+        if notebook_id is None:
+            logger.error('Notebook {} of note {} was not restored.'.format(
+                record['notebook_id'], record['id']))
+            return None
+        note_id = state.notes.get(record['id'])
+        if note_id is None:
+            note = api.create_note(notebook_id, record['title'],
+                                   record['content'])
+            if note is None or not record['tags']:
+                return note
+            note_id = int(note['id'])
+            state.created_note(record['id'], note_id)
+        return api.update_note({
+            'id': note_id, 'notebook_id': notebook_id,
+            'title': record['title'], 'content': record['content'],
+            'tags': [state.tags[tag_id] for tag_id in record['tags']
+                     if tag_id in state.tags]})
+
+    logger.info('Restoring snapshot {}'.format(path))
+    with open_snapshot(path, 'r', compress) as f, \
+            ThreadPoolExecutor(max(workers, 1)) as executor:
+        records = ((number, record) for number, record in read_records(f)
+                   if record['type'] in counts and
+                   not state.restored(number))
+        for batch in batches(records, batch_size):
+            results = executor.map(create, [record for _, record in batch])
+            for (number, record), result in zip(batch, results):
+                if result is None:
+                    failed += 1
+                    continue
+                state.restored_record(number, record, result)
+                counts[record['type']] += 1
+            # Restored lines are kept individually only after failures.
+            if not failed:
+                state.advance(batch[-1][0] + 1)
+            state.save()
+            if failed:
+                break
+    if failed:
+        logger.error('Restoring {} records failed, run again to '
+                     'continue.'.format(failed))
+        return None
+    logger.info('Restored {tag} tags, {notebook} notebooks and {note} '
+                'notes'.format(**counts))
+    return counts
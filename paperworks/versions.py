@@ -0,0 +1,166 @@
+import json
+import logging
+import sqlite3
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    zlib.compressobj(zdict=b' ')
+    deltas = True
+except TypeError:
+    # Preset dictionaries need Python 3.3, versions are stored whole.
+    deltas = False
+
+schema = '''
+CREATE TABLE IF NOT EXISTS versions (
+    note_id INTEGER NOT NULL,
+    version_id INTEGER NOT NULL,
+    base_id INTEGER,
+    depth INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (note_id, version_id)
+);
+'''
+
+
+class VersionStore:
+    # Versions decoded to reconstruct one version at most.
+    max_chain = 16
+
+    def __init__(self, path, level=6):
+        """Permanent cache of note versions in a SQLite database, which
+        never change once written. Versions are stored compressed, as
+        delta to the closest stored version of the same note where that
+        is smaller. Safe to use from several threads.
+
+        Deltas are compressed with the neighbouring version as preset
+        dictionary, which zlib only uses up to its last 32KB. Without
+        preset dictionaries (before Python 3.3) versions are stored whole.
+
+        :type path: str
+        :param int level: zlib compression level.
+        """
+        self.level = level
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(schema)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        """Closes the database."""
+        with self.lock:
+            self.db.close()
+
+    def _raw(self, note_id, version_id):
+        row = self.db.execute(
+            'SELECT base_id, body FROM versions '
+            'WHERE note_id = ? AND version_id = ?',
+            (note_id, version_id)).fetchone()
+        if row is None:
+            return None
+        base_id, body = row
+        if base_id is None:
+            return zlib.decompress(bytes(body))
+        if not deltas:
+            raise IOError('Version {} of note {} is stored as delta, which '
+                          'needs Python 3.3.'.format(version_id, note_id))
+        decoder = zlib.decompressobj(zdict=self._raw(note_id, base_id))
+        return decoder.decompress(bytes(body)) + decoder.flush()
+
+    def _compress(self, raw, base=None):
+        encoder = zlib.compressobj(self.level) if base is None else \
+            zlib.compressobj(self.level, zdict=base)
+        return encoder.compress(raw) + encoder.flush()
+
+    def has(self, note_id, version_id):
+        """:type note_id: int
+        :type version_id: int
+        :rtype: bool
+        """
+        with self.lock:
+            return self.db.execute(
+                'SELECT 1 FROM versions WHERE note_id = ? AND version_id = ?',
+                (int(note_id), int(version_id))).fetchone() is not None
+
+    def get(self, note_id, version_id):
+        """Returns the stored version or None.
+
+        :type note_id: int
+        :type version_id: int
+        :rtype: dict or None
+        """
+        with self.lock:
+            raw = self._raw(int(note_id), int(version_id))
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(raw.decode('UTF-8'))
+
+    def put(self, note_id, version):
+        """Stores version of note with note_id, if it is not stored yet.
+
+        :type note_id: int
+        :param dict version: Version as returned by the host.
+        """
+        note_id, version_id = int(note_id), int(version['id'])
+        raw = json.dumps(version, sort_keys=True).encode('UTF-8')
+        with self.lock, self.db:
+            if self.db.execute(
+                    'SELECT 1 FROM versions '
+                    'WHERE note_id = ? AND version_id = ?',
+                    (note_id, version_id)).fetchone() is not None:
+                return
+            # The closest earlier version, or the closest later one.
+            neighbour = self.db.execute(
+                'SELECT version_id, depth FROM versions WHERE note_id = ? '
+                'ORDER BY version_id > ?, ABS(version_id - ?) LIMIT 1',
+                (note_id, version_id, version_id)).fetchone()
+            body = self._compress(raw)
+            base_id, depth = None, 0
+            if deltas and neighbour is not None and \
+                    neighbour[1] + 1 < self.max_chain:
+                delta = self._compress(raw, self._raw(note_id, neighbour[0]))
+                if len(delta) < len(body):
+                    body = delta
+                    base_id, depth = neighbour[0], neighbour[1] + 1
+            self.db.execute(
+                'INSERT INTO versions '
+                '(note_id, version_id, base_id, depth, size, body) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (note_id, version_id, base_id, depth, len(raw),
+                 sqlite3.Binary(body)))
+
+    def version_ids(self, note_id):
+        """Returns the ids of the stored versions of note with note_id.
+
+        :type note_id: int
+        :rtype: list
+        """
+        with self.lock:
+            return [row[0] for row in self.db.execute(
+                'SELECT version_id FROM versions WHERE note_id = ? '
+                'ORDER BY version_id', (int(note_id),))]
+
+    def stats(self):
+        """Returns counters of the store.
+
+        :rtype: dict
+        """
+        with self.lock:
+            versions, deltas, size, stored = self.db.execute(
+                'SELECT COUNT(*), COUNT(base_id), COALESCE(SUM(size), 0), '
+                'COALESCE(SUM(LENGTH(body)), 0) FROM versions').fetchone()
+            return {
+                'versions': versions,
+                'deltas': deltas,
+                'size': size,
+                'stored': stored,
+                'hits': self.hits,
+                'misses': self.misses
+                }
@@ -1,13 +1,39 @@
 # License: MIT
 # Author: Nelo Wallus, http://github.com/ntnn
 
+import codecs
 import logging
 import json
+import os
+import re
+import select
+import socket
+import threading
+import time
+import zlib
 try:
     from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    from urllib.parse import quote, urlsplit
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 except ImportError:
-    from urllib2 import Request, urlopen
+    from urllib2 import Request, urlopen, HTTPError
+    from urllib import quote
+    from urlparse import urlsplit
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from paperworks.batching import NoteLoader
+from paperworks.metrics import Monitor
+from paperworks.singleflight import Group
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +51,7 @@ api_path = {
     'version':     'notebooks/{}/notes/{}/versions/{}',
     'attachments': 'notebooks/{}/notes/{}/versions/{}/attachments',
     'attachment':  'notebooks/{}/notes/{}/versions/{}/attachments/{}',
+    'raw':         'notebooks/{}/notes/{}/versions/{}/attachments/{}/raw',
     'tags':        'tags',
     'tag':         'tags/{}',
     'tagged':      'tagged/{}',
@@ -34,6 +61,144 @@ api_path = {
     }
 
 
+# Content codings accepted from the host, best first.
+accepted_encodings = ('br', 'gzip', 'deflate') if brotli else \
+    ('gzip', 'deflate')
+
+
+def decompressor(encoding):
+    """Returns an object decompressing data of given content coding with
+    decompress(data) and flush(), or None for identity.
+
+    Raises ValueError for unsupported codings.
+
+    :type encoding: str or None
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return DeflateDecompressor()
+    if encoding == 'br' and brotli:
+        return BrotliDecompressor()
+    raise ValueError('Unsupported content encoding {}'.format(encoding))
+
+
+def decompress(data, encoding):
+    """Returns data decoded from given content coding.
+
+    :type data: bytes
+    :type encoding: str or None
+    :rtype: bytes
+    """
+    decoder = decompressor(encoding)
+    if decoder is None:
+        return data
+    return decoder.decompress(data) + decoder.flush()
+
+
+class DeflateDecompressor:
+    def __init__(self):
+        """Decompresses deflate data, which servers send with or without
+        zlib header."""
+        self.decoder = None
+        self.pending = b''
+
+    def decompress(self, data):
+        if self.decoder is None:
+            data = self.pending + data
+            if len(data) < 2:
+                self.pending = data
+                return b''
+            # A zlib header names deflate and its first two bytes are a
+            # multiple of 31.
+            header = bytearray(data[:2])
+            zlib_header = header[0] & 0x0f == 8 and \
+                (header[0] * 256 + header[1]) % 31 == 0
+            self.decoder = zlib.decompressobj(
+                zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        if self.decoder is None:
+            return zlib.decompress(self.pending, -zlib.MAX_WBITS) \
+                if self.pending else b''
+        return self.decoder.flush()
+
+
+class BrotliDecompressor:
+    def __init__(self):
+        """Decompresses brotli data with the optional brotli module."""
+        self.decoder = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self.decoder.process(data) if data else b''
+
+    def flush(self):
+        return b''
+
+
+def gzip_compress(data):
+    """Returns data compressed in gzip format.
+
+    :type data: bytes
+    :rtype: bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class DecodedResponse:
+    def __init__(self, response, encoding, chunk_size=64 * 1024):
+        """File-like response decompressing the body of response, which
+        has given content coding, while it is read.
+
+        :param response: Object with a read(amt) method returning bytes.
+        :type encoding: str
+        :param int chunk_size: Compressed bytes read at once.
+        """
+        self._response = response
+        self._decoder = decompressor(encoding)
+        self._chunk_size = chunk_size
+        self._buffer = b''
+        self._eof = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        while not self._eof and (amt is None or len(self._buffer) < amt):
+            data = self._response.read(self._chunk_size)
+            if data:
+                self._buffer += self._decoder.decompress(data)
+            else:
+                self._buffer += self._decoder.flush()
+                self._eof = True
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+
+def decoded(response):
+    """Returns response, decompressed while it is read if the host sent
+    it with a content coding.
+
+    :param response: Response as returned by urlopen.
+    """
+    info = getattr(response, 'info', None)
+    encoding = info().get('Content-Encoding') if info else None
+    if decompressor(encoding) is None:
+        return response
+    return DecodedResponse(response, encoding)
+
+
 def b64(string):
     """Returns given string as base64 hash-string.
 
@@ -43,37 +208,559 @@ def b64(string):
     return b64encode(string.encode('UTF-8')).decode('ASCII')
 
 
+def remaining_size(fileobj):
+    """Returns the bytes left to read from fileobj or None if unknown.
+
+    :param fileobj: File object opened in binary mode.
+    :rtype: int or None
+    """
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except Exception:
+        pass
+    try:
+        position = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell() - position
+        fileobj.seek(position)
+        return size
+    except Exception:
+        return None
+
+
+class MultipartBody:
+    def __init__(self, fileobj, filename, content_type=None, field='file',
+                 chunk_size=64 * 1024, progress=None):
+        """Body of a multipart/form-data request uploading fileobj as
+        field. Iterating it yields the body in chunks of chunk_size bytes,
+        so the file is never loaded into memory at once. Seekable files
+        are read from their current position on every iteration, so the
+        body can be sent again. Sending the body of an unseekable file
+        again raises ValueError, its data was consumed.
+
+        :param fileobj: File object opened in binary mode.
+        :type filename: str
+        :param content_type: Guessed from filename if None.
+        :type content_type: str
+        :type field: str
+        :type chunk_size: int
+        :param progress: Called with the bytes sent and the length of the
+                         body, None if unknown, after every chunk.
+        :type progress: callable
+        """
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # Only needed for uploads, not imported with the module.
+        import mimetypes
+        import uuid
+        self.boundary = uuid.uuid4().hex
+        content_type = content_type or mimetypes.guess_type(filename)[0] \
+            or 'application/octet-stream'
+        self.head = ('--{}\r\nContent-Disposition: form-data; name="{}"; '
+                     'filename="{}"\r\nContent-Type: {}\r\n\r\n').format(
+            self.boundary, field, filename.replace('"', '%22'),
+            content_type).encode('UTF-8')
+        self.tail = '\r\n--{}--\r\n'.format(self.boundary).encode('ASCII')
+        try:
+            self.start = fileobj.tell()
+        except Exception:
+            self.start = None
+        size = remaining_size(fileobj)
+        self.length = None if size is None else \
+            len(self.head) + size + len(self.tail)
+        self.sent = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def _chunks(self):
+        yield self.head
+        while True:
+            data = self.fileobj.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+        yield self.tail
+
+    def __iter__(self):
+        if self.sent and self.start is None:
+            raise ValueError('Body of an unseekable file sent already.')
+        if self.sent:
+            self.fileobj.seek(self.start)
+        self.sent = 0
+        for chunk in self._chunks():
+            self.sent += len(chunk)
+            yield chunk
+            if self.progress is not None:
+                self.progress(self.sent, self.length)
+
+
+class JsonReader:
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, response, chunk_size=64 * 1024):
+        """Reads json values one at a time from a file-like response,
+        decoding UTF-8 while it arrives. Only the value being parsed is
+        kept in memory.
+
+        :param response: Object with a read(amt) method returning bytes.
+        :param int chunk_size: Bytes read at once.
+        """
+        self.response = response
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('UTF-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """Reads the next chunk of at least size bytes. Returns false at
+        the end of the response.
+
+        :type size: int
+        :rtype: bool
+        """
+        if self.eof:
+            return False
+        data = self.response.read(max(size or 0, self.chunk_size))
+        self.eof = not data
+        self.text = self.text[self.pos:] + self.decoder.decode(
+            data, self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next character that is not whitespace."""
+        while True:
+            self.pos = self.whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of json data')
+
+    def expect(self, chars):
+        """Consumes and returns the next character, which has to be one of
+        chars.
+
+        :type chars: str
+        :rtype: str
+        """
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected one of {} in json data, got {}'.format(
+                chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Parses and returns the next json value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                # Incomplete value, read at least as much as buffered.
+                if not self.fill(len(self.text) - self.pos):
+                    raise
+                continue
+            # A number may continue in the next chunk.
+            if end < len(self.text) or not self.fill():
+                self.pos = end
+                return value
+
+
+def iter_response(response, chunk_size=64 * 1024):
+    """Parses the json body of a response of the host incrementally and
+    yields the items of its response array one at a time. A response
+    that is no array is yielded as a single item.
+
+    Raises ValueError for invalid json and unsuccessful requests.
+
+    :param response: Object with a read(amt) method returning bytes.
+    :param int chunk_size: Bytes read at once.
+    """
+    reader = JsonReader(response, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'response' and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            value = reader.value()
+            if key == 'success' and value is False:
+                raise ValueError('Unsuccessful request.')
+            if key == 'response':
+                yield value
+        if reader.expect(',}') == '}':
+            return
+
+
+class MeteredResponse:
+    def __init__(self, response, finish):
+        """Response counting the bytes read from response. finish is
+        called once with the count and whether reading failed, after the
+        body was read completely or the response was closed.
+
+        :param response: Object with a read(amt) method returning bytes.
+        :type finish: callable
+        """
+        self._response = response
+        self._finish = finish
+        self._received = 0
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _finished(self, error=False):
+        if not self._done:
+            self._done = True
+            self._finish(self._received, error)
+
+    def read(self, amt=None):
+        try:
+            data = self._response.read() if amt is None \
+                else self._response.read(amt)
+        except Exception:
+            self._finished(True)
+            raise
+        self._received += len(data)
+        if amt is None or not data:
+            self._finished()
+        return data
+
+    def close(self):
+        self._response.close()
+        self._finished()
+
+
+class PooledResponse:
+    def __init__(self, response, release, discard):
+        """Response of a pooled connection. The connection is handed back
+        to the pool once the body is read completely.
+
+        :type response: http.client.HTTPResponse
+        :type release: callable
+        :type discard: callable
+        """
+        self._response = response
+        self._release = release
+        self._discard = discard
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _finish(self, release):
+        if not self._done:
+            self._done = True
+            if release and not self._response.will_close:
+                self._release()
+            else:
+                self._discard()
+
+    def read(self, amt=None):
+        data = self._response.read() if amt is None \
+            else self._response.read(amt)
+        if self._response.isclosed():
+            self._finish(True)
+        return data
+
+    def close(self):
+        """Closes the response. A partially read response can not be
+        reused and its connection is dropped."""
+        release = self._response.isclosed()
+        self._response.close()
+        self._finish(release)
+
+
+class ConnectionPool:
+    # Requests sending them again can not change more than once.
+    retried_methods = frozenset(['GET', 'HEAD', 'DELETE'])
+
+    def __init__(self, size=4, idle_timeout=30, timeout=None):
+        """Thread-safe per-host pool of keep-alive connections.
+
+        Up to size idle connections are kept per host. Connections idle
+        for longer than idle_timeout seconds are closed instead of reused,
+        as are connections the server closed meanwhile. A request failing
+        on a reused connection is sent again on a new one if it was not
+        sent completely or its method is in retried_methods.
+
+        :type size: int
+        :type idle_timeout: int or float
+        :type timeout: int or float or None
+        """
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.stale = 0
+        self.discarded = 0
+
+    def _connect(self, key):
+        cls = HTTPSConnection if key[0] == 'https' else HTTPConnection
+        if self.timeout is None:
+            return cls(key[1])
+        return cls(key[1], timeout=self.timeout)
+
+    def _acquire(self, key):
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used >= self.idle_timeout:
+                    self.discarded += 1
+                elif self._dropped(conn):
+                    self.stale += 1
+                else:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.created += 1
+        return self._connect(key), False
+
+    def _dropped(self, conn):
+        # An idle connection is readable only once the server closed it.
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (ValueError, socket.error):
+            return True
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append((conn, time.time()))
+                return
+            self.discarded += 1
+        conn.close()
+
+    def _discard(self, conn):
+        with self._lock:
+            self.discarded += 1
+        conn.close()
+
+    def urlopen(self, request):
+        """Sends request over a pooled connection. Behaves like urlopen,
+        HTTPError is raised for error status codes.
+
+        :type request: urllib.request.Request
+        :rtype: PooledResponse
+        """
+        url = urlsplit(request.get_full_url())
+        key = (url.scheme, url.netloc)
+        path = url.path + ('?' + url.query if url.query else '')
+        headers = dict(request.header_items())
+        method = request.get_method()
+        while True:
+            conn, reused = self._acquire(key)
+            sent = False
+            try:
+                conn.request(method, path, request.data, headers)
+                sent = True
+                res = conn.getresponse()
+                break
+            except (HTTPException, socket.error):
+                conn.close()
+                # The host may have processed a completely sent request.
+                if not reused or \
+                        sent and method not in self.retried_methods:
+                    raise
+                logger.info('Reconnecting stale connection to {}'.format(
+                    url.netloc))
+                with self._lock:
+                    self.stale += 1
+        response = PooledResponse(
+            res,
+            lambda: self._release(key, conn),
+            lambda: self._discard(conn))
+        if res.status >= 400:
+            body = response.read()
+            response.close()
+            raise HTTPError(request.get_full_url(), res.status, res.reason,
+                            res.msg, BytesIO(body))
+        return response
+
+    def clear(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def stats(self):
+        """Returns counters of the pool.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'created': self.created,
+                'reused': self.reused,
+                'stale': self.stale,
+                'discarded': self.discarded,
+                'idle': sum(len(conns) for conns in self._idle.values()),
+                'reuse_ratio': (float(self.reused) / self.requests
+                                if self.requests else 0.0)
+                }
+
+
+def open_partial(target, offset, digest, chunk_size=64 * 1024):
+    """Opens the partial download target to write from offset on, 0
+    starts over. The bytes kept are added to digest.
+
+    :type target: str
+    :type offset: int
+    :param digest: Hash object of the download.
+    :type chunk_size: int
+    :rtype: file
+    """
+    f = open(target, 'r+b' if offset else 'wb')
+    while f.tell() < offset:
+        digest.update(f.read(min(chunk_size, offset - f.tell())))
+    f.truncate(offset)
+    return f
+
+
+def nested_versions(lists):
+    """Returns the lists of versions the host listed for notes. A single
+    note's versions may come without enclosing list.
+
+    :type lists: list
+    :rtype: list
+    """
+    return lists if isinstance(lists[0], list) else [lists]
+
+
+def notebook_chunks(notes, chunk_size):
+    """Returns notes split into lists of up to chunk_size notes of the
+    same notebook.
+
+    :type notes: list
+    :type chunk_size: int
+    :rtype: list
+    """
+    by_notebook = {}
+    for note in notes:
+        by_notebook.setdefault(note['notebook_id'], []).append(note)
+    return [nb_notes[start:start + chunk_size]
+            for nb_notes in by_notebook.values()
+            for start in range(0, len(nb_notes), chunk_size)]
+
+
 class api:
-    def __init__(self, user_agent=default_agent):
-        """Api instance.
+    # Request bodies at least this large are gzipped if compress_uploads.
+    compress_min_size = 1024
+
+    # GET requests changing the host, never cached.
+    unsafe = ('move',)
+
+    def __init__(self, user_agent=default_agent, pool=None,
+                 compress_uploads=False, cache=None, hook=None,
+                 coalesce=True, batch_window=None, versions=None):
+        """Api instance. Responses are requested compressed and
+        decompressed while they are read. Requests sent to the host are
+        counted and timed per method and keyword in monitor.
 
         :type user_agent: str
+        :param ConnectionPool pool: If given requests are sent over
+                                    pooled keep-alive connections.
+        :param bool compress_uploads: Gzip large request bodies, the host
+                                      has to accept compressed requests.
+        :param cache: If given GET responses are cached and revalidated
+                      with conditional requests.
+        :type cache: httpcache.ResponseCache
+        :param hook: If given called with a dict describing every request
+                     sent, see metrics.Monitor.add_hook.
+        :type hook: callable
+        :param bool coalesce: Concurrent identical GET requests share one
+                              request to the host, counted in flights.
+        :param batch_window: If given get_note requests issued within
+                             this many seconds are fetched together.
+        :type batch_window: int or float
+        :param versions: If given fetched note versions are kept there
+                         and never requested again.
+        :type versions: versions.VersionStore
         """
         self.user_agent = user_agent
+        self.pool = pool
+        self.compress_uploads = compress_uploads
+        self.cache = cache
+        self.monitor = Monitor()
+        self.flights = Group() if coalesce else None
+        self.loader = NoteLoader(self, batch_window) \
+            if batch_window is not None else None
+        self.versions = versions
+        if hook is not None:
+            self.monitor.add_hook(hook)
+
+    def metrics(self):
+        """Returns request counts, bytes sent and received, errors and
+        latency percentiles of the requests sent so far by method and
+        keyword, like 'GET notes'.
 
-    def basic_authentication(self, host, user, passwd):
-        """Basic authentication with host.
+        :rtype: dict
+        """
+        return self.monitor.snapshot()
+
+    def set_credentials(self, host, user, passwd):
+        """Sets host and authentication headers without contacting the host.
 
-        Returns false if connection fails.
         :type host: str
         :type user: str
         :type passwd: str
-        :rtype: bool
         """
         self.host = host if 'http://' in host else 'http://' + host
+        self.user = user
         self.headers = {
             'Application-Type': 'application/json',
             'Content-Type': 'application/json',
             'Authorization': 'Basic ' + b64('{}:{}'.format(user, passwd)),
             'Connection': 'keep-alive',
+            'Accept-Encoding': ', '.join(accepted_encodings),
             'User-Agent': self.user_agent
             }
+
+    def basic_authentication(self, host, user, passwd):
+        """Basic authentication with host.
+
+        Returns false if connection fails.
+        :type host: str
+        :type user: str
+        :type passwd: str
+        :rtype: bool
+        """
+        self.set_credentials(host, user, passwd)
         if self.request(None, 'GET', 'notebooks'):
             return True
         else:
             return False
 
-    def request(self, data, method, keyword, *args):
+    def request(self, data, method, keyword, *args, **kwargs):
         """Sends a request to the host and returns the parsed json data
         if successfull.
 
@@ -81,17 +768,33 @@ class api:
         :type method: str
         :type keyword: str
         :type args: str
+        :param kwargs: Passed to open.
         :rtype: dict or None
         """
+        if method == 'GET' and keyword not in self.unsafe and not kwargs \
+                and self.flights is not None:
+            return self.flights.do(
+                (keyword,) + tuple(str(arg) for arg in args),
+                lambda: self._request(data, method, keyword, *args))
+        return self._request(data, method, keyword, *args, **kwargs)
+
+    def _request(self, data, method, keyword, *args, **kwargs):
         try:
-            if data:
-                data = json.dumps(data).encode('ASCII')
-            uri = self.host + api_version + api_path[keyword].format(*args)
-            request = Request(uri, data, self.headers)
-            request.get_method = lambda: method
-            logger.info('{} request to {} with {}'.format(method, uri, data))
-            res = urlopen(request)
-            json_res = json.loads(res.read().decode('ASCII'))
+            if self.cache is None:
+                body = self.open(data, method, keyword, *args,
+                                 **kwargs).read()
+            elif method == 'GET' and keyword not in self.unsafe:
+                body = self._cached_get(keyword, *args)
+            else:
+                # Again afterwards, GET requests running meanwhile may
+                # have stored the old responses.
+                self._invalidate(keyword, *args)
+                try:
+                    body = self.open(data, method, keyword, *args,
+                                     **kwargs).read()
+                finally:
+                    self._invalidate(keyword, *args)
+            json_res = json.loads(body.decode('UTF-8'))
             if json_res['success'] is False:
                 logger.error('Unsuccessful request.')
             else:
@@ -99,6 +802,107 @@ class api:
         except Exception as e:
             logger.error(e)
 
+    def _invalidate(self, keyword, *args):
+        self.cache.invalidate(api_path[keyword].format(*args))
+        if keyword == 'move':
+            self.cache.invalidate('notebooks/{}'.format(args[-1]))
+
+    def _cached_get(self, keyword, *args):
+        path = api_path[keyword].format(*args)
+        # Responses differ per user.
+        uri = self.host.replace('://', '://{}@'.format(
+            quote(self.user, safe='')), 1) + api_version + path
+        entry, fresh = self.cache.lookup(uri)
+        if fresh:
+            return entry.body
+        try:
+            res = self.open(None, 'GET', keyword, *args,
+                            headers=self.cache.conditions(entry))
+        except HTTPError as e:
+            # urllib reports 304 Not Modified as error.
+            if e.code == 304 and entry is not None:
+                return self.cache.not_modified(uri, entry)
+            raise
+        body = res.read()
+        status = getattr(res, 'status', None) or res.getcode()
+        if status == 304 and entry is not None:
+            return self.cache.not_modified(uri, entry)
+        self.cache.store(uri, path, res.info(), body)
+        return body
+
+    def open(self, data, method, keyword, *args, **kwargs):
+        """Sends a request to the host and returns the response.
+
+        :type data: dict
+        :type method: str
+        :type keyword: str
+        :type args: str
+        :param dict headers: Headers added to the request.
+        :param MultipartBody body: Sent instead of data, with its content
+                                   type and chunked if its length is
+                                   unknown.
+        :rtype: http.client.HTTPResponse
+        """
+        headers = self.headers
+        if kwargs.get('headers'):
+            headers = dict(headers, **kwargs['headers'])
+        body = kwargs.get('body')
+        if body is not None:
+            headers = dict(headers, **{'Content-Type': body.content_type})
+            if body.length is not None:
+                headers['Content-Length'] = str(body.length)
+            data = body
+        elif data:
+            data = json.dumps(data).encode('UTF-8')
+        uri = self.host + api_version + api_path[keyword].format(*args)
+        logger.info('{} request to {} with {}'.format(
+            method, uri, 'upload' if body is not None else data))
+        if body is None and data and self.compress_uploads and \
+                len(data) >= self.compress_min_size:
+            data = gzip_compress(data)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        request = Request(uri, data, headers)
+        request.get_method = lambda: method
+        sent = len(data) if data and body is None else 0
+        start = time.time()
+
+        def finish(received, error):
+            self.monitor.record(
+                method, keyword, time.time() - start,
+                sent if body is None else body.sent, received, error)
+        try:
+            res = self.pool.urlopen(request) if self.pool \
+                else urlopen(request)
+        except HTTPError as e:
+            # Includes 304 Not Modified with urllib.
+            finish(0, e.code >= 400)
+            raise
+        except Exception:
+            finish(0, True)
+            raise
+        return decoded(MeteredResponse(res, finish))
+
+    def stream(self, keyword, *args):
+        """Sends a GET request to the host and yields the items of the
+        response one at a time, parsing the body while it is received.
+        Errors are logged and raised, so a failed response is not taken
+        for a complete one.
+
+        :type keyword: str
+        :type args: str
+        """
+        res = None
+        try:
+            res = self.open(None, 'GET', keyword, *args)
+            for item in iter_response(res):
+                yield item
+        except Exception as e:
+            logger.error(e)
+            raise
+        finally:
+            if res is not None:
+                res.close()
+
     def get(self, keyword, *args):
         """Convenience wrapper for GET request.
 
@@ -186,6 +990,14 @@ class api:
         """
         return self.get('notes', notebook_id)
 
+    def iter_notebook_notes(self, notebook_id):
+        """Yields the notes of notebook with notebook_id one at a time,
+        while they are received.
+
+        :type notebook_id: int
+        """
+        return self.stream('notes', notebook_id)
+
     def create_note(self, notebook_id, note_title, content=''):
         """Creates note with note_title in notebook.
 
@@ -203,12 +1015,15 @@ class api:
             notebook_id)
 
     def get_note(self, notebook_id, note_id):
-        """Returns note with note_id from notebook with notebook_id.
+        """Returns note with note_id from notebook with notebook_id. With
+        a loader the note is fetched in a batch with other notes.
 
         :type notebook_id: int
         :type note_id: int
         :rtype: dict
         """
+        if self.loader is not None:
+            return self.loader.load(notebook_id, note_id)
         return self.get_notes(notebook_id, [note_id])
 
     def get_notes(self, notebook_id, note_ids):
@@ -274,22 +1089,77 @@ class api:
         return self.list_notes_versions([note])
 
     def list_notes_versions(self, notes):
-        """Returns lists of versions of given notes.
+        """Returns lists of versions of given notes. Listed versions with
+        content are kept in the version store.
 
         :type notes: list
         :rtype: list
         """
-        return self.get('versions', notes[0]['notebook_id'], ','.join(
+        lists = self.get('versions', notes[0]['notebook_id'], ','.join(
             [str(note['id']) for note in notes]))
+        self._keep_versions(notes, lists)
+        return lists
+
+    def _keep_versions(self, notes, lists):
+        # Puts the listed versions with content into the version store.
+        if lists and self.versions is not None:
+            for note, versions in zip(notes, nested_versions(lists)):
+                for version in versions:
+                    if 'content' in version:
+                        self.versions.put(note['id'], version)
+
+    def _missing_versions(self, chunks, lists):
+        # Returns (note, version id) of the versions listed for chunks of
+        # notes that are not in the version store.
+        missing = []
+        for chunk, listed in zip(chunks, lists):
+            if not listed:
+                continue
+            for note, versions in zip(chunk, nested_versions(listed)):
+                missing.extend(
+                    (note, version['id']) for version in versions
+                    if not self.versions.has(note['id'], version['id']))
+        return missing
 
     def get_note_version(self, note, version_id):
-        """Returns version with version_id of note.
+        """Returns version with version_id of note, from the version
+        store if it was fetched before.
 
         :type note: models.Note
         :type version_id: int
         :rtype: dict
         """
-        return self.get('version', note['notebook_id'], note['id'], version_id)
+        if self.versions is not None:
+            version = self.versions.get(note['id'], version_id)
+            if version is not None:
+                return version
+        version = self.get('version', note['notebook_id'], note['id'],
+                           version_id)
+        if version is not None and self.versions is not None:
+            self.versions.put(note['id'], version)
+        return version
+
+    def prefetch_versions(self, notes, workers=4, chunk_size=50):
+        """Fetches all versions of notes missing in the version store,
+        listing them in chunks of chunk_size notes per notebook, with up
+        to workers concurrent requests. Returns the number of versions
+        added to the store.
+
+        :type notes: list
+        :type workers: int
+        :type chunk_size: int
+        :rtype: int
+        """
+        if self.versions is None:
+            raise ValueError('No version store to prefetch into.')
+        chunks = notebook_chunks(notes, chunk_size)
+        stored = self.versions.stats()['versions']
+        with ThreadPoolExecutor(max(workers, 1)) as executor:
+            missing = self._missing_versions(
+                chunks, list(executor.map(self.list_notes_versions, chunks)))
+            list(executor.map(lambda args: self.get_note_version(*args),
+                              missing))
+        return self.versions.stats()['versions'] - stored
 
     def list_note_attachments(self, note):
         """List attachments of note.
@@ -317,6 +1187,117 @@ class api:
             note['versions'][0]['id'],
             attachment_id)
 
+    def download_attachment(self, note, attachment, store,
+                            chunk_size=64 * 1024, progress=None):
+        """Downloads attachment of the latest version of note into store
+        and returns the path of its content, or None if the download
+        failed. Contents stored already are not downloaded again. The
+        body is written to disk in chunks of chunk_size bytes, an
+        interrupted download is resumed by the next call.
+
+        :type note: models.Note
+        :param attachment: Attachment as returned by the host, or its id.
+        :type attachment: dict or int
+        :type store: blobs.BlobStore
+        :type chunk_size: int
+        :param progress: Called with the bytes received and the size of
+                         the attachment, None if unknown, after every
+                         chunk.
+        :type progress: callable
+        :rtype: str or None
+        """
+        if not isinstance(attachment, dict):
+            attachment = self.get_note_attachment(note, attachment)
+            if attachment is None:
+                return None
+        args = (note['notebook_id'], note['id'], note['versions'][0]['id'],
+                attachment['id'])
+        uri = self.host + api_version + api_path['raw'].format(*args)
+        announced = attachment.get('hash')
+        # Concurrent downloads of uri wait for the first one, then find
+        # its content stored.
+        with store.download_lock(uri):
+            path = store.lookup(uri, announced)
+            if path is not None:
+                return path
+            target = store.partial(uri)
+            try:
+                digest = self._download(args, target, store.new_hash(),
+                                        chunk_size, progress)
+            except Exception as e:
+                logger.error('Download of {} failed: {}'.format(uri, e))
+                return None
+            if store.valid_digest(announced) and \
+                    digest.lower() != announced.lower():
+                logger.error('Download of {} is corrupt, hash {} instead '
+                             'of {}.'.format(uri, digest, announced))
+                os.remove(target)
+                return None
+            return store.commit(uri, target, digest)
+
+    def _download(self, args, target, digest, chunk_size, progress):
+        # Bytes of an earlier, interrupted download are kept.
+        offset = os.path.getsize(target) if os.path.exists(target) else 0
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            res = self.open(None, 'GET', 'raw', *args, headers=headers)
+        except HTTPError as e:
+            if e.code != 416:
+                raise
+            # The partial download is complete or does not match anymore.
+            os.remove(target)
+            return self._download(args, target, digest, chunk_size,
+                                  progress)
+        try:
+            status = getattr(res, 'status', None) or res.getcode()
+            if status != 206:
+                offset = 0
+            length = res.info().get('Content-Length')
+            total = offset + int(length) if length is not None else None
+            with open_partial(target, offset, digest, chunk_size) as f:
+                received = offset
+                while True:
+                    data = res.read(chunk_size)
+                    if not data:
+                        break
+                    f.write(data)
+                    digest.update(data)
+                    received += len(data)
+                    if progress is not None:
+                        progress(received, total)
+        finally:
+            res.close()
+        if total is not None and received != total:
+            raise IOError('Received {} of {} bytes'.format(received, total))
+        return digest.hexdigest()
+
+    def download_attachments(self, note, attachments, store, workers=4,
+                             progress=None, **kwargs):
+        """Downloads attachments of note into store with up to workers
+        concurrent requests and returns the paths of their contents in
+        order of attachments, None for failed downloads.
+
+        :type note: models.Note
+        :param list attachments: Attachments or their ids.
+        :type store: blobs.BlobStore
+        :type workers: int
+        :param progress: Called with the attachment, the bytes received
+                         and its size, see download_attachment.
+        :type progress: callable
+        :param kwargs: Passed to download_attachment.
+        :rtype: list
+        """
+        def download(attachment):
+            return self.download_attachment(
+                note, attachment, store,
+                progress=progress and partial(progress, attachment),
+                **kwargs)
+
+        with ThreadPoolExecutor(max(workers, 1)) as executor:
+            return list(executor.map(download, attachments))
+
     def delete_note_attachment(self, note, attachment_id):
         """Deletes attachment with attachment_id on note.
 
@@ -331,8 +1312,66 @@ class api:
             note['versions'][0]['id'],
             attachment_id)
 
-    def upload_attachment(self, note, attachment):
-        pass
+    def upload_attachment(self, note, attachment, filename=None,
+                          content_type=None, chunk_size=64 * 1024,
+                          progress=None):
+        """Uploads attachment to the latest version of note as
+        multipart/form-data, reading it in chunks of chunk_size bytes.
+        Attachments of unknown length are sent with chunked transfer
+        encoding.
+
+        :type note: models.Note
+        :param attachment: Path or file object opened in binary mode.
+        :type attachment: str or file
+        :param filename: Name of attachment by default.
+        :type filename: str
+        :param content_type: Guessed from filename if None.
+        :type content_type: str
+        :type chunk_size: int
+        :param progress: Called with the bytes sent and the total bytes
+                         to send, None if unknown, after every chunk.
+        :type progress: callable
+        :rtype: dict or None
+        """
+        if isinstance(attachment, str):
+            with open(attachment, 'rb') as fileobj:
+                return self.upload_attachment(
+                    note, fileobj, filename or os.path.basename(attachment),
+                    content_type, chunk_size, progress)
+        filename = filename or os.path.basename(
+            getattr(attachment, 'name', None) or 'attachment')
+        body = MultipartBody(attachment, filename, content_type,
+                             chunk_size=chunk_size, progress=progress)
+        return self.request(
+            None, 'POST', 'attachments',
+            note['notebook_id'],
+            note['id'],
+            note['versions'][0]['id'],
+            body=body)
+
+    def upload_attachments(self, note, attachments, workers=4,
+                           progress=None, **kwargs):
+        """Uploads attachments to note with up to workers concurrent
+        requests and returns the responses in order of attachments.
+
+        :type note: models.Note
+        :param list attachments: Paths or file objects.
+        :type workers: int
+        :param progress: Called with the attachment, the bytes sent and
+                         the total bytes of its upload, see
+                         upload_attachment.
+        :type progress: callable
+        :param kwargs: Passed to upload_attachment.
+        :rtype: list
+        """
+        def upload(attachment):
+            return self.upload_attachment(
+                note, attachment,
+                progress=progress and partial(progress, attachment),
+                **kwargs)
+
+        with ThreadPoolExecutor(max(workers, 1)) as executor:
+            return list(executor.map(upload, attachments))
 
     def list_tags(self):
         """Returns all tags.
@@ -341,6 +1380,15 @@ class api:
         """
         return self.get('tags')
 
+    def create_tag(self, title, visibility=0):
+        """Creates tag with title.
+
+        :type title: str
+        :type visibility: int
+        :rtype: dict
+        """
+        return self.post({'title': title, 'visibility': visibility}, 'tags')
+
     def get_tag(self, tag_id):
         """Returns tag with tag_id.
 
@@ -365,6 +1413,14 @@ class api:
         """
         return self.get('search', b64(keyword))
 
+    def iter_search(self, keyword):
+        """Yields notes containing given keyword one at a time, while they
+        are received.
+
+        :type keyword: str
+        """
+        return self.stream('search', b64(keyword))
+
     def i18n(self, keyword=None):
         """Returns either the full i18n dict or the requested word.
 
@@ -12,6 +12,10 @@ with open(path.join(here, 'README.rst'), 'r', encoding='utf-8') as f:
 with open(path.join(here, package_name, 'wrapper.py'), 'r') as f:
     version = re.search("__version__ = u?'([^']+)'", f.read()).group(1)
 
+install_requires = ['PyYAML', 'fuzzywuzzy', 'python-Levenshtein']
+if sys.version_info[0] < 3:
+    install_requires.append('futures')
+
 if __name__ == "__main__":
     # part taken from https://github.com/gbin/err/blob/master/setup.py#L54-68
     if sys.version_info[0] < 3:
@@ -50,13 +54,18 @@ if __name__ == "__main__":
             'Programming Language :: Python :: 2.7',
             'Programming Language :: Python :: 3.3',
             'Programming Language :: Python :: 3.4',
+            'Programming Language :: Python :: 3.6',
         ],
 
         entry_points={
             'console_scripts': ['paperworks = paperworks.cli:main']
             },
 
-        install_requires=['PyYAML', 'fuzzywuzzy', 'python-Levenshtein'],
+        install_requires=install_requires,
+
+        extras_require={
+            'brotli': ['brotli']
+            },
 
         keywords='paperwork rocks twostairs api wrapper',
 
@@ -0,0 +1,4 @@
+import sys
+
+# paperworks.aio and its tests use async generators.
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 6) else []
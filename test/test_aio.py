@@ -0,0 +1,360 @@
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from hashlib import md5
+from io import BytesIO
+from json import dumps
+from paperworks import aio, blobs, emulator, wrapper
+from paperworks.versions import VersionStore
+from test_data import *
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0
+    compress = False
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    received = b''
+    # Set to send the rest of a streamed response.
+    proceed = None
+    streamed = None
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline(), 16)
+                chunks.append(self.rfile.read(size + 2)[:size])
+                if size == 0:
+                    return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self):
+        Handler.received = self.read_body()
+        with Handler.lock:
+            Handler.active += 1
+            Handler.max_active = max(Handler.max_active, Handler.active)
+        time.sleep(self.delay)
+        with Handler.lock:
+            Handler.active -= 1
+        if self.proceed is not None:
+            return self.respond_streamed()
+        keyword = 'move' if '/move/' in self.path else \
+            'notes' if self.path.endswith('/notes') else 'notebooks'
+        body = dumps({'success': True, 'response': ret[keyword]}).encode(
+            'UTF-8')
+        self.send_response(200)
+        if self.compress:
+            body = wrapper.gzip_compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_streamed(self):
+        # The first note is sent, the rest once proceed is set.
+        body = dumps({'success': True, 'response': notes}).encode('UTF-8')
+        split = body.index(b'}, {') + 2
+        parts = [body[:split], body[split:]]
+        self.send_response(200)
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            parts = [compressor.compress(parts[0]) +
+                     compressor.flush(zlib.Z_SYNC_FLUSH),
+                     compressor.compress(parts[1]) + compressor.flush()]
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, part in enumerate(parts):
+            if i:
+                self.proceed.wait(5)
+            self.wfile.write('{:x}\r\n'.format(len(part)).encode('ASCII') +
+                             part + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+        self.streamed.set()
+
+    do_GET = do_POST = do_PUT = do_DELETE = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Timed out and cancelled requests close the socket early.
+        pass
+
+
+class TestAsyncApi(unittest.TestCase):
+    def setUp(self):
+        Handler.delay = 0
+        Handler.compress = False
+        Handler.max_active = 0
+        Handler.proceed = None
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = '127.0.0.1:{}'.format(self.server.server_port)
+        self.api = aio.AsyncApi(agent, concurrency=2, timeout=5)
+        self.loop = asyncio.new_event_loop()
+        self.assertTrue(self.complete(
+            self.api.basic_authentication(self.host, user, passwd)))
+
+    def tearDown(self):
+        self.complete(self.api.close())
+        self.loop.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_list_notebooks(self):
+        self.assertEqual(self.complete(self.api.list_notebooks()), notebooks)
+
+    def test_gzip(self):
+        Handler.compress = True
+        self.assertEqual(self.complete(self.api.list_notebooks()), notebooks)
+
+    def test_keep_alive(self):
+        self.complete(self.api.list_notebooks())
+        self.assertEqual(len(self.api._idle), 1)
+
+    def test_move_note(self):
+        self.assertEqual(
+            self.complete(self.api.move_note(note, new_notebook_id)), move[0])
+
+    def test_concurrency(self):
+        Handler.delay = 0.05
+
+        async def fan_out():
+            return await asyncio.gather(*[
+                self.api.list_notebook_notes(notebook_id) for _ in range(6)])
+
+        self.assertEqual(self.complete(fan_out()), [notes] * 6)
+        self.assertEqual(Handler.max_active, 2)
+
+    def test_timeout(self):
+        Handler.delay = 0.5
+        self.api.timeout = 0.05
+        self.assertIsNone(self.complete(self.api.list_notebooks()))
+        metrics = self.api.metrics()['GET notebooks']
+        self.assertEqual(metrics['requests'], 2)
+        self.assertEqual(metrics['errors'], 1)
+
+    def test_cancel(self):
+        Handler.delay = 0.5
+
+        async def cancelled():
+            task = self.loop.create_task(self.api.list_notebooks())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await task
+
+        self.assertRaises(asyncio.CancelledError, self.complete, cancelled())
+        self.assertEqual(self.api._idle, [])
+
+    def test_upload_attachment(self):
+        data = b'%PDF-1.4' * 1000
+        progress = []
+        self.assertEqual(self.complete(self.api.upload_attachment(
+            note, BytesIO(data), 'scan.pdf', chunk_size=1000,
+            progress=lambda *args: progress.append(args))), notebooks)
+        self.assertTrue(data in Handler.received)
+        self.assertTrue(b'filename="scan.pdf"' in Handler.received)
+        self.assertEqual(progress[-1], (len(Handler.received),) * 2)
+        self.assertEqual(
+            self.api.metrics()['POST attachments']['bytes_sent'],
+            len(Handler.received))
+
+    def test_upload_chunked(self):
+        class Unsized:
+            def __init__(self, data):
+                self.data = BytesIO(data)
+
+            def read(self, size):
+                return self.data.read(size)
+
+        data = b'%PDF-1.4' * 1000
+        self.assertEqual(self.complete(self.api.upload_attachments(
+            note, [Unsized(data)])), [notebooks])
+        self.assertTrue(data in Handler.received)
+        # The connection is still usable.
+        self.assertEqual(self.complete(self.api.list_notebooks()), notebooks)
+
+    def test_iter_notebook_notes(self):
+        async def collect():
+            return [item async for item in
+                    self.api.iter_notebook_notes(notebook_id)]
+
+        self.assertEqual(self.complete(collect()), notes)
+
+    def test_iter_while_received(self):
+        async def collect():
+            items = []
+            async for item in self.api.iter_notebook_notes(notebook_id):
+                # The first note arrives before the rest is sent.
+                if not items:
+                    self.assertFalse(Handler.streamed.is_set())
+                items.append(item)
+                Handler.proceed.set()
+            return items
+
+        for compress in (False, True):
+            Handler.compress = compress
+            Handler.proceed = threading.Event()
+            Handler.streamed = threading.Event()
+            self.assertEqual(self.complete(collect()), notes)
+        # The chunked body was received completely, its connection is
+        # reused.
+        Handler.proceed = None
+        self.assertEqual(len(self.api._idle), 1)
+        self.assertEqual(self.complete(self.api.list_notebooks()), notebooks)
+
+    def test_iter_failed(self):
+        Handler.delay = 0.5
+        self.api.timeout = 0.05
+
+        async def collect():
+            return [item async for item in self.api.iter_search(keyword)]
+
+        self.assertRaises(IOError, self.complete, collect())
+
+    def test_stale_connection(self):
+        class Stale:
+            def write(self, data):
+                pass
+
+            async def drain(self):
+                pass
+
+            async def readuntil(self, separator):
+                raise asyncio.IncompleteReadError(b'', None)
+
+            def close(self):
+                pass
+
+        connect = self.api._connect
+        connects = []
+
+        async def stale_first():
+            connects.append(True)
+            if len(connects) == 1:
+                return Stale(), Stale(), True
+            return await connect()
+
+        self.api._connect = stale_first
+        self.assertEqual(self.complete(self.api.list_notebooks()), notebooks)
+        self.assertEqual(len(connects), 2)
+        # The host may have processed the request, it is not sent again.
+        del(connects[:])
+        self.assertIsNone(self.complete(self.api.create_notebook('new')))
+        self.assertEqual(len(connects), 1)
+
+
+class TestAsyncFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = blobs.BlobStore(os.path.join(self.dir, 'blobs'))
+        self.versions = VersionStore(os.path.join(self.dir, 'v.db'))
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=2, notes=4)).start()
+        self.api = aio.AsyncApi(agent, versions=self.versions)
+        self.loop = asyncio.new_event_loop()
+        self.complete(self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd))
+        self.notes = [note for nb in self.complete(self.api.list_notebooks())
+                      for note in self.complete(
+                          self.api.list_notebook_notes(nb['id']))]
+        self.data = os.urandom(200 * 1024)
+        self.attachment = self.complete(self.api.upload_attachment(
+            self.notes[0], BytesIO(self.data), 'scan.pdf'))
+
+    def tearDown(self):
+        self.complete(self.api.close())
+        self.loop.close()
+        self.server.stop()
+        self.store.close()
+        self.versions.close()
+        shutil.rmtree(self.dir)
+
+    def complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def downloads(self):
+        return self.api.metrics().get('GET raw', {}).get('requests', 0)
+
+    def test_download(self):
+        progress = []
+        path = self.complete(self.api.download_attachment(
+            self.notes[0], self.attachment, self.store, chunk_size=4096,
+            progress=lambda *args: progress.append(args)))
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(progress[-1], (len(self.data), len(self.data)))
+        self.assertEqual(self.complete(self.api.download_attachment(
+            self.notes[0], self.attachment['id'], self.store)), path)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_resume(self):
+        uri = self.api.host + wrapper.api_version + wrapper.api_path[
+            'raw'].format(self.notes[0]['notebook_id'], self.notes[0]['id'],
+                          self.notes[0]['versions'][0]['id'],
+                          self.attachment['id'])
+        with open(self.store.partial(uri), 'wb') as f:
+            f.write(self.data[:1000])
+        path = self.complete(self.api.download_attachment(
+            self.notes[0], self.attachment, self.store))
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(self.api.metrics()['GET raw']['bytes_received'],
+                         len(self.data) - 1000)
+
+    def test_corrupt(self):
+        attachment = dict(self.attachment, hash=md5(b'other').hexdigest())
+        self.assertIsNone(self.complete(self.api.download_attachment(
+            self.notes[0], attachment, self.store)))
+        self.assertEqual(os.listdir(self.store.partial_dir), [])
+
+    def test_download_same(self):
+        attachment = dict(self.attachment, hash=None)
+        paths = self.complete(self.api.download_attachments(
+            self.notes[0], [attachment] * 4, self.store))
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(self.read(paths[0]), self.data)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_prefetch_versions(self):
+        for note in self.notes:
+            self.complete(self.api.update_note(dict(note, content='changed')))
+        self.assertEqual(self.complete(self.api.prefetch_versions(
+            self.notes, chunk_size=1)), 8)
+        self.assertEqual(self.complete(self.api.prefetch_versions(
+            self.notes)), 0)
+        requests = self.server.requests
+        note = self.notes[0]
+        version = self.complete(self.api.get_note_version(
+            note, note['versions'][0]['id']))
+        self.assertEqual(version['content'], note['content'])
+        self.assertEqual(self.server.requests, requests)
@@ -0,0 +1,94 @@
+import unittest
+import threading
+from paperworks import batching, emulator, models, wrapper
+from test_data import *
+
+
+class TestNoteLoader(unittest.TestCase):
+    def setUp(self):
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=2, notes=20)).start()
+        self.api = wrapper.api(agent, pool=wrapper.ConnectionPool())
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        self.notebooks = self.api.list_notebooks()
+        self.notes = [self.api.list_notebook_notes(nb['id'])
+                      for nb in self.notebooks]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def concurrently(self, func, args):
+        results = [None] * len(args)
+
+        def call(i):
+            results[i] = func(*args[i])
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(len(args))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_window(self):
+        self.api.loader = batching.NoteLoader(self.api, 0.1)
+        args = [(note['notebook_id'], note['id'])
+                for notes in self.notes for note in notes[:5]]
+        requests = self.server.requests
+        results = self.concurrently(self.api.get_note, args)
+        self.assertEqual(results, [note for notes in self.notes
+                                   for note in notes[:5]])
+        # One request per notebook.
+        self.assertEqual(self.server.requests - requests, 2)
+        self.assertEqual(self.api.loader.stats(),
+                         {'loads': 10, 'batches': 2, 'pending': 0})
+
+    def test_tick(self):
+        loader = batching.NoteLoader(self.api, None)
+        notes = self.notes[0]
+        futures = [loader.submit(note['notebook_id'], note['id'])
+                   for note in notes[:3]]
+        futures.append(loader.submit(notes[0]['notebook_id'], 999))
+        futures.append(loader.submit(notes[0]['notebook_id'],
+                                     notes[0]['id']))
+        self.assertFalse(any(future.done() for future in futures))
+        requests = self.server.requests
+        loader.tick()
+        # The missing note fails the batch, which is fetched note by note.
+        self.assertEqual(self.server.requests - requests, 1 + 4)
+        self.assertEqual([future.result() for future in futures],
+                         notes[:3] + [None, notes[0]])
+        self.assertIsNot(futures[0].result(), futures[4].result())
+        self.assertEqual(loader.load(notes[3]['notebook_id'],
+                                     notes[3]['id']), notes[3])
+
+    def test_max_batch(self):
+        loader = batching.NoteLoader(self.api, 10, max_batch=3)
+        notes = self.notes[0]
+        futures = [loader.submit(note['notebook_id'], note['id'])
+                   for note in notes[:4]]
+        self.assertTrue(all(future.done() for future in futures[:3]))
+        self.assertFalse(futures[3].done())
+        loader.tick()
+        self.assertEqual(futures[3].result(), notes[3])
+
+    def test_threaded_update(self):
+        models.use_threading = True
+        try:
+            pw = models.Paperwork(self.server.user, self.server.passwd,
+                                  self.server.host, batch_window=0.1)
+            pw.download()
+            for note in pw.get_notes():
+                note.title = 'changed'
+            requests = self.server.requests
+            pw.update()
+            self.assertEqual(pw.flush(), [])
+        finally:
+            models.use_threading = False
+        # The remote notes were fetched in batches before the updates.
+        self.assertLess(self.server.requests - requests, 2 * 20)
+        self.assertEqual(pw.api.loader.stats()['loads'], 20)
+        self.assertEqual(
+            [note['title'] for note in self.server.dataset.notes.values()],
+            ['changed'] * 20)
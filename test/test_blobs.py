@@ -0,0 +1,170 @@
+import unittest
+import tempfile
+import shutil
+import os
+from hashlib import md5
+from io import BytesIO
+from paperworks import blobs, emulator, wrapper
+from test_data import *
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = blobs.BlobStore(self.dir)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, uri, data):
+        partial = self.store.partial(uri)
+        with open(partial, 'wb') as f:
+            f.write(data)
+        return partial
+
+    def test_commit(self):
+        digest = md5(b'data').hexdigest()
+        self.assertIsNone(self.store.lookup('a'))
+        path = self.store.commit('a', self.write('a', b'data'), digest)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        self.assertEqual(self.store.lookup('a'), path)
+        # Known by digest before any download of b.
+        self.assertEqual(self.store.lookup('b', digest), path)
+        self.assertEqual(self.store.commit('c', self.write('c', b'data'),
+                                           digest), path)
+        self.assertEqual(os.listdir(self.store.partial_dir), [])
+        stats = self.store.stats()
+        self.assertEqual((stats['blobs'], stats['size']), (1, 4))
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertEqual(stats['deduplicated'], 1)
+
+    def test_discard(self):
+        digest = md5(b'data').hexdigest()
+        self.store.commit('a', self.write('a', b'data'), digest)
+        self.store.discard(digest)
+        self.assertIsNone(self.store.lookup('a'))
+        self.assertIsNone(self.store.lookup('a', digest))
+
+    def test_valid_digest(self):
+        self.assertTrue(self.store.valid_digest(md5(b'').hexdigest()))
+        self.assertFalse(self.store.valid_digest(None))
+        self.assertFalse(self.store.valid_digest('abc'))
+        self.assertFalse(self.store.valid_digest('x' * 32))
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = blobs.BlobStore(self.dir)
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=1, notes=2)).start()
+        self.api = wrapper.api(agent, pool=wrapper.ConnectionPool())
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        self.notes = self.api.list_notebook_notes(
+            self.api.list_notebooks()[0]['id'])
+        self.data = os.urandom(200 * 1024)
+        self.attachment = self.api.upload_attachment(
+            self.notes[0], BytesIO(self.data), 'scan.pdf')
+
+    def tearDown(self):
+        self.server.stop()
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def downloads(self):
+        return self.api.metrics().get('GET raw', {}).get('requests', 0)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        progress = []
+        path = self.api.download_attachment(
+            self.notes[0], self.attachment, self.store, chunk_size=4096,
+            progress=lambda *args: progress.append(args))
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(progress[-1], (len(self.data), len(self.data)))
+        self.assertEqual(
+            self.api.download_attachment(self.notes[0],
+                                         self.attachment['id'], self.store),
+            path)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_shared_content(self):
+        other = self.api.upload_attachment(
+            self.notes[1], BytesIO(self.data), 'copy.pdf')
+        path = self.api.download_attachment(
+            self.notes[0], self.attachment, self.store)
+        self.assertEqual(
+            self.api.download_attachment(self.notes[1], other, self.store),
+            path)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_hashless(self):
+        # Without announced hash the same content is downloaded, but
+        # stored once.
+        attachment = dict(self.attachment, hash=None)
+        other = dict(self.api.upload_attachment(
+            self.notes[1], BytesIO(self.data), 'copy.pdf'), hash=None)
+        path = self.api.download_attachment(
+            self.notes[0], attachment, self.store)
+        self.assertEqual(
+            self.api.download_attachment(self.notes[1], other, self.store),
+            path)
+        self.assertEqual(
+            self.api.download_attachment(self.notes[1], other, self.store),
+            path)
+        self.assertEqual(self.downloads(), 2)
+        self.assertEqual(self.store.stats()['deduplicated'], 1)
+
+    def test_resume(self):
+        uri = self.api.host + wrapper.api_version + wrapper.api_path[
+            'raw'].format(self.notes[0]['notebook_id'], self.notes[0]['id'],
+                          self.notes[0]['versions'][0]['id'],
+                          self.attachment['id'])
+        with open(self.store.partial(uri), 'wb') as f:
+            f.write(self.data[:1000])
+        path = self.api.download_attachment(
+            self.notes[0], self.attachment, self.store)
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(
+            self.api.metrics()['GET raw']['bytes_received'],
+            len(self.data) - 1000)
+
+    def test_complete_partial(self):
+        uri = self.api.host + wrapper.api_version + wrapper.api_path[
+            'raw'].format(self.notes[0]['notebook_id'], self.notes[0]['id'],
+                          self.notes[0]['versions'][0]['id'],
+                          self.attachment['id'])
+        with open(self.store.partial(uri), 'wb') as f:
+            f.write(self.data + b'stale')
+        path = self.api.download_attachment(
+            self.notes[0], self.attachment, self.store)
+        self.assertEqual(self.read(path), self.data)
+
+    def test_corrupt(self):
+        attachment = dict(self.attachment, hash=md5(b'other').hexdigest())
+        self.assertIsNone(self.api.download_attachment(
+            self.notes[0], attachment, self.store))
+        self.assertEqual(os.listdir(self.store.partial_dir), [])
+
+    def test_parallel(self):
+        files = [os.urandom(1024 * i) for i in range(1, 7)]
+        attachments = self.api.upload_attachments(
+            self.notes[1], [BytesIO(data) for data in files],
+            filename='scan.pdf')
+        paths = self.api.download_attachments(
+            self.notes[1], attachments, self.store, workers=3)
+        self.assertEqual([self.read(path) for path in paths], files)
+
+    def test_parallel_same(self):
+        attachment = dict(self.attachment, hash=None)
+        paths = self.api.download_attachments(
+            self.notes[0], [attachment] * 4, self.store, workers=4)
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(self.read(paths[0]), self.data)
+        self.assertEqual(self.downloads(), 1)
@@ -0,0 +1,196 @@
+import unittest
+import tempfile
+import shutil
+import os
+from json import dumps
+from paperworks import models, cache, contents
+from test_data import *
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+cached_notebook = dict(notebook, updated_at=note_updated_at)
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch('paperworks.wrapper.urlopen')
+        mocked_urlopen = self.patcher.start()
+        temp = tempfile.TemporaryFile()
+        temp.write(dumps(
+            {
+                'success': True,
+                'response': 'success'
+            }).encode('ASCII'))
+        temp.seek(0)
+        mocked_urlopen.return_value = temp
+        self.dir = tempfile.mkdtemp()
+        self.store = cache.Store(os.path.join(self.dir, 'cache.db'))
+        self.pw = self.paperwork()
+        self.pw.load_tags(tags)
+        nb = models.Notebook.from_json(cached_notebook, self.pw.api)
+        self.pw.add_notebook(nb)
+        nb.load(notes, self.pw.tags)
+        self.pw.save(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        self.patcher.stop()
+        shutil.rmtree(self.dir)
+
+    def paperwork(self):
+        return models.Paperwork(user, passwd, uri)
+
+    def test_wal(self):
+        mode = self.store.db.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_load(self):
+        pw = self.paperwork()
+        self.assertTrue(pw.load(self.store))
+        self.assertEqual(sorted(pw.tags), [tag_id, tag2_id])
+        nb = pw.notebooks[notebook_id]
+        self.assertEqual(nb.updated_at, models.timestamp(note_updated_at))
+        self.assertEqual(sorted(nb.notes), [note_id, note2_id])
+        loaded = nb.notes[note_id]
+        self.assertEqual(loaded.content, content)
+        self.assertEqual(loaded.updated_at,
+                         models.timestamp(note_updated_at))
+        self.assertEqual([tag.id for tag in loaded.tags], [tag_id])
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_save_keeps_contents(self, mocked_get_notes):
+        # Contents evicted from the cache are kept in the store.
+        pw = models.Paperwork(user, passwd, uri,
+                              contents=contents.ContentCache(max_size=1))
+        pw.load(self.store)
+        pw.notebooks[notebook_id].notes[note_id].title = 'renamed'
+        pw.save(self.store)
+        pw.save(self.store)
+        self.assertFalse(mocked_get_notes.called)
+        pw = self.paperwork()
+        pw.load(self.store)
+        loaded = pw.notebooks[notebook_id].notes[note_id]
+        self.assertEqual(loaded.title, 'renamed')
+        self.assertEqual(loaded.content, content)
+        self.assertEqual(len(pw.notebooks[notebook_id].notes), 2)
+
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_save_keeps_local_changes(self, mocked_list_tags,
+                                      mocked_list_notebooks,
+                                      mocked_list_notebook_notes):
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = [cached_notebook]
+        pw = self.paperwork()
+        pw.load(self.store)
+        edited = pw.notebooks[notebook_id].notes[note_id]
+        edited.title = 'renamed'
+        edited.content = 'edited'
+        pw.notebooks[notebook_id].title = 'renamed notebook'
+        pw.save(self.store)
+        pw = self.paperwork()
+        pw.load(self.store)
+        pw.sync(self.store)
+        self.assertFalse(mocked_list_notebook_notes.called)
+        nb = pw.notebooks[notebook_id]
+        loaded = nb.notes[note_id]
+        self.assertEqual(pw.changes(), [(nb, ['title']),
+                                        (loaded, ['content', 'title'])])
+        self.assertEqual(loaded.content, 'edited')
+        # Once updated to the host, the note is stored clean.
+        loaded.clean()
+        nb.clean()
+        pw.save(self.store)
+        pw = self.paperwork()
+        pw.load(self.store)
+        self.assertEqual(pw.changes(), [])
+        self.assertEqual(pw.notebooks[notebook_id].notes[note_id].title,
+                         'renamed')
+
+    def test_old_schema(self):
+        path = os.path.join(self.dir, 'old.db')
+        db = cache.sqlite3.connect(path)
+        db.executescript(cache.schema.replace(
+            ",\n    dirty TEXT NOT NULL DEFAULT ''", ''))
+        db.execute("INSERT INTO notebooks (id, title) VALUES (1, 'old')")
+        db.commit()
+        db.close()
+        store = cache.Store(path)
+        pw = self.paperwork()
+        self.assertTrue(pw.load(store))
+        self.assertEqual(pw.notebooks[1].dirty, frozenset())
+        store.close()
+
+    def test_load_empty(self):
+        store = cache.Store(os.path.join(self.dir, 'empty.db'))
+        self.assertFalse(self.paperwork().load(store))
+        store.close()
+
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_sync_unchanged(self, mocked_list_tags, mocked_list_notebooks,
+                            mocked_list_notebook_notes):
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = [cached_notebook]
+        pw = self.paperwork()
+        pw.load(self.store)
+        pw.sync(self.store)
+        self.assertFalse(mocked_list_notebook_notes.called)
+        self.assertEqual(sorted(pw.notebooks[notebook_id].notes),
+                         [note_id, note2_id])
+
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_sync_changed(self, mocked_list_tags, mocked_list_notebooks,
+                          mocked_list_notebook_notes):
+        changed_note = dict(note, content='changed',
+                            updated_at='2014-09-21 19:43:59')
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = [
+            dict(cached_notebook, updated_at='2014-09-21 19:43:59'),
+            notebook2]
+        mocked_list_notebook_notes.side_effect = lambda id: \
+            [changed_note] if id == notebook_id else [note2]
+        pw = self.paperwork()
+        pw.load(self.store)
+        unchanged = pw.notebooks[notebook_id].notes[note_id]
+        pw.sync(self.store, workers=2)
+        self.assertEqual(list(pw.notebooks[notebook_id].notes), [note_id])
+        self.assertEqual(list(pw.notebooks[notebook2_id].notes), [note2_id])
+        self.assertFalse(unchanged is pw.notebooks[notebook_id].notes[note_id])
+
+        pw = self.paperwork()
+        pw.load(self.store)
+        self.assertEqual(
+            pw.notebooks[notebook_id].notes[note_id].content, 'changed')
+        self.assertEqual(list(pw.notebooks[notebook2_id].notes), [note2_id])
+
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_sync_keeps_local_changes(self, mocked_list_tags,
+                                      mocked_list_notebooks,
+                                      mocked_list_notebook_notes):
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = [
+            dict(cached_notebook, updated_at='2014-09-21 19:43:59')]
+        mocked_list_notebook_notes.return_value = [
+            dict(note, content='changed', updated_at='2014-09-21 19:43:59')]
+        pw = self.paperwork()
+        pw.load(self.store)
+        edited = pw.notebooks[notebook_id].notes[note_id]
+        edited.content = 'edited'
+        changes = pw.fetch_changes()
+        # Fetching leaves the instance alone.
+        self.assertTrue(pw.notebooks[notebook_id].notes[note_id] is edited)
+        self.assertTrue(note2_id in pw.notebooks[notebook_id].notes)
+        pw.apply_changes(self.store, changes)
+        self.assertTrue(pw.notebooks[notebook_id].notes[note_id] is edited)
+        self.assertEqual(edited.content, 'edited')
+        self.assertEqual(list(pw.notebooks[notebook_id].notes), [note_id])
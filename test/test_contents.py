@@ -0,0 +1,154 @@
+import unittest
+import tempfile
+from json import dumps
+from paperworks import models, contents
+from test_data import *
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = contents.ContentCache(max_size=10)
+
+    def test_lru(self):
+        self.cache.put(1, 'aaaa')
+        self.cache.put(2, 'bbbb')
+        self.assertEqual(self.cache.get(1), 'aaaa')
+        self.cache.put(3, 'cccc')
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), 'aaaa')
+        self.assertEqual(self.cache.size, 8)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['evictions']), (2, 1, 1))
+
+    def test_replace_and_discard(self):
+        self.cache.put(1, 'aaaa')
+        self.cache.put(1, 'aa')
+        self.assertEqual(self.cache.size, 2)
+        self.cache.discard(1)
+        self.cache.discard(1)
+        self.assertEqual((self.cache.size, len(self.cache)), (0, 0))
+
+    def test_oversized(self):
+        self.cache.put(1, 'a' * 20)
+        self.assertEqual(self.cache.get(1), 'a' * 20)
+        self.cache.put(2, 'b')
+        self.assertIsNone(self.cache.get(1))
+
+
+class TestLazyNotes(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch('paperworks.wrapper.urlopen')
+        mocked_urlopen = self.patcher.start()
+        temp = tempfile.TemporaryFile()
+        temp.write(dumps(
+            {
+                'success': True,
+                'response': 'success'
+            }).encode('ASCII'))
+        temp.seek(0)
+        mocked_urlopen.return_value = temp
+        self.contents = contents.ContentCache(max_size=len(content))
+        self.pw = models.Paperwork(user, passwd, uri, contents=self.contents)
+        self.pw.load_tags(tags)
+        self.nb = models.Notebook.from_json(notebook, self.pw.api)
+        self.pw.add_notebook(self.nb)
+        self.nb.load(notes, self.pw.tags)
+        self.note = self.nb.notes[note_id]
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_unloaded(self):
+        self.assertIsNone(self.note.loaded_content)
+        self.assertIsNone(self.nb.notes[note2_id].loaded_content)
+        self.assertEqual(len(self.contents), 1)
+        self.assertEqual(self.pw.search('some content'),
+                         [self.note, self.nb.notes[note2_id]])
+
+    @patch('paperworks.wrapper.api.move_note')
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_no_fetch_on_change(self, mocked_get_notes, mocked_move_note):
+        self.contents.discard(note_id)
+        self.note.title = 'renamed'
+        other = models.Notebook.from_json(notebook2, self.pw.api)
+        self.pw.add_notebook(other)
+        self.note.move_to(other)
+        self.assertFalse(mocked_get_notes.called)
+        self.assertEqual(self.pw.search('renamed content'), [self.note])
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_fetch(self, mocked_get_notes):
+        mocked_get_notes.return_value = [note]
+        self.assertEqual(self.note.content, content)
+        mocked_get_notes.assert_called_once_with(notebook_id, [note_id])
+        self.assertEqual(self.note.content, content)
+        self.assertEqual(mocked_get_notes.call_count, 1)
+        self.assertIsNone(self.note.loaded_content)
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_phrase_fetch(self, mocked_get_notes):
+        mocked_get_notes.return_value = notes
+        self.contents.discard(note_id)
+        self.contents.discard(note2_id)
+        self.assertEqual(self.pw.search('"some content"'),
+                         [self.note, self.nb.notes[note2_id]])
+        # Both contents are fetched with one request.
+        self.assertEqual(mocked_get_notes.call_count, 1)
+        self.assertEqual(sorted(mocked_get_notes.call_args[0][1]),
+                         [note_id, note2_id])
+        mocked_get_notes.return_value = None
+        self.contents.discard(note_id)
+        self.contents.discard(note2_id)
+        self.assertEqual(self.pw.search('"some content"'), [])
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_fetch_single(self, mocked_get_notes):
+        # A single note is returned without list.
+        mocked_get_notes.return_value = note
+        self.assertEqual(self.note.content, content)
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_fetch_batched(self, mocked_get_notes):
+        mocked_get_notes.return_value = notes
+        self.contents.chunk_size = 1
+        fetched = self.contents.fetch(self.nb.get_notes())
+        self.assertEqual(fetched, {note_id: content, note2_id: content})
+        self.assertEqual(mocked_get_notes.call_count, 1)
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_fetch_failed(self, mocked_get_notes):
+        mocked_get_notes.return_value = None
+        self.contents.discard(note2_id)
+        with self.assertRaises(IOError):
+            self.nb.notes[note2_id].content
+
+    @patch('paperworks.wrapper.api.update_note')
+    @patch('paperworks.wrapper.api.get_note')
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_push_fetch_failed(self, mocked_get_notes, mocked_get_note,
+                               mocked_update_note):
+        mocked_get_notes.return_value = None
+        mocked_get_note.return_value = note2
+        self.contents.discard(note2_id)
+        other = self.nb.notes[note2_id]
+        other.title = 'renamed'
+        with self.assertRaises(IOError):
+            other.update(force=True)
+        self.assertFalse(mocked_update_note.called)
+        self.assertEqual(other.dirty, set(['title']))
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_edit(self, mocked_get_notes):
+        self.note.content = 'changed'
+        self.assertFalse(mocked_get_notes.called)
+        self.assertEqual(self.note.dirty, set(['content']))
+        self.assertEqual(self.note.loaded_content, 'changed')
+        self.note.clean()
+        self.assertIsNone(self.note.loaded_content)
+        self.assertEqual(self.note.content, 'changed')
@@ -0,0 +1,95 @@
+import unittest
+import time
+from paperworks import emulator, models, wrapper
+from test_data import *
+
+
+class TestDataset(unittest.TestCase):
+    def test_generate(self):
+        dataset = emulator.Dataset.generate(notebooks=3, notes=10, tags=2)
+        self.assertEqual(len(dataset.get_notebooks()), 3)
+        self.assertEqual(len(dataset.get_tags()), 2)
+        self.assertEqual(
+            sum(len(dataset.get_notes(nb['id']))
+                for nb in dataset.get_notebooks()), 10)
+        other = emulator.Dataset.generate(notebooks=3, notes=10, tags=2)
+        self.assertEqual(
+            [note['content'] for note in dataset.notes.values()],
+            [note['content'] for note in other.notes.values()])
+
+    def test_missing(self):
+        dataset = emulator.Dataset.generate(notebooks=1, notes=1)
+        self.assertRaises(KeyError, dataset.get_notes, '99')
+        self.assertRaises(KeyError, dataset.get_note, '99', '1')
+
+
+class TestEmulator(unittest.TestCase):
+    def setUp(self):
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=2, notes=20, tags=3)).start()
+        self.api = wrapper.api(agent, pool=wrapper.ConnectionPool())
+        self.assertTrue(self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd))
+        self.notebook_id = self.api.list_notebooks()[0]['id']
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_authentication(self):
+        self.assertFalse(wrapper.api(agent).basic_authentication(
+            self.server.host, self.server.user, 'wrong'))
+
+    def test_notes(self):
+        notes = self.api.list_notebook_notes(self.notebook_id)
+        self.assertEqual(len(notes), 10)
+        self.assertEqual(
+            self.api.get_note(self.notebook_id, notes[0]['id']), notes[0])
+        self.assertEqual(len(self.api.get_notes(
+            self.notebook_id, [note['id'] for note in notes[:3]])), 3)
+        note = dict(notes[0], title='changed')
+        self.assertEqual(self.api.update_note(note)['title'], 'changed')
+        self.assertEqual(len(self.api.list_note_versions(note)[0]), 2)
+        self.assertEqual(
+            self.api.create_note(self.notebook_id, 'new', 'milk')['title'],
+            'new')
+        self.assertIn('new', [note['title'] for note in
+                              self.api.search('milk')])
+
+    def test_bulk(self):
+        notebooks = self.api.list_notebooks()
+        notes = self.api.list_notebook_notes(self.notebook_id)
+        moved = self.api.move_notes(notes[:5], notebooks[1]['id'])
+        self.assertEqual(len(moved), 5)
+        self.assertEqual(
+            len(self.api.list_notebook_notes(notebooks[1]['id'])), 15)
+        deleted = self.api.delete_notes(
+            [dict(note, notebook_id=notebooks[1]['id'])
+             for note in notes[:5]])
+        self.assertEqual(len(deleted), 5)
+        self.assertEqual(
+            len(self.api.list_notebook_notes(notebooks[1]['id'])), 10)
+        self.assertIsNone(self.api.get_note(notebooks[1]['id'],
+                                            notes[0]['id']))
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        start = time.time()
+        self.api.list_tags()
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_errors(self):
+        self.server.error_rate = 1
+        self.assertIsNone(self.api.list_tags())
+        self.assertEqual(self.api.metrics()['GET tags']['errors'], 1)
+
+    def test_paperwork(self):
+        pw = models.Paperwork(self.server.user, self.server.passwd,
+                              self.server.host)
+        pw.download(2, stream=True)
+        self.assertEqual(len(pw.get_notes()), 20)
+        note = pw.get_notes()[0]
+        note.title = 'changed'
+        pw.update()
+        self.assertEqual(self.server.dataset.notes[note.id]['title'],
+                         'changed')
+        self.assertEqual(pw.reconcile()['pulled'], 0)
@@ -0,0 +1,181 @@
+import unittest
+import tempfile
+import shutil
+import os
+import threading
+from json import dumps
+from paperworks import httpcache, wrapper
+from test_data import *
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_memory(self):
+        self.lru(httpcache.MemoryBackend(10))
+
+    def test_disk(self):
+        backend = httpcache.DiskBackend(os.path.join(self.dir, 'http.db'), 10)
+        self.lru(backend)
+        backend.close()
+
+    def lru(self, backend):
+        backend.put('a', httpcache.Entry('tags', b'aaaa', '"1"'))
+        backend.put('b', httpcache.Entry('notebooks', b'bbbb'))
+        self.assertEqual(backend.get('a').etag, '"1"')
+        backend.put('c', httpcache.Entry('i18n', b'cccc'))
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a').body, b'aaaa')
+        self.assertEqual(sorted(backend.paths()),
+                         [('a', 'tags'), ('c', 'i18n')])
+        backend.discard('a')
+        self.assertIsNone(backend.get('a'))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = httpcache.ResponseCache(ttl=60)
+        for path in ('notebooks', 'notebooks/1', 'notebooks/1/notes',
+                     'notebooks/2/notes', 'notebooks/1/notes/4,5', 'tags',
+                     'tagged/42', 'i18n'):
+            self.cache.store(path, path, {'ETag': '"1"'}, b'{}')
+
+    def cached(self):
+        return sorted(path for uri, path in self.cache.backend.paths())
+
+    def test_related(self):
+        self.assertTrue(httpcache.related('notebooks/1/notes/4',
+                                          'notebooks/1/notes/3,4'))
+        self.assertTrue(httpcache.related('notebooks/1', 'notebooks'))
+        self.assertFalse(httpcache.related('notebooks/1/notes',
+                                           'notebooks/2/notes'))
+
+    def test_invalidate(self):
+        self.cache.invalidate('notebooks/1/notes/5')
+        self.assertEqual(self.cached(), ['i18n', 'notebooks/2/notes', 'tags'])
+        self.cache.invalidate('tags/42')
+        self.assertEqual(self.cached(), ['i18n'])
+
+    def test_expiry(self):
+        entry, fresh = self.cache.lookup('tags')
+        self.assertFalse(fresh)
+        self.assertEqual(self.cache.conditions(entry),
+                         {'If-None-Match': '"1"'})
+        self.cache.max_age = 60
+        self.assertTrue(self.cache.lookup('tags')[1])
+        entry.stored_at -= 120
+        self.assertEqual(self.cache.lookup('tags'), (None, False))
+        self.assertFalse('tags' in self.cached())
+
+    def test_uncacheable(self):
+        self.cache.store('search/a', 'search/a', {}, b'{}')
+        self.assertFalse('search/a' in self.cached())
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    version = 1
+    requests = []
+
+    def respond(self, status, body=b''):
+        self.send_response(status)
+        if status == 200:
+            self.send_header('ETag', '"{}"'.format(ETagHandler.version))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        etag = '"{}"'.format(ETagHandler.version)
+        if self.headers.get('If-None-Match') == etag:
+            ETagHandler.requests.append(304)
+            return self.respond(304)
+        ETagHandler.requests.append(200)
+        self.respond(200, dumps({'success': True, 'response': tags}).encode(
+            'ASCII'))
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        ETagHandler.version += 1
+        self.respond(200, dumps({'success': True, 'response': tag}).encode(
+            'ASCII'))
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        ETagHandler.version = 1
+        ETagHandler.requests = []
+        self.server = Server(('127.0.0.1', 0), ETagHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = '127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def api(self, pool=None):
+        api = wrapper.api(agent, pool=pool, cache=httpcache.ResponseCache())
+        api.set_credentials(self.host, user, passwd)
+        return api
+
+    def test_not_modified(self):
+        for pool in (None, wrapper.ConnectionPool(timeout=5)):
+            ETagHandler.requests = []
+            api = self.api(pool)
+            self.assertEqual(api.list_tags(), tags)
+            self.assertEqual(api.list_tags(), tags)
+            self.assertEqual(ETagHandler.requests, [200, 304])
+            self.assertEqual(api.cache.stats()['revalidated'], 1)
+
+    def test_invalidated_by_put(self):
+        api = self.api()
+        api.list_tags()
+        api.cache.max_age = 60
+        self.assertEqual(api.list_tags(), tags)
+        self.assertEqual(ETagHandler.requests, [200])
+        api.put(tag, 'tag', tag_id)
+        self.assertEqual(api.list_tags(), tags)
+        self.assertEqual(ETagHandler.requests, [200, 200])
+
+    def test_invalidated_after_write(self):
+        api = self.api()
+        api.cache.max_age = 60
+        open_request = api.open
+
+        def open_during_get(data, method, keyword, *args, **kwargs):
+            res = open_request(data, method, keyword, *args, **kwargs)
+            if method == 'PUT':
+                # A GET finishing while the PUT is processed.
+                api.list_tags()
+            return res
+        api.open = open_during_get
+        api.put(tag, 'tag', tag_id)
+        self.assertEqual(api.cache.stats()['entries'], 0)
+
+    def test_per_user(self):
+        api = self.api()
+        api.cache.max_age = 60
+        api.list_tags()
+        api.set_credentials(self.host, 'other', passwd)
+        api.list_tags()
+        self.assertEqual(ETagHandler.requests, [200, 200])
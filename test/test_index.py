@@ -0,0 +1,160 @@
+import unittest
+from paperworks import index
+
+
+class Item:
+    def __init__(self, title, id=0, content=''):
+        self.title = title
+        self.id = id
+        self.content = content
+
+    @property
+    def loaded_content(self):
+        return self.content
+
+
+class TestTitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.titles = index.TitleIndex()
+        self.item = Item('title')
+        self.item2 = Item('title')
+        self.titles.add(self.item)
+        self.titles.add(self.item2)
+
+    def test_duplicates(self):
+        self.assertEqual(self.titles.get('title'), [self.item, self.item2])
+        self.assertTrue(self.titles.first('title') is self.item)
+
+    def test_remove(self):
+        self.titles.remove(self.item)
+        self.assertEqual(self.titles.get('title'), [self.item2])
+        self.titles.remove(self.item2)
+        self.assertEqual(self.titles.items, {})
+        self.assertIsNone(self.titles.first('title'))
+
+
+class TestSortedView(unittest.TestCase):
+    def setUp(self):
+        self.view = index.SortedView()
+        self.items = [Item(title) for title in ('b', 'd', 'a', 'c', 'b')]
+        for item in self.items:
+            self.view.add(item)
+
+    def titles(self, items):
+        return [item.title for item in items]
+
+    def test_order(self):
+        self.assertEqual(self.titles(self.view), ['a', 'b', 'b', 'c', 'd'])
+        self.assertTrue(self.view[1] is self.items[0])
+        self.assertTrue(self.view[2] is self.items[4])
+        self.assertEqual(self.titles(self.view[1:3]), ['b', 'b'])
+        self.assertEqual(len(self.view), 5)
+
+    def test_range(self):
+        self.assertEqual(self.titles(self.view.range('b', 'd')),
+                         ['b', 'b', 'c'])
+        self.assertEqual(self.titles(self.view.range(end='b')), ['a'])
+        self.assertEqual(self.titles(self.view.range('bb')), ['c', 'd'])
+
+    def test_discard_and_retitle(self):
+        item = self.items[0]
+        item.title = 'e'
+        self.view.retitle(item, 'b')
+        self.assertEqual(self.titles(self.view), ['a', 'b', 'c', 'd', 'e'])
+        self.view.discard(item)
+        self.view.discard(item)
+        self.assertFalse(item in self.view)
+        self.assertEqual(self.titles(self.view), ['a', 'b', 'c', 'd'])
+
+    def test_update(self):
+        items = [Item(str(i % 7), i) for i in range(100, 0, -1)]
+        self.view.update(items + [self.items[0]])
+        self.view.update(items[:1])
+        self.view.discard(items[1])
+        self.assertEqual(len(self.view), 104)
+        self.assertEqual([(item.title, item.id) for item in self.view],
+                         sorted((item.title, item.id) for item in
+                                self.items + items[:1] + items[2:]))
+        # Items with equal titles and ids keep their insertion order.
+        self.assertTrue(self.view.range('b', 'c')[0] is self.items[0])
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = index.Index()
+        self.note = Item('note', 1)
+        self.index.add_note(self.note)
+
+    def test_add_note(self):
+        self.assertTrue(self.index.notes[1] is self.note)
+        self.assertEqual(self.index.note_titles.get('note'), [self.note])
+
+    def test_replace_note(self):
+        replacement = Item('new note', 1)
+        self.index.add_note(replacement)
+        self.assertTrue(self.index.notes[1] is replacement)
+        self.assertEqual(self.index.note_titles.get('note'), [])
+        self.index.remove_note(self.note)
+        self.assertTrue(self.index.notes[1] is replacement)
+
+    def test_retitle(self):
+        self.note.title = 'renamed'
+        self.index.retitle(self.note, 'note')
+        self.assertEqual(self.index.note_titles.get('note'), [])
+        self.assertEqual(self.index.note_titles.get('renamed'), [self.note])
+
+
+class TestFuzzy(unittest.TestCase):
+    def setUp(self):
+        self.titles = index.TitleIndex()
+        self.shopping = Item('shopping list')
+        self.shopping2 = Item('shopping list')
+        self.meeting = Item('meeting notes')
+        for item in (self.shopping, self.shopping2, self.meeting):
+            self.titles.add(item)
+
+    def test_best_match(self):
+        score, item = self.titles.fuzzy('shoping lst')[0]
+        self.assertTrue(item is self.shopping)
+
+    def test_limit_and_cutoff(self):
+        matches = self.titles.fuzzy('shopping list', limit=3)
+        self.assertEqual([item for score, item in matches],
+                         [self.shopping, self.shopping2, self.meeting])
+        matches = self.titles.fuzzy('shopping list', limit=3, cutoff=90)
+        self.assertEqual([item for score, item in matches],
+                         [self.shopping, self.shopping2])
+
+    def test_no_shared_grams(self):
+        self.assertEqual(index.ngrams('xyz') & index.ngrams('meeting notes'),
+                         set())
+        self.assertEqual(len(self.titles.fuzzy('xyz')), 0)
+        self.assertEqual(len(self.titles.fuzzy('xyz', cutoff=0)), 1)
+
+    def test_cache_invalidation(self):
+        self.assertTrue(self.titles.fuzzy('meeting')[0][1] is self.meeting)
+        self.assertTrue(('meeting', 1, 1) in self.titles.cache)
+        meeting2 = Item('meeting')
+        self.titles.add(meeting2)
+        self.assertEqual(self.titles.cache, {})
+        self.assertTrue(self.titles.fuzzy('meeting')[0][1] is meeting2)
+
+    def test_common_grams(self):
+        self.titles.max_candidates = 2
+        common = [Item('common {}'.format(i)) for i in range(10)]
+        self.titles.update(common)
+        # Only the rarer n-grams of meeting choose candidates.
+        matches = self.titles.fuzzy('common meeting', limit=3)
+        self.assertTrue(matches[0][1] is self.meeting)
+        self.assertFalse(any(item in common for score, item in matches))
+        # The rarest n-gram is counted, however common.
+        self.assertTrue(self.titles.fuzzy('common')[0][1] in common)
+
+    def test_remove_unindexed(self):
+        item = Item('unindexed')
+        self.titles.add(item)
+        self.titles.remove(item)
+        self.titles.fuzzy('unindexed')
+        self.assertEqual(self.titles.unindexed, set())
+        self.assertFalse(any('unindexed' in titles
+                             for titles in self.titles.grams.values()))
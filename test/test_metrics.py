@@ -0,0 +1,139 @@
+import unittest
+from io import BytesIO
+from json import dumps
+from paperworks import httpcache, metrics, wrapper
+from test_data import *
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(metrics.Histogram().percentile(50), 0.0)
+
+    def test_percentiles(self):
+        histogram = metrics.Histogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000.0)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.total, 5.05)
+        self.assertEqual(histogram.max, 0.1)
+        # Buckets grow by 25 percent.
+        for percent in (50, 95, 99):
+            self.assertAlmostEqual(histogram.percentile(percent),
+                                   percent / 1000.0,
+                                   delta=percent / 4000.0)
+        self.assertEqual(histogram.percentile(100), 0.1)
+
+    def test_outlier(self):
+        histogram = metrics.Histogram()
+        histogram.add(1000)
+        self.assertGreater(histogram.percentile(99),
+                           metrics.Histogram.bounds[-1])
+        self.assertEqual(histogram.percentile(100), 1000)
+
+
+class TestMonitor(unittest.TestCase):
+    def setUp(self):
+        self.monitor = metrics.Monitor()
+
+    def test_snapshot(self):
+        self.monitor.record('GET', 'notes', 0.01, 0, 100)
+        self.monitor.record('GET', 'notes', 0.03, 0, 50, True)
+        self.monitor.record('PUT', 'note', 0.02, 20, 10)
+        snapshot = self.monitor.snapshot()
+        self.assertEqual(sorted(snapshot), ['GET notes', 'PUT note'])
+        notes = snapshot['GET notes']
+        self.assertEqual(notes['requests'], 2)
+        self.assertEqual(notes['errors'], 1)
+        self.assertEqual(notes['bytes_received'], 150)
+        self.assertAlmostEqual(notes['mean'], 0.02)
+        self.assertEqual(notes['max'], 0.03)
+        self.assertEqual(snapshot['PUT note']['bytes_sent'], 20)
+        self.monitor.reset()
+        self.assertEqual(self.monitor.snapshot(), {})
+
+    def test_hooks(self):
+        events = []
+
+        def failing(event):
+            raise ValueError('failed')
+        self.monitor.add_hook(failing)
+        self.monitor.add_hook(events.append)
+        self.monitor.record('DELETE', 'note', 0.5, error=True)
+        self.assertEqual(events, [{
+            'method': 'DELETE',
+            'keyword': 'note',
+            'duration': 0.5,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'error': True
+            }])
+        self.monitor.remove_hook(events.append)
+        self.monitor.record('DELETE', 'note', 0.5)
+        self.assertEqual(len(events), 1)
+
+
+class Response(BytesIO):
+    def info(self):
+        return {}
+
+    def getcode(self):
+        return 200
+
+
+class TestApiMetrics(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch('paperworks.wrapper.urlopen')
+        self.mocked_urlopen = self.patcher.start()
+        self.mocked_urlopen.side_effect = self.respond
+        self.events = []
+        self.api = wrapper.api(agent, hook=self.events.append)
+        self.api.set_credentials(uri, user, passwd)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def respond(self, request):
+        return Response(self.body)
+
+    def test_request(self):
+        self.body = dumps({'success': True, 'response': notes}).encode(
+            'ASCII')
+        self.assertEqual(self.api.list_notebook_notes(notebook_id), notes)
+        self.api.update_note(note)
+        snapshot = self.api.metrics()
+        self.assertEqual(snapshot['GET notes']['requests'], 1)
+        self.assertEqual(snapshot['GET notes']['bytes_received'],
+                         len(self.body))
+        self.assertEqual(snapshot['PUT note']['bytes_sent'],
+                         len(dumps(note).encode('UTF-8')))
+        self.assertEqual([event['keyword'] for event in self.events],
+                         ['notes', 'note'])
+
+    def test_stream(self):
+        self.body = dumps({'success': True, 'response': notes}).encode(
+            'ASCII')
+        self.assertEqual(list(self.api.iter_notebook_notes(notebook_id)),
+                         notes)
+        self.assertEqual(self.events[0]['bytes_received'], len(self.body))
+        self.assertFalse(self.events[0]['error'])
+
+    def test_error(self):
+        self.mocked_urlopen.side_effect = IOError('unreachable')
+        self.assertIsNone(self.api.list_notebooks())
+        snapshot = self.api.metrics()['GET notebooks']
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertEqual(snapshot['errors'], 1)
+
+    def test_cached(self):
+        self.body = dumps({'success': True, 'response': tags}).encode(
+            'ASCII')
+        self.api.cache = httpcache.ResponseCache(max_age=60)
+        self.api.list_tags()
+        self.api.list_tags()
+        # The second response is served without a request.
+        self.assertEqual(self.api.metrics()['GET tags']['requests'], 1)
@@ -1,7 +1,10 @@
 import unittest
 import tempfile
+import threading
 from json import dumps
 from paperworks import models
+from paperworks.index import Index
+from paperworks.wrapper import api as wrapper_api
 from test_data import *
 
 try:
@@ -26,7 +29,7 @@ class TestPaperwork(unittest.TestCase):
         self.api = self.pw.api
 
     def tearDown(self):
-        pass
+        self.patcher.stop()
 
     @patch('paperworks.wrapper.api.list_notebook_notes')
     @patch('paperworks.wrapper.api.list_notebooks')
@@ -41,17 +44,256 @@ class TestPaperwork(unittest.TestCase):
         self.assertTrue(mocked_list_notebooks.called)
         self.assertTrue(mocked_list_notebook_notes.called)
 
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_download_parallel(self, mocked_list_tags, mocked_list_notebooks,
+                               mocked_list_notebook_notes):
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = notebooks
+        mocked_list_notebook_notes.side_effect = lambda id: \
+            [note] if id == notebook_id else [note2]
+        self.pw.download(workers=4)
+        self.assertEqual(sorted(self.pw.notebooks), [notebook_id,
+                                                     notebook2_id])
+        self.assertEqual(list(self.pw.notebooks[notebook_id].notes),
+                         [note_id])
+        self.assertEqual(list(self.pw.notebooks[notebook2_id].notes),
+                         [note2_id])
+        self.assertEqual(sorted(self.pw.tags), [tag_id, tag2_id])
+        self.assertEqual(
+            sorted(self.pw.timings),
+            ['notebooks', 'notes', 'tags', 'total'])
+
+    @patch('paperworks.wrapper.api.iter_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_download_stream(self, mocked_list_tags, mocked_list_notebooks,
+                             mocked_iter_notebook_notes):
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = notebooks
+        mocked_iter_notebook_notes.side_effect = lambda id: \
+            iter([note] if id == notebook_id else [note2])
+        for workers in (1, 4):
+            self.pw = models.Paperwork(user, passwd, uri)
+            self.pw.download(workers, stream=True)
+            self.assertEqual(list(self.pw.notebooks[notebook_id].notes),
+                             [note_id])
+            self.assertEqual(list(self.pw.notebooks[notebook2_id].notes),
+                             [note2_id])
+
+    @patch('paperworks.wrapper.api.iter_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_download_stream_failed(self, mocked_list_tags,
+                                    mocked_list_notebooks,
+                                    mocked_iter_notebook_notes):
+        def iter_notes(id):
+            yield note if id == notebook_id else note2
+            if id == notebook_id:
+                raise ValueError('Connection lost')
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = notebooks
+        mocked_iter_notebook_notes.side_effect = iter_notes
+        for workers in (1, 4):
+            self.pw = models.Paperwork(user, passwd, uri)
+            self.pw.download(workers, stream=True)
+            failed = self.pw.notebooks[notebook_id]
+            self.assertEqual(self.pw.incomplete, [failed])
+            self.assertEqual(failed.updated_at, 0)
+            self.assertEqual(list(failed.notes), [note_id])
+
+    @patch('paperworks.wrapper.api.list_notebook_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    @patch('paperworks.wrapper.api.list_tags')
+    def test_download_malformed(self, mocked_list_tags,
+                                mocked_list_notebooks,
+                                mocked_list_notebook_notes):
+        unknown_tag = dict(note, tags=[{'id': 999, 'title': 'unknown'}])
+        mocked_list_tags.return_value = tags
+        mocked_list_notebooks.return_value = notebooks
+        mocked_list_notebook_notes.side_effect = lambda id: \
+            [unknown_tag] if id == notebook_id else [note2]
+        for workers in (1, 4):
+            self.pw = models.Paperwork(user, passwd, uri)
+            self.pw.download(workers)
+            failed = self.pw.notebooks[notebook_id]
+            self.assertEqual(self.pw.incomplete, [failed])
+            self.assertEqual(failed.updated_at, 0)
+            self.assertEqual(list(self.pw.notebooks[notebook2_id].notes),
+                             [note2_id])
+
     @patch('paperworks.models.Note.update')
     @patch('paperworks.models.Notebook.update')
     def test_update(self, mocked_update_notebook, mocked_update_note):
         parsed_notebook = models.Notebook.from_json(notebook, self.api)
         self.pw.add_notebook(parsed_notebook)
         self.pw.add_tag(models.Tag.from_json(tag, self.api))
-        parsed_notebook.add_note(models.Note.from_json(note, parsed_notebook))
+        parsed_note = models.Note.from_json(note, parsed_notebook)
+        parsed_notebook.add_note(parsed_note)
+        parsed_notebook.title = 'changed title'
+        parsed_note.content = 'changed content'
         self.pw.update()
         self.assertTrue(mocked_update_note.called)
         self.assertTrue(mocked_update_notebook.called)
 
+    @patch('paperworks.models.Note.update')
+    @patch('paperworks.models.Notebook.update')
+    def test_update_unchanged(self, mocked_update_notebook,
+                              mocked_update_note):
+        parsed_notebook = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(parsed_notebook)
+        parsed_notebook.load(notes, {tag_id: models.Tag.from_json(
+            tag, self.api), tag2_id: models.Tag.from_json(tag2, self.api)})
+        self.assertEqual(self.pw.update(), [])
+        self.assertFalse(mocked_update_note.called)
+        self.assertFalse(mocked_update_notebook.called)
+
+    @patch('paperworks.models.Note.update')
+    def test_update_dry_run(self, mocked_update_note):
+        parsed_notebook = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(parsed_notebook)
+        parsed_note = models.Note.from_json(note, parsed_notebook)
+        parsed_notebook.add_note(parsed_note)
+        parsed_note.title = 'changed title'
+        parsed_note.add_tags([models.Tag.from_json(tag, self.api)])
+        self.assertEqual(self.pw.update(dry_run=True),
+                         [(parsed_note, ['tags', 'title'])])
+        self.assertFalse(mocked_update_note.called)
+
+    @patch('paperworks.wrapper.api.update_note')
+    @patch('paperworks.wrapper.api.get_notes')
+    @patch('paperworks.wrapper.api.list_notebooks')
+    def test_reconcile(self, mocked_list_notebooks, mocked_get_notes,
+                       mocked_update_note):
+        newer_note = dict(note2, title='remote title',
+                          updated_at='2014-09-21 19:43:59')
+        mocked_list_notebooks.return_value = [
+            dict(notebook, updated_at='')]
+        mocked_get_notes.side_effect = lambda nb_id, ids: \
+            [note] if ids == [note_id] else [newer_note]
+        mocked_update_note.return_value = note
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        nb.load(notes, {tag_id: models.Tag.from_json(tag, self.api),
+                        tag2_id: models.Tag.from_json(tag2, self.api)})
+        nb.notes[note_id].content = 'changed content'
+        result = self.pw.reconcile(chunk_size=1, workers=2)
+        self.assertEqual(result, {'pushed': 1, 'pulled': 1, 'missing': 0,
+                                  'requests': 3})
+        self.assertEqual(mocked_get_notes.call_count, 2)
+        self.assertEqual(mocked_update_note.call_count, 1)
+        self.assertEqual(nb.notes[note2_id].title, 'remote title')
+        self.assertEqual(nb.notes[note_id].dirty, set())
+
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_reconcile_chunks(self, mocked_get_notes):
+        mocked_get_notes.return_value = notes
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        nb.load(notes, {tag_id: models.Tag.from_json(tag, self.api),
+                        tag2_id: models.Tag.from_json(tag2, self.api)})
+        result = self.pw.reconcile(notes=nb.get_notes())
+        mocked_get_notes.assert_called_once_with(
+            notebook_id, [note.id for note in nb.get_notes()])
+        self.assertEqual(result, {'pushed': 0, 'pulled': 0, 'missing': 0,
+                                  'requests': 1})
+
+    @patch('paperworks.wrapper.api.update_note')
+    @patch('paperworks.wrapper.api.get_notes')
+    def test_reconcile_deleted(self, mocked_get_notes, mocked_update_note):
+        # The host fails the whole request if one of the notes is gone.
+        mocked_get_notes.side_effect = lambda nb_id, ids: \
+            None if note2_id in ids else [note]
+        mocked_update_note.return_value = note
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        nb.load(notes, {tag_id: models.Tag.from_json(tag, self.api),
+                        tag2_id: models.Tag.from_json(tag2, self.api)})
+        nb.notes[note_id].content = 'changed content'
+        result = self.pw.reconcile(notes=nb.get_notes())
+        self.assertEqual(result, {'pushed': 1, 'pulled': 0, 'missing': 1,
+                                  'requests': 3})
+        self.assertEqual(mocked_update_note.call_count, 1)
+        self.assertEqual(nb.notes[note_id].dirty, set())
+
+    @patch('paperworks.models.pop_failed')
+    @patch('paperworks.models.wait')
+    def test_flush(self, mocked_wait, mocked_pop_failed):
+        mocked_pop_failed.return_value = []
+        self.assertEqual(self.pw.flush(), [])
+        mocked_wait.assert_called_with()
+
+    def test_find(self):
+        nb = models.Notebook.from_json(notebook, self.api)
+        nb2 = models.Notebook.from_json(notebook2, self.api)
+        self.pw.add_notebook(nb)
+        self.pw.add_notebook(nb2)
+        parsed_tag = models.Tag.from_json(tag, self.api)
+        self.pw.add_tag(parsed_tag)
+        n = models.Note.from_json(note, nb)
+        nb.add_note(n)
+        self.assertTrue(self.pw.find_note(note_id) is n)
+        self.assertTrue(self.pw.find_note(note_title) is n)
+        self.assertTrue(self.pw.find_tag(tag_title) is parsed_tag)
+        self.assertEqual(self.pw.find_notes(note_title), [n])
+
+        n.title = 'renamed'
+        self.assertIsNone(self.pw.find_note(note_title))
+        self.assertTrue(self.pw.find_note('renamed') is n)
+        nb.title = 'renamed notebook'
+        self.assertTrue(self.pw.find_notebook('renamed notebook') is nb)
+
+        with patch('paperworks.wrapper.api.move_note'):
+            n.move_to(nb2)
+        self.assertTrue(n.notebook is nb2)
+        self.assertTrue(self.pw.find_note(note_id) is n)
+        with patch('paperworks.wrapper.api.delete_note'):
+            n.delete()
+        self.assertIsNone(self.pw.find_note(note_id))
+        self.assertIsNone(self.pw.find_note('renamed'))
+
+        self.pw.remove_notebook(nb2)
+        self.assertIsNone(self.pw.find_notebook(notebook_title))
+
+    def test_fuzzy_find(self):
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        self.pw.add_tag(models.Tag.from_json(tag, self.api))
+        n = models.Note.from_json(note, nb)
+        nb.add_note(n)
+        self.assertTrue(self.pw.fuzzy_find_note('note titel') is n)
+        self.assertTrue(self.pw.fuzzy_find_notebook('notebok') is nb)
+        self.assertEqual(self.pw.fuzzy_find_tag('some tag').id, tag_id)
+        n.title = 'renamed'
+        self.assertTrue(self.pw.fuzzy_find_note('renamd') is n)
+
+    def test_search(self):
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        n = models.Note.from_json(note, nb)
+        nb.add_note(n)
+        n2 = models.Note.from_json(note2, nb)
+        nb.add_note(n2)
+        self.assertEqual(self.pw.search('some content'), [n, n2])
+        n2.content = 'some content, some more'
+        self.assertEqual(self.pw.search('some'), [n2, n])
+        self.assertEqual(self.pw.search('more'), [n2])
+        self.assertEqual(self.pw.search('some', limit=1), [n2])
+        with patch('paperworks.wrapper.api.delete_note'):
+            n2.delete()
+        self.assertEqual(self.pw.search('more'), [])
+
+    @patch('paperworks.wrapper.api.iter_search')
+    def test_search_remote(self, mocked_search):
+        nb = models.Notebook.from_json(notebook, self.api)
+        self.pw.add_notebook(nb)
+        n = models.Note.from_json(note, nb)
+        nb.add_note(n)
+        mocked_search.return_value = iter([{'id': str(note_id)},
+                                           {'id': '99'}])
+        self.assertEqual(self.pw.search('title', remote=True), [n])
+
     def test_get_notes(self):
         nb = models.Notebook.from_json(notebook, self.api)
         nb2 = models.Notebook.from_json(notebook2, self.api)
@@ -65,6 +307,104 @@ class TestPaperwork(unittest.TestCase):
         self.assertTrue(n in nb_notes)
         self.assertTrue(n2 in nb_notes)
 
+    def test_sorted_views(self):
+        nb = models.Notebook.from_json(notebook, self.api)
+        nb2 = models.Notebook.from_json(notebook2, self.api)
+        self.pw.add_notebook(nb)
+        self.pw.add_notebook(nb2)
+        parsed_tag = models.Tag.from_json(tag, self.api)
+        self.pw.add_tag(parsed_tag)
+        n = models.Note('a note', note_id, nb)
+        n2 = models.Note('b note', note2_id, nb)
+        nb.add_note(n2)
+        nb.add_note(n)
+        n.add_tags([parsed_tag])
+        n2.add_tags([parsed_tag])
+        self.assertEqual(nb.get_notes(), [n, n2])
+        self.assertEqual(self.pw.get_notes('b'), [n2])
+        self.assertEqual(parsed_tag.get_notes(end='b'), [n])
+
+        n.title = 'c note'
+        self.assertEqual(nb.get_notes(), [n2, n])
+        self.assertEqual(self.pw.get_notes(), [n2, n])
+        self.assertEqual(parsed_tag.get_notes(), [n2, n])
+        nb2.title = 'another notebook'
+        self.assertEqual(self.pw.get_notebooks(), [nb2, nb])
+
+        with patch('paperworks.wrapper.api.move_note'):
+            n.move_to(nb2)
+        self.assertEqual(nb.get_notes(), [n2])
+        self.assertEqual(nb2.get_notes(), [n])
+        self.assertEqual(parsed_tag.get_notes(), [n2, n])
+        with patch('paperworks.wrapper.api.delete_note'):
+            n.delete()
+        self.assertEqual(self.pw.get_notes(), [n2])
+        self.assertEqual(parsed_tag.get_notes(), [n2])
+
+
+class TestThreading(unittest.TestCase):
+    def setUp(self):
+        models.use_threading = True
+        models.max_workers = 2
+        models.queue_limit = 3
+        models.shutdown()
+        self.api = wrapper_api()
+        self.notebook = models.Notebook.from_json(notebook, self.api)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        models.wait()
+        models.use_threading = False
+        models.max_workers = 8
+        models.queue_limit = 256
+        models.shutdown()
+
+    def blocking_delete(self, *args):
+        self.release.wait(5)
+        return 'deleted'
+
+    @patch('paperworks.wrapper.api.delete_notebook')
+    def test_returns_future(self, mocked_delete):
+        mocked_delete.side_effect = self.blocking_delete
+        future = self.notebook.delete()
+        self.assertFalse(future.done())
+        self.release.set()
+        self.assertIsNone(future.result(5))
+        self.assertEqual(models.wait(5), set())
+        mocked_delete.assert_called_with(notebook_id)
+
+    @patch('paperworks.wrapper.api.delete_notebook')
+    def test_backpressure(self, mocked_delete):
+        mocked_delete.side_effect = self.blocking_delete
+        futures = [self.notebook.delete() for _ in range(3)]
+        blocked = threading.Thread(target=self.notebook.delete)
+        blocked.start()
+        blocked.join(0.1)
+        self.assertTrue(blocked.is_alive())
+        self.release.set()
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(models.wait(5), set())
+        self.assertTrue(all(future.done() for future in futures))
+
+    @patch('paperworks.wrapper.api.delete_notebook')
+    def test_failed(self, mocked_delete):
+        mocked_delete.side_effect = ValueError('failed')
+        self.notebook.delete()
+        models.wait(5)
+        errors = models.pop_failed()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], ValueError))
+        self.assertEqual(models.pop_failed(), [])
+
+    def test_synchronous(self):
+        models.use_threading = False
+        with patch('paperworks.wrapper.api.delete_notebook') as mocked:
+            future = self.notebook.delete()
+        self.assertTrue(future.done())
+        self.assertTrue(mocked.called)
+
 
 class TestModel(unittest.TestCase):
     def setUp(self):
@@ -81,7 +421,7 @@ class TestModel(unittest.TestCase):
         self.api = models.Paperwork(user, passwd, host=uri).api
 
     def tearDown(self):
-        pass
+        self.patcher.stop()
 
     def from_json_test(self, model, title, id):
         self.assertEqual(model.title, title)
@@ -211,6 +551,53 @@ class TestNote(TestModel):
             self.parsed_note.id)
         mocked_update.assert_called_with(self.parsed_note.to_json())
 
+    def test_dirty(self):
+        self.assertEqual(self.parsed_note.dirty, set())
+        self.parsed_note.content = content
+        self.assertEqual(self.parsed_note.dirty, set())
+        self.parsed_note.content = 'changed content'
+        self.assertEqual(self.parsed_note.dirty, set(['content']))
+        self.parsed_note.clean()
+        self.assertEqual(self.parsed_note.dirty, set())
+
+    def test_compact(self):
+        self.assertFalse(hasattr(self.parsed_note, '__dict__'))
+        self.assertEqual(self.parsed_note.updated_at, 1411242239)
+        self.assertTrue(self.parsed_note.api is self.notebook.api)
+        copy = models.Note.from_json(dict(note, title=''.join(note_title)),
+                                     self.notebook)
+        self.assertTrue(copy.title is self.parsed_note.title)
+        # Tag tuples are shared by the notes of a paperwork instance.
+        self.notebook.index = Index()
+        first = models.Tag.from_json(tag, self.api)
+        second = models.Tag.from_json(tag2, self.api)
+        self.parsed_note.add_tags([second, first])
+        copy.add_tags([first])
+        copy.add_tags([second])
+        self.assertEqual(self.parsed_note.tags, (first, second))
+        self.assertTrue(copy.tags is self.parsed_note.tags)
+        other = models.Notebook.from_json(notebook, self.api)
+        other.index = Index()
+        other_note = models.Note.from_json(note, other)
+        other_note.add_tags([first, second])
+        self.assertEqual(other_note.tags, copy.tags)
+        self.assertFalse(other_note.tags is copy.tags)
+
+    def test_timestamp(self):
+        self.assertEqual(models.timestamp('2014-09-20 19:43:59'), 1411242239)
+        self.assertEqual(models.timestamp('1411242239'), 1411242239)
+        self.assertEqual(models.timestamp(''), 0)
+        self.assertEqual(models.timestamp('invalid'), 0)
+
+    @patch('paperworks.wrapper.api.get_note')
+    @patch('paperworks.wrapper.api.update_note')
+    def test_update_cleans(self, mocked_update, mocked_get):
+        mocked_get.return_value = note
+        mocked_update.return_value = note
+        self.parsed_note.title = 'changed title'
+        self.parsed_note.update(force=True)
+        self.assertEqual(self.parsed_note.dirty, set())
+
     @patch('paperworks.wrapper.api.create_note')
     @patch('paperworks.wrapper.api.get_note')
     @patch('paperworks.wrapper.api.update_note')
@@ -225,7 +612,8 @@ class TestNote(TestModel):
         self.assertFalse(mocked_update.called)
         self.assertEqual(self.parsed_note.title, note['title'])
         self.assertEqual(self.parsed_note.content, note['content'])
-        self.assertEqual(self.parsed_note.updated_at, note['updated_at'])
+        self.assertEqual(self.parsed_note.updated_at,
+                         models.timestamp(note['updated_at']))
 
 
 class TestTag(TestModel):
@@ -0,0 +1,89 @@
+import unittest
+from paperworks import search
+
+
+class Notebook:
+    contents = None
+
+
+class Note:
+    notebook = Notebook()
+
+    def __init__(self, id, title, content=''):
+        self.id = id
+        self.title = title
+        self.content = content
+
+    @property
+    def loaded_content(self):
+        return self.content
+
+
+class TestParse(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('<p>Some <b>bold</b> Text</p>'),
+                         ['some', 'bold', 'text'])
+
+    def test_parse(self):
+        self.assertEqual(search.parse('one "two three" fo* five-six'),
+                         [('term', 'one'), ('phrase', ['two', 'three']),
+                          ('prefix', 'fo'), ('phrase', ['five', 'six'])])
+        self.assertEqual(search.parse('"" *'), [])
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = search.SearchIndex()
+        self.shopping = Note(1, 'Shopping', 'milk, bread and more milk')
+        self.meeting = Note(2, 'Meeting notes', '<p>bread budget</p>')
+        self.recipe = Note(3, 'Recipe', 'bake the bread with milk')
+        for note in (self.shopping, self.meeting, self.recipe):
+            self.index.add(note)
+
+    def test_retitle(self):
+        self.shopping.title = 'Groceries for the budget meeting'
+        self.shopping.content = None
+        self.index.retitle(self.shopping)
+        self.assertEqual(self.index.search('"budget meeting"'),
+                         [self.shopping])
+        self.assertEqual(self.index.search('more milk'), [self.shopping])
+        self.assertEqual(self.index.search('shopping'), [])
+        self.assertEqual(self.index.lengths[1], 10)
+        self.assertEqual(self.index.postings['milk'][1], 2)
+        unindexed = Note(4, 'New note', None)
+        self.index.retitle(unindexed)
+        self.assertEqual(self.index.search('new'), [unindexed])
+
+    def test_ranking(self):
+        self.assertEqual(self.index.search('milk'),
+                         [self.shopping, self.recipe])
+        self.assertEqual(self.index.search('milk', limit=1), [self.shopping])
+        self.assertEqual(self.index.search('bread budget'), [self.meeting])
+        self.assertEqual(self.index.search('unknown'), [])
+        self.assertEqual(self.index.search(''), [])
+
+    def test_phrase(self):
+        self.assertEqual(self.index.search('"bread with milk"'),
+                         [self.recipe])
+        self.assertEqual(self.index.search('"bread milk"'), [])
+        # Title and content are not one phrase.
+        self.assertEqual(self.index.search('"notes bread"'), [])
+        self.assertEqual(self.index.search('"meeting notes" budget'),
+                         [self.meeting])
+
+    def test_prefix(self):
+        self.assertEqual(self.index.expand('b'),
+                         ['bake', 'bread', 'budget'])
+        self.assertEqual(self.index.search('bu*'), [self.meeting])
+        self.assertEqual(self.index.search('shop*'), [self.shopping])
+
+    def test_update_and_remove(self):
+        self.shopping.content = 'eggs'
+        self.index.add(self.shopping)
+        self.assertEqual(self.index.search('milk'), [self.recipe])
+        self.assertEqual(self.index.search('egg*'), [self.shopping])
+        self.index.remove(self.recipe.id)
+        self.index.remove(self.recipe.id)
+        self.assertEqual(self.index.search('milk'), [])
+        self.assertFalse('bake' in self.index.postings)
+        self.assertEqual(len(self.index), 2)
@@ -0,0 +1,111 @@
+import unittest
+import threading
+import time
+from paperworks import emulator, singleflight, wrapper
+from test_data import *
+
+
+class TestGroup(unittest.TestCase):
+    def setUp(self):
+        self.group = singleflight.Group()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self):
+        self.calls += 1
+        self.release.wait(5)
+        return {'calls': self.calls}
+
+    def run_threads(self, count, key=('notebook', '1'), func=None):
+        results = [None] * count
+
+        def call(i):
+            try:
+                results[i] = self.group.do(key, func or self.slow)
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        while self.group.stats()['coalesced'] < count - 1:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        results = self.run_threads(4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'calls': 1}] * 4)
+        # Every caller may change its own result.
+        self.assertEqual(len(set(id(result) for result in results)), 4)
+        stats = self.group.stats()
+        self.assertEqual((stats['executed'], stats['coalesced']), (1, 3))
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(self.group.do(('notebook', '1'), self.slow),
+                         {'calls': 2})
+
+    def test_error(self):
+        def failing():
+            self.release.wait(5)
+            raise ValueError('failed')
+        results = self.run_threads(3, func=failing)
+        self.assertTrue(all(isinstance(result, ValueError)
+                            for result in results))
+        self.assertEqual(self.group.stats()['in_flight'], 0)
+
+    def test_distinct_keys(self):
+        self.release.set()
+        self.group.do(('notebook', '1'), self.slow)
+        self.group.do(('notebook', '2'), self.slow)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.group.stats()['coalesced'], 0)
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=2, notes=4), latency=0.2).start()
+        self.api = wrapper.api(agent, pool=wrapper.ConnectionPool())
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        self.notebook = self.api.list_notebooks()[0]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def concurrently(self, count, func, *args):
+        results = [None] * count
+
+        def call(i):
+            results[i] = func(*args)
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_get(self):
+        requests = self.server.requests
+        results = self.concurrently(5, self.api.get_notebook,
+                                    self.notebook['id'])
+        self.assertEqual(results, [self.notebook] * 5)
+        self.assertEqual(self.server.requests - requests, 1)
+        self.assertEqual(self.api.flights.stats()['coalesced'], 4)
+
+    def test_changes(self):
+        requests = self.server.requests
+        self.concurrently(3, self.api.update_notebook, self.notebook)
+        self.assertEqual(self.server.requests - requests, 3)
+
+    def test_disabled(self):
+        self.api = wrapper.api(agent, coalesce=False)
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        requests = self.server.requests
+        self.concurrently(3, self.api.get_notebook, self.notebook['id'])
+        self.assertEqual(self.server.requests - requests, 3)
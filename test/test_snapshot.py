@@ -0,0 +1,162 @@
+import unittest
+import tempfile
+import shutil
+import gzip
+import json
+import os
+import threading
+from paperworks import emulator, snapshot, wrapper
+from test_data import *
+
+
+def connect(server):
+    api = wrapper.api(agent, pool=wrapper.ConnectionPool())
+    api.basic_authentication(server.host, server.user, server.passwd)
+    return api
+
+
+def contents(api):
+    """Returns notebook titles with their notes' titles, contents and tag
+    titles, which a restore keeps."""
+    return sorted(
+        (nb['title'], sorted(
+            (note['title'], note['content'],
+             sorted(tag['title'] for tag in note['tags']))
+            for note in api.list_notebook_notes(nb['id'])))
+        for nb in api.list_notebooks())
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=3, notes=40, tags=4)).start()
+        self.target = emulator.Emulator(emulator.Dataset()).start()
+        self.api = connect(self.source)
+        self.target_api = connect(self.target)
+
+    def tearDown(self):
+        self.source.stop()
+        self.target.stop()
+        shutil.rmtree(self.dir)
+
+    def test_export(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        self.assertEqual(snapshot.export(self.api, path),
+                         {'tag': 4, 'notebook': 3, 'note': 40})
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]['type'], 'snapshot')
+        self.assertEqual([record['type'] for record in records[1:8]],
+                         ['tag'] * 4 + ['notebook'] * 3)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_compressed(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl.gz')
+        snapshot.export(self.api, path)
+        with gzip.open(path) as f:
+            self.assertEqual(len(f.read().splitlines()), 48)
+        self.assertEqual(snapshot.restore(self.target_api, path),
+                         {'tag': 4, 'notebook': 3, 'note': 40})
+        self.assertEqual(contents(self.target_api), contents(self.api))
+
+    def test_export_failed(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        self.source.error_rate = 1
+        self.assertIsNone(snapshot.export(self.api, path))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_replace_without_os_replace(self):
+        path = os.path.join(self.dir, 'checkpoint.json')
+        for content in ('old', 'new'):
+            with open(path + '.part', 'w') as f:
+                f.write(content)
+            replace, name = os.replace, os.name
+            del os.replace
+            os.name = 'nt'
+            try:
+                snapshot.replace(path + '.part', path)
+            finally:
+                os.replace, os.name = replace, name
+        with open(path) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.dir), ['checkpoint.json'])
+
+    def test_restore(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        snapshot.export(self.api, path)
+        self.assertEqual(
+            snapshot.restore(self.target_api, path, batch_size=7, workers=3),
+            {'tag': 4, 'notebook': 3, 'note': 40})
+        self.assertEqual(contents(self.target_api), contents(self.api))
+        # Completed restores are not repeated.
+        self.assertEqual(snapshot.restore(self.target_api, path),
+                         {'tag': 0, 'notebook': 0, 'note': 0})
+        self.assertEqual(contents(self.target_api), contents(self.api))
+
+    def test_resume(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        snapshot.export(self.api, path)
+        create_note = self.target_api.create_note
+
+        def failing(notebook_id, title, content=''):
+            if title.startswith('note 2'):
+                return None
+            return create_note(notebook_id, title, content)
+        self.target_api.create_note = failing
+        self.assertIsNone(snapshot.restore(self.target_api, path,
+                                           batch_size=10))
+        self.target_api.create_note = create_note
+        restored = snapshot.restore(self.target_api, path, batch_size=10)
+        self.assertEqual((restored['tag'], restored['notebook']), (0, 0))
+        self.assertEqual(contents(self.target_api), contents(self.api))
+
+    def test_resume_tagging(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        snapshot.export(self.api, path)
+        update_note = self.target_api.update_note
+        self.target_api.update_note = lambda json: None
+        self.assertIsNone(snapshot.restore(self.target_api, path,
+                                           batch_size=10))
+        self.target_api.update_note = update_note
+        snapshot.restore(self.target_api, path, batch_size=10)
+        # Created notes are tagged, not created again.
+        self.assertEqual(contents(self.target_api), contents(self.api))
+
+    def test_checkpoint_writes(self):
+        state = snapshot.Checkpoint(os.path.join(self.dir, 'checkpoint'))
+        state.save_interval = 60
+        for i in range(100):
+            state.created_note(i, i + 1000)
+        # Only the first created note was written at once.
+        self.assertEqual(snapshot.Checkpoint(state.path).notes, {0: 1000})
+        state.save()
+        self.assertEqual(len(snapshot.Checkpoint(state.path).notes), 100)
+
+    def test_checkpoint_concurrent(self):
+        state = snapshot.Checkpoint(os.path.join(self.dir, 'checkpoint'))
+        state.save_interval = 0
+        errors = []
+
+        def create():
+            try:
+                for i in range(200):
+                    state.created_note(i, i)
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=create)
+        thread.start()
+        for i in range(5000):
+            state.restored_record(i, {'type': 'tag', 'id': i}, {'id': i})
+            state.advance(i // 2)
+        thread.join()
+        self.assertEqual(errors, [])
+        state.save()
+        self.assertEqual(len(snapshot.Checkpoint(state.path).tags), 5000)
+
+    def test_unsupported(self):
+        path = os.path.join(self.dir, 'snapshot.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"type": "snapshot", "version": 99}\n')
+        self.assertRaises(ValueError, snapshot.restore, self.target_api,
+                          path)
@@ -0,0 +1,151 @@
+import unittest
+import tempfile
+import shutil
+import os
+from paperworks import emulator, wrapper
+from paperworks.versions import VersionStore, deltas
+from test_data import *
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def version_json(version_id, content):
+    return {'id': version_id, 'title': 'title', 'content': content,
+            'updated_at': note_updated_at}
+
+
+class TestVersionStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'versions.db')
+        self.store = VersionStore(self.path)
+        self.content = ' '.join('line {}'.format(i) for i in range(500))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_roundtrip(self):
+        version = version_json(version_id, content)
+        self.assertIsNone(self.store.get(note_id, version_id))
+        self.store.put(note_id, version)
+        self.assertEqual(self.store.get(note_id, version_id), version)
+        self.assertTrue(self.store.has(note_id, version_id))
+        self.assertFalse(self.store.has(note2_id, version_id))
+        stats = self.store.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_immutable(self):
+        self.store.put(note_id, version_json(version_id, content))
+        self.store.put(note_id, version_json(version_id, 'changed'))
+        self.assertEqual(self.store.get(note_id, version_id)['content'],
+                         content)
+
+    @unittest.skipUnless(deltas, 'needs zlib preset dictionaries')
+    def test_delta(self):
+        for i in range(5):
+            self.store.put(note_id, version_json(
+                i, self.content + ' edit {}'.format(i)))
+        # Stored out of order, next to both neighbours.
+        self.store.put(note_id, version_json(10, self.content + ' late'))
+        self.store.put(note_id, version_json(7, self.content + ' between'))
+        stats = self.store.stats()
+        self.assertEqual(stats['versions'], 7)
+        self.assertEqual(stats['deltas'], 6)
+        full = len(self.store._compress(self.content.encode('UTF-8')))
+        self.assertLess(stats['stored'], full + 6 * 100)
+        self.assertEqual(self.store.version_ids(note_id),
+                         [0, 1, 2, 3, 4, 7, 10])
+        for i in range(5):
+            self.assertEqual(self.store.get(note_id, i)['content'],
+                             self.content + ' edit {}'.format(i))
+        self.assertEqual(self.store.get(note_id, 7)['content'],
+                         self.content + ' between')
+
+    @unittest.skipUnless(deltas, 'needs zlib preset dictionaries')
+    def test_chain(self):
+        self.store.max_chain = 3
+        for i in range(7):
+            self.store.put(note_id, version_json(
+                i, self.content + ' edit {}'.format(i)))
+        # Every third version is stored in full.
+        self.assertEqual(self.store.stats()['deltas'], 4)
+        self.assertEqual(self.store.get(note_id, 6)['content'],
+                         self.content + ' edit 6')
+
+    @patch('paperworks.versions.deltas', False)
+    def test_without_deltas(self):
+        for i in range(3):
+            self.store.put(note_id, version_json(
+                i, self.content + ' edit {}'.format(i)))
+        self.assertEqual(self.store.stats()['deltas'], 0)
+        self.assertEqual(self.store.get(note_id, 1)['content'],
+                         self.content + ' edit 1')
+
+    def test_persistent(self):
+        self.store.put(note_id, version_json(version_id, content))
+        self.store.close()
+        self.store = VersionStore(self.path)
+        self.assertEqual(self.store.get(note_id, version_id)['content'],
+                         content)
+
+
+class TestVersionRequests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = VersionStore(os.path.join(self.dir, 'v.db'))
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=2, notes=6)).start()
+        self.api = wrapper.api(agent, versions=self.store)
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        self.notes = [note for nb in self.api.list_notebooks()
+                      for note in self.api.list_notebook_notes(nb['id'])]
+        for note in self.notes:
+            self.api.update_note(dict(note, content='changed'))
+
+    def tearDown(self):
+        self.server.stop()
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_get_version(self):
+        note = self.notes[0]
+        version = note['versions'][0]['id']
+        requests = self.server.requests
+        fetched = self.api.get_note_version(note, version)
+        self.assertEqual(fetched['content'], note['content'])
+        self.assertEqual(self.api.get_note_version(note, version), fetched)
+        self.assertEqual(self.server.requests - requests, 1)
+
+    def test_prefetch(self):
+        requests = self.server.requests
+        self.assertEqual(self.api.prefetch_versions(self.notes,
+                                                    chunk_size=2), 12)
+        # Listings of 3 notes in 2 notebooks, two at a time.
+        self.assertEqual(self.server.requests - requests, 4)
+        self.assertEqual(self.api.prefetch_versions(self.notes), 0)
+        requests = self.server.requests
+        for note in self.notes:
+            for version in self.store.version_ids(note['id']):
+                self.api.get_note_version(note, version)
+        self.assertEqual(self.server.requests, requests)
+
+    def test_prefetch_versions_without_content(self):
+        original = self.api.get
+
+        def without_content(keyword, *args):
+            result = original(keyword, *args)
+            if keyword == 'versions':
+                result = [[{'id': version['id']} for version in versions]
+                          for versions in result]
+            return result
+        self.api.get = without_content
+        self.assertEqual(self.api.prefetch_versions(self.notes[:2]), 4)
+        note = self.notes[0]
+        self.assertEqual(self.store.get(
+            note['id'], note['versions'][0]['id'])['content'],
+            note['content'])
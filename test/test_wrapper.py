@@ -1,11 +1,23 @@
 # License: MIT
 # Author: Nelo Wallus, http://github.com/ntnn
 import unittest
-from paperworks import wrapper
+import os
+from hashlib import md5
+from paperworks import emulator, wrapper
 from json import dumps
 import tempfile
+import threading
+import zlib
+from io import BytesIO
 from test_data import *
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
 try:
     from unittest.mock import patch
 except ImportError:
@@ -122,11 +134,16 @@ class TestRequests(unittest.TestCase):
         self.request(self.api.delete_note_attachment, 'attachment', note,
                      attachment_id)
 
-    # TODO (Nelo Wallus): Fix actual method
-    @unittest.expectedFailure
     def test_upload_attachment(self):
-        self.request(self.api.upload_attachment, 'attachments', note,
-                     attachment)
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(b'%PDF-1.4')
+            f.flush()
+            self.request(self.api.upload_attachment, 'attachments', note,
+                         f.name)
+        request = self.mocked_urlopen.call_args[0][0]
+        self.assertEqual(request.get_method(), 'POST')
+        self.assertTrue(request.get_header('Content-type').startswith(
+            'multipart/form-data; boundary='))
 
     def test_list_tags(self):
         self.request(self.api.list_tags, 'tags')
@@ -147,3 +164,316 @@ class TestRequests(unittest.TestCase):
         self.request(self.api.i18n, 'i18nkey', keyword)
 
 
+class TestStreaming(unittest.TestCase):
+    def parse(self, body, chunk_size=1):
+        return list(wrapper.iter_response(
+            BytesIO(body.encode('UTF-8')), chunk_size))
+
+    def test_items(self):
+        body = dumps({'success': True, 'response': notes})
+        self.assertEqual(self.parse(body), notes)
+        self.assertEqual(self.parse(body, 7), notes)
+        self.assertEqual(self.parse(body, 4096), notes)
+
+    def test_utf8(self):
+        body = dumps({'success': True,
+                      'response': [{'content': u'\u00fcber \u2713'}]},
+                     ensure_ascii=False)
+        self.assertEqual(self.parse(body),
+                         [{'content': u'\u00fcber \u2713'}])
+
+    def test_values(self):
+        self.assertEqual(self.parse('{"response": [12345, true], '
+                                    '"success": true}'), [12345, True])
+        self.assertEqual(self.parse('{"success": true, "response": []}'),
+                         [])
+        self.assertEqual(self.parse('{"response": {"id": 1}}'), [{'id': 1}])
+        self.assertEqual(self.parse('{}'), [])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, self.parse,
+                          '{"success": false, "response": [1]}')
+        self.assertRaises(ValueError, self.parse,
+                          '{"success": true, "response": [1, 2')
+        self.assertRaises(ValueError, self.parse, '[1]')
+
+    @patch('paperworks.wrapper.urlopen')
+    def test_stream(self, mocked_urlopen):
+        api = wrapper.api(agent)
+        api.set_credentials(uri, user, passwd)
+        mocked_urlopen.return_value = BytesIO(dumps(
+            {'success': True, 'response': notes}).encode('ASCII'))
+        self.assertEqual(list(api.iter_notebook_notes(notebook_id)), notes)
+        mocked_urlopen.return_value = BytesIO(b'{"success": false}')
+        self.assertRaises(ValueError, list,
+                          api.iter_notebook_notes(notebook_id))
+        mocked_urlopen.return_value = BytesIO(dumps(
+            {'success': True, 'response': notes}).encode('ASCII')[:-10])
+        self.assertRaises(ValueError, list,
+                          api.iter_notebook_notes(notebook_id))
+
+    @patch('paperworks.wrapper.urlopen')
+    def test_request_utf8(self, mocked_urlopen):
+        api = wrapper.api(agent)
+        api.set_credentials(uri, user, passwd)
+        mocked_urlopen.return_value = BytesIO(dumps(
+            {'success': True, 'response': u'\u00fcber'},
+            ensure_ascii=False).encode('UTF-8'))
+        self.assertEqual(api.list_notebooks(), u'\u00fcber')
+
+
+class TestCompression(unittest.TestCase):
+    body = dumps({'success': True, 'response': notes}).encode('ASCII')
+
+    def compressed(self, wbits):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+        return compressor.compress(self.body) + compressor.flush()
+
+    def test_decompress(self):
+        self.assertEqual(wrapper.decompress(
+            wrapper.gzip_compress(self.body), 'gzip'), self.body)
+        for wbits in (zlib.MAX_WBITS, -zlib.MAX_WBITS):
+            self.assertEqual(wrapper.decompress(
+                self.compressed(wbits), 'deflate'), self.body)
+        self.assertEqual(wrapper.decompress(self.body, None), self.body)
+        self.assertRaises(ValueError, wrapper.decompress, self.body, 'lzma')
+
+    def test_streaming(self):
+        for encoding, data in (('gzip', wrapper.gzip_compress(self.body)),
+                               ('deflate', self.compressed(-zlib.MAX_WBITS))):
+            response = wrapper.DecodedResponse(BytesIO(data), encoding, 1)
+            self.assertEqual(list(wrapper.iter_response(response, 3)), notes)
+
+    @patch('paperworks.wrapper.urlopen')
+    def test_compress_uploads(self, mocked_urlopen):
+        mocked_urlopen.return_value = BytesIO(self.body)
+        api = wrapper.api(agent, compress_uploads=True)
+        api.set_credentials(uri, user, passwd)
+        self.assertTrue('gzip' in api.headers['Accept-Encoding'])
+        api.compress_min_size = 10
+        api.update_note(note)
+        request = mocked_urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('Content-encoding'), 'gzip')
+        self.assertEqual(zlib.decompress(request.data, 16 + zlib.MAX_WBITS),
+                         dumps(note).encode('ASCII'))
+
+
+class Unsized:
+    def __init__(self, data):
+        """Readable of unknown length, like a pipe."""
+        self.data = BytesIO(data)
+
+    def read(self, amt=-1):
+        return self.data.read(amt)
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        self.server = emulator.Emulator(emulator.Dataset.generate(
+            notebooks=1, notes=1)).start()
+        self.api = wrapper.api(agent)
+        self.api.basic_authentication(
+            self.server.host, self.server.user, self.server.passwd)
+        self.note = self.api.list_notebook_notes(
+            self.api.list_notebooks()[0]['id'])[0]
+        self.data = os.urandom(300 * 1024)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def uploaded(self, attachment):
+        return self.server.dataset.files[attachment['id']]
+
+    def test_body(self):
+        progress = []
+        body = wrapper.MultipartBody(BytesIO(self.data), 'scan.pdf',
+                                     chunk_size=1024,
+                                     progress=lambda *args:
+                                     progress.append(args))
+        self.assertIn(b'Content-Type: application/pdf', body.head)
+        chunks = list(body)
+        self.assertEqual(max(len(chunk) for chunk in chunks), 1024)
+        self.assertEqual(len(b''.join(chunks)), body.length)
+        self.assertEqual(progress[-1], (body.length, body.length))
+        # Seekable files can be sent again.
+        self.assertEqual(b''.join(body), b''.join(chunks))
+
+    def test_upload_path(self):
+        progress = []
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(self.data)
+            f.flush()
+            attachment = self.api.upload_attachment(
+                self.note, f.name,
+                progress=lambda *args: progress.append(args))
+        self.assertEqual(attachment['filename'], os.path.basename(f.name))
+        self.assertEqual(attachment['mimetype'], 'application/pdf')
+        self.assertEqual(attachment['hash'], md5(self.data).hexdigest())
+        self.assertEqual(self.uploaded(attachment), self.data)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        self.assertEqual(
+            self.api.list_note_attachments(self.note), [attachment])
+        self.assertGreater(
+            self.api.metrics()['POST attachments']['bytes_sent'],
+            len(self.data))
+
+    def test_upload_chunked(self):
+        attachment = self.api.upload_attachment(
+            self.note, Unsized(self.data), 'scan.bin')
+        self.assertEqual(attachment['mimetype'], 'application/octet-stream')
+        self.assertEqual(self.uploaded(attachment), self.data)
+
+    def test_replay(self):
+        body = wrapper.MultipartBody(BytesIO(self.data), 'scan.pdf')
+        self.assertEqual(b''.join(body), b''.join(body))
+        body = wrapper.MultipartBody(Unsized(self.data), 'scan.pdf')
+        self.assertEqual(len(b''.join(body)), body.sent)
+        # A resent body would silently lack the file.
+        self.assertRaises(ValueError, b''.join, body)
+
+    def test_upload_pooled(self):
+        self.api.pool = wrapper.ConnectionPool()
+        for data in (BytesIO(self.data), Unsized(self.data)):
+            attachment = self.api.upload_attachment(self.note, data,
+                                                    'scan.pdf')
+            self.assertEqual(self.uploaded(attachment), self.data)
+        self.assertEqual(self.api.pool.stats()['reused'], 1)
+
+    def test_upload_concurrent(self):
+        self.api.pool = wrapper.ConnectionPool()
+        files = [BytesIO(os.urandom(1024 * i)) for i in range(1, 9)]
+        progress = {}
+        attachments = self.api.upload_attachments(
+            self.note, files, workers=4, filename='scan.pdf',
+            progress=lambda f, sent, total: progress.update({f: sent}))
+        for f, attachment in zip(files, attachments):
+            self.assertEqual(self.uploaded(attachment), f.getvalue())
+        self.assertEqual(len(progress), 8)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    drop_connection = False
+    compress = False
+    # Closes before responding, after the request was processed.
+    drop_request = False
+    received = 0
+
+    def do_GET(self):
+        body = dumps({'success': True, 'response': ret['notebooks']}).encode(
+            'ASCII')
+        self.send_response(200)
+        if self.compress and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = wrapper.gzip_compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Closes without announcing it, like a server timing out idle
+        # connections.
+        self.close_connection = self.drop_connection
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        KeepAliveHandler.received += 1
+        if self.drop_request:
+            self.close_connection = True
+            return
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        KeepAliveHandler.drop_connection = False
+        KeepAliveHandler.compress = False
+        KeepAliveHandler.drop_request = False
+        KeepAliveHandler.received = 0
+        self.server = ThreadingServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.pool = wrapper.ConnectionPool(size=2, timeout=5)
+        self.api = wrapper.api(agent, pool=self.pool)
+        self.api.basic_authentication(
+            '127.0.0.1:{}'.format(self.server.server_port), user, passwd)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['reused'], 0)
+        self.assertEqual(stats['discarded'], 1)
+
+    def test_reconnect_stale(self):
+        KeepAliveHandler.drop_connection = True
+        self.pool.clear()
+        self.pool = wrapper.ConnectionPool(size=2, timeout=5)
+        self.api.pool = self.pool
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        stats = self.pool.stats()
+        self.assertEqual(stats['stale'], 2)
+        self.assertEqual(stats['created'], 3)
+
+    def test_no_resend(self):
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        KeepAliveHandler.drop_request = True
+        # Sent completely on a reused connection, the host may have
+        # created the notebook already.
+        self.assertIsNone(self.api.create_notebook('title'))
+        self.assertEqual(KeepAliveHandler.received, 1)
+        KeepAliveHandler.drop_request = False
+        self.assertEqual(self.api.create_notebook('title'), notebooks)
+
+    def test_stream(self):
+        self.assertEqual(list(self.api.stream('notebooks')), notebooks)
+        stream = self.api.stream('notebooks')
+        self.assertEqual(next(stream), notebook)
+        stream.close()
+        # The small body was read at once, so the connection is reused.
+        stats = self.pool.stats()
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_gzip(self):
+        KeepAliveHandler.compress = True
+        self.assertEqual(self.api.list_notebooks(), notebooks)
+        self.assertEqual(list(self.api.stream('notebooks')), notebooks)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_threaded(self):
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.api.list_notebooks()))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [notebooks] * 8)
+        self.assertTrue(self.pool.stats()['idle'] <= 2)